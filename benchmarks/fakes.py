@@ -0,0 +1,252 @@
+"""Local stand-ins for the external services used by the load test: Meta Graph API, OpenAI, Cosmos and MySQL.
+
+Every fake sleeps for a latency drawn from a `LatencyModel`, so the app sees realistic waits without any network
+traffic or API spend.
+"""
+import asyncio
+import hashlib
+import random
+import sqlite3
+import time
+from collections import defaultdict, deque
+from types import SimpleNamespace
+import numpy as np
+from aiohttp import web
+
+
+class LatencyModel:
+    """Log-normal latency given as "median[:sigma]" in seconds, e.g. "0.8:0.4". A median of 0 disables it."""
+
+    def __init__(self, median, sigma=0.0):
+        self.median = median
+        self.sigma = sigma
+
+    @classmethod
+    def parse(cls, spec):
+        median, _, sigma = spec.partition(':')
+        return cls(float(median), float(sigma or 0))
+
+    def sample(self):
+        if self.median <= 0:
+            return 0.0
+        return self.median * random.lognormvariate(0, self.sigma) if self.sigma else self.median
+
+    async def wait(self):
+        delay = self.sample()
+        if delay:
+            await asyncio.sleep(delay)
+
+    def __str__(self):
+        return f"{self.median * 1000:.0f}ms" + (f" (sigma {self.sigma})" if self.sigma else "")
+
+
+def fake_embedding(text, dimensions):
+    # Ten sam tekst daje ten sam wektor, więc cache embeddingów i cache semantyczny działają jak w produkcji
+    seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+    return np.random.default_rng(seed).standard_normal(dimensions, dtype=np.float32).tolist()
+
+
+class FakeMetaGraph:
+    """aiohttp server accepting `POST /{phone_number_id}/messages` like the WhatsApp Cloud API.
+
+    For every recipient it keeps the send times of incoming webhook messages not answered yet; the first send to
+    that recipient answers all of them (coalesced messages get one reply), which gives end-to-end latencies.
+    """
+
+    def __init__(self, latency, error_rate=0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.pending = defaultdict(deque)  # recipient -> perf_counter() of webhook deliveries awaiting a reply
+        self.latencies = []
+        self.sends = 0
+        self.errors = 0
+        self.answered = asyncio.Event()
+        self.runner = None
+        self.port = None
+
+    def expect(self, recipient, sent_at):
+        self.answered.clear()
+        self.pending[str(recipient)].append(sent_at)
+
+    def outstanding(self):
+        return sum(len(queue) for queue in self.pending.values())
+
+    async def handle(self, request):
+        payload = await request.json()
+        await self.latency.wait()
+        self.sends += 1
+        if self.error_rate and random.random() < self.error_rate:
+            self.errors += 1
+            return web.json_response({"error": {"message": "Service temporarily unavailable"}}, status=503)
+
+        now = time.perf_counter()
+        queue = self.pending.get(str(payload.get('to')))
+        while queue:
+            self.latencies.append(now - queue.popleft())
+        if not self.outstanding():
+            self.answered.set()
+        return web.json_response({"messages": [{"id": f"wamid.fake{self.sends}"}]})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post('/{phone_number_id}/messages', self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{self.port}/"
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+
+class FakeOpenAI:
+    """Replaces the `AsyncOpenAI` client inside `OpenAIClient`, so retries, caching and metrics still run."""
+
+    def __init__(self, embedding_latency, chat_latency, dimensions=1536, answer_words=120, stream_deltas=40):
+        self.embedding_latency = embedding_latency
+        self.chat_latency = chat_latency
+        self.dimensions = dimensions
+        self.answer = ' '.join(['Lorem ipsum dolor sit amet.'] * max(answer_words // 5, 1))
+        self.stream_deltas = stream_deltas
+        self.embeddings = SimpleNamespace(create=self._create_embeddings)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create_completion))
+        self.calls = defaultdict(int)
+
+    async def _create_embeddings(self, model, input):
+        self.calls['embeddings'] += 1
+        await self.embedding_latency.wait()
+        return SimpleNamespace(data=[SimpleNamespace(index=i, embedding=fake_embedding(text, self.dimensions))
+                                     for i, text in enumerate(input)])
+
+    def _usage(self, messages):
+        prompt_tokens = sum(len(message['content']) for message in messages) // 4
+        return SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=len(self.answer) // 4)
+
+    async def _create_completion(self, model, messages, stream=False, **kwargs):
+        self.calls[f'chat:{model}'] += 1
+        if not stream:
+            await self.chat_latency.wait()
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=self.answer))],
+                                   usage=self._usage(messages))
+        return self._stream(messages)
+
+    async def _stream(self, messages):
+        # Całkowity czas odpowiedzi jak bez strumieniowania, rozłożony na kolejne fragmenty
+        total = self.chat_latency.sample()
+        words = self.answer.split(' ')
+        step = max(len(words) // self.stream_deltas, 1)
+        for start in range(0, len(words), step):
+            await asyncio.sleep(total / self.stream_deltas)
+            piece = ' '.join(words[start:start + step]) + ' '
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=piece))], usage=None)
+        yield SimpleNamespace(choices=[], usage=self._usage(messages))
+
+
+class FakeCosmos:
+    """Patched onto the `MongoDBClient` singleton: vector search over a synthetic corpus, no index management."""
+
+    def __init__(self, search_latency, documents=500):
+        self.search_latency = search_latency
+        words = "usługi chmurowe wsparcie IT konsulting bezpieczeństwo integracja systemów dane analityka".split()
+        rng = random.Random(0)
+        self.documents = [
+            {
+                "_id": i,
+                "title": f"Dokument {i // 10}",
+                "pageNumber": i % 10 + 1,
+                "content": ' '.join(rng.choices(words, k=200)),
+                "wordCount": 200,
+                "createdAt": i,
+            }
+            for i in range(documents)
+        ]
+        self.searches = 0
+
+    def install(self, mongodb_client):
+        async def noop(*args, **kwargs):
+            return None
+
+        mongodb_client.connect = noop
+        mongodb_client.ensure_vector_search_index = noop
+        mongodb_client.stop_index_verification = noop
+        mongodb_client.start_index_verification = lambda *args, **kwargs: None
+        mongodb_client.close = lambda: None
+        mongodb_client.vector_search = self.vector_search
+        mongodb_client.fetch_vector_documents = self.fetch_vector_documents
+
+    async def vector_search(self, query_embedding, num_results=10, **kwargs):
+        self.searches += 1
+        await self.search_latency.wait()
+        start = int(abs(query_embedding[0]) * 1000) % len(self.documents)
+        return [{**document, "similarityScore": 0.9 - 0.01 * rank}
+                for rank, document in enumerate(self.documents[start:start + int(num_results)])]
+
+    async def fetch_vector_documents(self, created_after=None, include_vector=True):
+        # Korpus jest stały - zwracamy go tylko przy pierwszym wczytaniu
+        return [] if created_after is not None else [dict(document) for document in self.documents]
+
+
+class FakeMySQL:
+    """SQLite-backed replacement for the MySQL functions in `src.database.mysql_queries`.
+
+    Only the functions that talk to MySQL are swapped; the chat history cache and the write-behind query log
+    writer in front of them stay real.
+    """
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.db = sqlite3.connect(':memory:')
+        self.db.execute("CREATE TABLE queries (whatsapp_number_id INTEGER, query TEXT, answer TEXT, created_at REAL)")
+        self.db.execute("CREATE INDEX idx_queries_number ON queries (whatsapp_number_id, created_at)")
+        self.reads = 0
+        self.rows_written = 0
+        self.generations = defaultdict(int)
+
+    def install(self, mysql_queries):
+        from src.config import CHAT_HISTORY_MAX_TURNS, CHAT_HISTORY_WINDOW_SECONDS
+
+        async def fetch_recent_queries(whatsapp_number_id):
+            self.reads += 1
+            await self.latency.wait()
+            now = time.time()
+            rows = self.db.execute(
+                "SELECT query, answer, created_at FROM queries WHERE whatsapp_number_id = ? AND created_at >= ? "
+                "ORDER BY created_at DESC LIMIT ?",
+                (whatsapp_number_id, now - CHAT_HISTORY_WINDOW_SECONDS, CHAT_HISTORY_MAX_TURNS)).fetchall()
+            history = [{"query": query, "answer": answer, "created_at": str(created_at)}
+                       for query, answer, created_at in rows]
+            return history, [int(now - created_at) for _, _, created_at in rows]
+
+        async def insert_interactions(rows):
+            await self.latency.wait()
+            self.db.executemany("INSERT INTO queries VALUES (?, ?, ?, ?)",
+                                [(row["whatsapp_number_id"], row["query"], row["answer"], row["submitted_at"])
+                                 for row in rows])
+            self.rows_written += len(rows)
+            return True
+
+        async def fetch_cache_generation(name):
+            return self.generations[name]
+
+        async def bump_cache_generation(name):
+            self.generations[name] += 1
+            return self.generations[name]
+
+        async def initialize_connection_pools():
+            await mysql_queries.query_log_writer.start()
+            return {}
+
+        async def close_connection_pools():
+            await mysql_queries.query_log_writer.close()
+
+        mysql_queries.fetch_recent_queries = fetch_recent_queries
+        mysql_queries.insert_interactions = insert_interactions
+        # semantic_cache importuje te funkcje po nazwie, więc podmieniamy je też tam
+        from src.ai import semantic_cache
+        for module in (mysql_queries, semantic_cache):
+            module.fetch_cache_generation = fetch_cache_generation
+            module.bump_cache_generation = bump_cache_generation
+        return initialize_connection_pools, close_connection_pools
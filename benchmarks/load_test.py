@@ -0,0 +1,230 @@
+"""End-to-end load test of the Quart/Hypercorn app with local stand-ins for Meta, OpenAI, Cosmos and MySQL.
+
+Recorded Meta webhook deliveries are replayed into POST /webhook at a fixed rate (open loop), and a local
+WhatsApp Graph API stand-in records when each reply arrives. No external service is contacted.
+
+Usage:
+    python -m benchmarks.load_test [--requests 500] [--rate 50] [--senders 0]
+                                   [--chat-latency 0.8:0.4] [--embedding-latency 0.15:0.3]
+                                   [--env MESSAGE_COALESCE_WINDOW=0 --env STREAMING_ENABLED=true]
+
+Latencies are "median[:sigma]" in seconds of a log-normal distribution. `--senders 0` gives every request its
+own sender; with fewer senders, consecutive messages of a sender may be coalesced into one reply.
+"""
+import argparse
+import asyncio
+import copy
+import json
+import os
+import socket
+import tempfile
+import time
+from pathlib import Path
+import aiohttp
+import numpy as np
+from benchmarks.fakes import LatencyModel, FakeMetaGraph, FakeOpenAI, FakeCosmos, FakeMySQL
+
+DEFAULT_PAYLOADS = Path(__file__).parent / 'payloads' / 'text_messages.jsonl'
+PHONE_NUMBER_ID = '106540352242922'
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def load_payloads(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def make_delivery(template, index, sender):
+    """Copy of a recorded delivery with a fresh message id, sender and timestamp."""
+    delivery = copy.deepcopy(template)
+    for entry in delivery.get('entry', []):
+        for change in entry.get('changes', []):
+            value = change.get('value', {})
+            for contact in value.get('contacts', []):
+                contact['wa_id'] = sender
+            for message in value.get('messages', []):
+                message['id'] = f'wamid.bench{index:08d}'
+                message['from'] = sender
+                message['timestamp'] = str(int(time.time()))
+    return delivery
+
+
+def percentiles(values):
+    if not values:
+        return 'n/a'
+    p50, p95, p99 = np.percentile(np.array(values) * 1000, [50, 95, 99])
+    return f'p50={p50:.0f}ms p95={p95:.0f}ms p99={p99:.0f}ms'
+
+
+def configure_environment(args, meta_endpoint, work_dir):
+    # Ustawiane przed importem aplikacji - src.config czyta zmienne środowiskowe przy imporcie
+    os.environ.update({
+        'META_ENDPOINT': meta_endpoint,
+        'PHONE_NUMBER_ID': PHONE_NUMBER_ID,
+        'ACCESS_TOKEN': 'benchmark',
+        'OPEN_AI_KEY': 'benchmark',
+        'DEDUP_BACKEND': 'local',
+        'RETRIEVAL_BACKEND': 'cosmos',
+        'EMBEDDING_CACHE_DIR': '',
+        'LOG_DIR': os.path.join(work_dir, 'logs'),
+        'LOG_LEVEL': args.log_level,
+        'QUERY_LOG_SPILL_PATH': os.path.join(work_dir, 'query_log_spill.jsonl'),
+    })
+    for assignment in args.env:
+        key, _, value = assignment.partition('=')
+        os.environ[key] = value
+
+
+class QueueSampler:
+    def __init__(self, message_queue, query_log_writer, meta):
+        self.sources = {
+            'message_queue': message_queue.depth,
+            'query_log_writer': query_log_writer.depth,
+            'awaiting_reply': meta.outstanding,
+        }
+        self.samples = {name: [] for name in self.sources}
+
+    async def run(self, interval=0.1):
+        while True:
+            for name, depth in self.sources.items():
+                self.samples[name].append(depth())
+            await asyncio.sleep(interval)
+
+    def report(self):
+        return '\n'.join(f'  {name}: max={max(values, default=0)} mean={np.mean(values) if values else 0:.1f}'
+                         for name, values in self.samples.items())
+
+
+async def wait_until_serving(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while True:
+            try:
+                async with session.get(url):
+                    return
+            except aiohttp.ClientError:
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.1)
+
+
+async def run(args):
+    meta = FakeMetaGraph(LatencyModel.parse(args.send_latency), error_rate=args.send_error_rate)
+    meta_endpoint = await meta.start()
+    work_dir = tempfile.mkdtemp(prefix='whatsapp-load-test-')
+    configure_environment(args, meta_endpoint, work_dir)
+
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+    import main
+    from src.database import mysql_queries
+    from src.metrics import REGISTRY
+    from src.tracing import STAGE_SECONDS
+
+    rag_engine = main.get_rag_engine()
+    openai = FakeOpenAI(LatencyModel.parse(args.embedding_latency), LatencyModel.parse(args.chat_latency))
+    rag_engine.openai_client.client = openai
+    cosmos = FakeCosmos(LatencyModel.parse(args.search_latency), documents=args.documents)
+    cosmos.install(rag_engine.mongodb_client)
+    mysql = FakeMySQL(LatencyModel.parse(args.mysql_latency))
+    main.initialize_connection_pools, main.close_connection_pools = mysql.install(mysql_queries)
+
+    port = free_port()
+    config = Config()
+    config.bind = [f'127.0.0.1:{port}']
+    config.accesslog = None
+    stop = asyncio.Event()
+    server = asyncio.create_task(serve(main.app, config, shutdown_trigger=stop.wait))
+    webhook_url = f'http://127.0.0.1:{port}/webhook'
+    await wait_until_serving(webhook_url)
+
+    payloads = load_payloads(args.payloads)
+    sampler = QueueSampler(main.message_queue, mysql_queries.query_log_writer, meta)
+    sampler_task = asyncio.create_task(sampler.run())
+    statuses = {}
+    webhook_latencies = []
+
+    async def deliver(session, index):
+        sender = str(48_600_000_000 + (index % args.senders if args.senders else index))
+        delivery = make_delivery(payloads[index % len(payloads)], index, sender)
+        started = time.perf_counter()
+        meta.expect(sender, started)
+        async with session.post(webhook_url, json=delivery) as response:
+            await response.read()
+            statuses[response.status] = statuses.get(response.status, 0) + 1
+        webhook_latencies.append(time.perf_counter() - started)
+
+    print(f'Replaying {args.requests} deliveries at {args.rate}/s into {webhook_url} '
+          f'(chat {LatencyModel.parse(args.chat_latency)}, embeddings {LatencyModel.parse(args.embedding_latency)})')
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        started = time.perf_counter()
+        tasks = []
+        for index in range(args.requests):
+            delay = started + index / args.rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(deliver(session, index)))
+        await asyncio.gather(*tasks)
+        sent_in = time.perf_counter() - started
+
+        try:
+            await asyncio.wait_for(meta.answered.wait(), timeout=args.timeout)
+        except asyncio.TimeoutError:
+            print(f'⚠️ {meta.outstanding()} message(s) still unanswered after {args.timeout}s')
+        finished_in = time.perf_counter() - started
+
+    sampler_task.cancel()
+    stop.set()
+    await server
+    await meta.stop()
+
+    answered = len(meta.latencies)
+    print(f'\nWebhook: {args.requests} deliveries in {sent_in:.1f}s ({args.requests / sent_in:.1f} req/s), '
+          f'statuses {statuses}, {percentiles(webhook_latencies)}')
+    print(f'End-to-end: {answered} answered in {finished_in:.1f}s ({answered / finished_in:.1f} answers/s), '
+          f'{percentiles(meta.latencies)}')
+    print(f'Queue depths:\n{sampler.report()}')
+    print('Mean stage times:')
+    for key, series in sorted(STAGE_SECONDS.values.items()):
+        count = sum(series[:-1])
+        print(f'  {key[0]}: {series[-1] / count * 1000:.1f}ms over {count}')
+    print(f'Fake calls: openai {dict(openai.calls)}, cosmos searches {cosmos.searches}, '
+          f'mysql reads {mysql.reads}, rows written {mysql.rows_written}, '
+          f'whatsapp sends {meta.sends} ({meta.errors} failed)')
+    if args.metrics:
+        from src.metrics import render
+        Path(args.metrics).write_text(render(), encoding='utf-8')
+        print(f'Metrics ({len(REGISTRY)} families) written to {args.metrics}')
+    print(f'Logs: {work_dir}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--rate', type=float, default=50, help='webhook deliveries per second')
+    parser.add_argument('--senders', type=int, default=0, help='distinct senders, 0 = one per request')
+    parser.add_argument('--payloads', default=DEFAULT_PAYLOADS, help='JSON lines of recorded Meta deliveries')
+    parser.add_argument('--chat-latency', default='0.8:0.4')
+    parser.add_argument('--embedding-latency', default='0.15:0.3')
+    parser.add_argument('--search-latency', default='0.05:0.3')
+    parser.add_argument('--mysql-latency', default='0.005:0.3')
+    parser.add_argument('--send-latency', default='0.1:0.3')
+    parser.add_argument('--send-error-rate', type=float, default=0.0, help='share of sends answered with 503')
+    parser.add_argument('--documents', type=int, default=500, help='size of the fake Cosmos corpus')
+    parser.add_argument('--timeout', type=float, default=120, help='seconds to wait for the last reply')
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--metrics', help='write the Prometheus metrics to this file at the end')
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                        help='extra configuration, e.g. MESSAGE_COALESCE_WINDOW=0')
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
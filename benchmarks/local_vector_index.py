@@ -0,0 +1,59 @@
+"""Benchmarks LocalVectorIndex.search against a synthetic corpus.
+
+Usage: python -m benchmarks.local_vector_index [--documents 5000] [--dimensions 1536] [--queries 200]
+"""
+import argparse
+import asyncio
+import time
+import numpy as np
+from src.database.local_vector_index import LocalVectorIndex
+
+
+class SyntheticMongoDBClient:
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    async def fetch_vector_documents(self, created_after=None):
+        return [
+            {"_id": i, "vector": vector, "content": f"chunk {i}", "title": "Synthetic", "pageNumber": i,
+             "createdAt": i}
+            for i, vector in enumerate(self.vectors)
+        ]
+
+
+async def run(documents, dimensions, queries, k):
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((documents, dimensions), dtype=np.float32)
+    index = LocalVectorIndex(SyntheticMongoDBClient(vectors), refresh_interval=0)
+
+    started = time.perf_counter()
+    await index.refresh()
+    load_ms = (time.perf_counter() - started) * 1000
+
+    query_vectors = rng.standard_normal((queries, dimensions), dtype=np.float32).tolist()
+    index.search(query_vectors[0], k)  # warm-up
+    timings = []
+    for query in query_vectors:
+        started = time.perf_counter()
+        index.search(query, k)
+        timings.append((time.perf_counter() - started) * 1000)
+
+    timings = np.array(timings)
+    print(f"documents={documents} dimensions={dimensions} k={k} queries={queries}")
+    print(f"load: {load_ms:.1f} ms, matrix: {index.matrix.nbytes / 2 ** 20:.1f} MiB allocated")
+    print(f"search p50={np.percentile(timings, 50):.3f} ms p95={np.percentile(timings, 95):.3f} ms "
+          f"p99={np.percentile(timings, 99):.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--documents", type=int, default=5000)
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=10)
+    args = parser.parse_args()
+    asyncio.run(run(args.documents, args.dimensions, args.queries, args.k))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,33 +1,48 @@
-import asyncio
 from quart import Quart
 from hypercorn.config import Config
-from hypercorn.asyncio import serve
-from src.api.webhook import webhook_bp
-from src.config import PORT
+from hypercorn.run import run as run_hypercorn
+from src.api.webhook import webhook_bp, message_queue, get_rag_engine
+from src.api.admin import admin_bp
+from src.api.metrics import metrics_bp, start_metrics_export, stop_metrics_export
+from src.config import PORT, WORKERS
 from src.logger import main_logger
 from src.database.mysql_queries import initialize_connection_pools, close_connection_pools
+from src.whatsapp.whatsapp_client import WhatsAppClient
 
 app = Quart(__name__)
 app.register_blueprint(webhook_bp)
+app.register_blueprint(admin_bp)
+app.register_blueprint(metrics_bp)
 
 
 @app.before_serving
 async def before_serving():
     await initialize_connection_pools()
+    await WhatsAppClient.start()
+    await get_rag_engine().start()
+    await message_queue.start()
+    await start_metrics_export()
 
 
 @app.after_serving
 async def after_serving():
+    await stop_metrics_export()
+    await message_queue.drain()
+    await get_rag_engine().close()
+    await WhatsAppClient.close()
     await close_connection_pools()
 
 
-async def run_quart():
+def run():
+    """Serves the app with WORKERS Hypercorn processes; each worker imports `main:app` and builds its own
+    RAGEngine, connection pools and message queue in before_serving."""
     config = Config()
+    config.application_path = "main:app"
     config.bind = [f"0.0.0.0:{PORT}"]
-    await serve(app, config)
+    config.workers = WORKERS
+    main_logger.info(f"Starting the application with {WORKERS} worker(s)")
+    run_hypercorn(config)
 
 
-async def main(): # TODO delete
-    main_logger.info("Starting the application")
-    quart_task = asyncio.create_task(run_quart())
-    await asyncio.gather(quart_task)
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,230 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from src.logger import openai_logger as logger
+from src.file_lock import try_lock_file
+from src.metrics import CacheMetrics
+from src.config import EMBEDDING_CACHE_MAX_SIZE, EMBEDDING_CACHE_DIR, EMBEDDING_CACHE_DISK_CAPACITY
+
+
+class DiskEmbeddingStore:
+    """Persistent embedding tier: a memory-mapped float32 matrix plus an append-only index log.
+
+    `vectors.f32` holds `capacity` rows; `index.log` records `<key> <row>` lines and is replayed on start-up
+    (the last line for a row wins). Rows are reused round-robin once the file is full. `get` runs on the event
+    loop and `put_many` in a worker thread, so both take `lock`.
+    """
+
+    def __init__(self, directory, capacity, dimensions):
+        self.directory = directory
+        self.capacity = capacity
+        self.dimensions = dimensions
+        self.rows = {}  # key -> row
+        self.keys = {}  # row -> key
+        self.next_row = 0
+        self.lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        meta_path = os.path.join(directory, 'meta.json')
+        vectors_path = os.path.join(directory, 'vectors.f32')
+        self.index_path = os.path.join(directory, 'index.log')
+
+        meta = {'capacity': capacity, 'dimensions': dimensions}
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                if json.load(f) != meta:
+                    logger.warning(f"⚠️ Embedding cache layout changed, discarding {directory}")
+                    for path in (vectors_path, self.index_path):
+                        if os.path.exists(path):
+                            os.remove(path)
+        with open(meta_path, 'w') as f:
+            json.dump(meta, f)
+
+        mode = 'r+' if os.path.exists(vectors_path) else 'w+'
+        self.vectors = np.memmap(vectors_path, dtype=np.float32, mode=mode, shape=(capacity, dimensions))
+        self._load_index()
+        self.index_file = open(self.index_path, 'a')
+
+    @staticmethod
+    def stored_dimensions(directory):
+        meta_path = os.path.join(directory, 'meta.json')
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path) as f:
+            return json.load(f).get('dimensions')
+
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path) as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) != 2:
+                    continue
+                self._assign(parts[0], int(parts[1]))
+                self.next_row = (int(parts[1]) + 1) % self.capacity
+
+        # Kompaktujemy log, żeby nie rósł w nieskończoność
+        with open(self.index_path, 'w') as f:
+            for key, row in self.rows.items():
+                f.write(f"{key} {row}\n")
+        logger.info(f"💾 Loaded {len(self.rows)} embeddings from disk cache")
+
+    def _assign(self, key, row):
+        previous_key = self.keys.get(row)
+        if previous_key is not None:
+            self.rows.pop(previous_key, None)
+        self.rows[key] = row
+        self.keys[row] = key
+
+    def get(self, key):
+        with self.lock:
+            row = self.rows.get(key)
+            return None if row is None else np.array(self.vectors[row])
+
+    def put_many(self, items):
+        """Stores (key, vector) pairs and appends them to the index log in one write."""
+        lines = []
+        with self.lock:
+            for key, vector in items:
+                if key in self.rows or vector.shape[0] != self.dimensions:
+                    continue
+                row = self.next_row
+                self.next_row = (row + 1) % self.capacity
+                self.vectors[row] = vector
+                self._assign(key, row)
+                lines.append(f"{key} {row}\n")
+        if lines:
+            self.index_file.write(''.join(lines))
+            self.index_file.flush()
+
+    def close(self):
+        self.vectors.flush()
+        self.index_file.close()
+
+
+class EmbeddingCache:
+    """Exact-match embedding cache keyed by a SHA-256 of the model name and input text.
+
+    The in-memory tier is an LRU bounded by `max_size` entries. When `directory` is set, embeddings are also
+    written to a `DiskEmbeddingStore` so they survive restarts. Disk writes are batched and done by a background
+    task in a worker thread, off the request path. The store is not safe for concurrent writers, so only the
+    first process to lock the directory uses it; other workers stay memory-only.
+    """
+
+    def __init__(self, model, max_size=EMBEDDING_CACHE_MAX_SIZE, directory=EMBEDDING_CACHE_DIR,
+                 disk_capacity=EMBEDDING_CACHE_DISK_CAPACITY):
+        self.model = model
+        self.max_size = max_size
+        self.directory = directory
+        self.disk_capacity = disk_capacity
+        self.memory = OrderedDict()  # key -> np.float32 vector
+        self.disk = None
+        self.disk_pending = []  # (key, vector) waiting for the background disk write
+        self.disk_task = None
+        self.lookups = CacheMetrics('embedding')
+        self.lock_file = None
+
+        if directory and disk_capacity > 0:
+            self.lock_file = try_lock_file(os.path.join(directory, 'lock'))
+            if self.lock_file is None:
+                logger.info(f"🔒 Embedding cache {directory} is used by another worker, keeping embeddings in memory only")
+                self.directory = directory = None
+
+        # Jeśli na dysku jest cache z poprzedniego uruchomienia, otwieramy go od razu
+        if directory and disk_capacity > 0:
+            dimensions = DiskEmbeddingStore.stored_dimensions(directory)
+            if dimensions:
+                self.disk = DiskEmbeddingStore(directory, disk_capacity, dimensions)
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model}\n{text}".encode('utf-8')).hexdigest()
+
+    def _get(self, key):
+        vector = self.memory.get(key)
+        if vector is not None:
+            self.memory.move_to_end(key)
+            return vector
+        if self.disk is not None:
+            vector = self.disk.get(key)
+            if vector is not None:
+                self._remember(key, vector)
+        return vector
+
+    def _remember(self, key, vector):
+        if self.max_size <= 0:
+            return
+        self.memory[key] = vector
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_size:
+            self.memory.popitem(last=False)
+
+    def _put(self, key, embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        self._remember(key, vector)
+        if self.directory and self.disk_capacity > 0:
+            self.disk_pending.append((key, vector))
+
+    def _schedule_disk_write(self):
+        if self.disk_pending and (self.disk_task is None or self.disk_task.done()):
+            self.disk_task = asyncio.create_task(self._write_disk())
+
+    async def _write_disk(self):
+        # Memmap i log indeksu zapisujemy w osobnym wątku, poza pętlą zdarzeń
+        while self.disk_pending:
+            batch, self.disk_pending = self.disk_pending, []
+            try:
+                await asyncio.to_thread(self._write_disk_batch, batch)
+            except Exception as e:
+                logger.error(f"❌ Could not write {len(batch)} embedding(s) to the disk cache: {e}")
+
+    def _write_disk_batch(self, batch):
+        if self.disk is None:
+            self.disk = DiskEmbeddingStore(self.directory, self.disk_capacity, batch[0][1].shape[0])
+        self.disk.put_many(batch)
+
+    async def get_many(self, texts, fetch_misses):
+        """Returns embeddings for `texts`, calling `fetch_misses(list_of_texts)` once for all cache misses."""
+        keys = [self.key(text) for text in texts]
+        found = {}
+        missing = {}  # key -> text, deduplicated and in order
+        for key, text in zip(keys, texts):
+            if key in found or key in missing:
+                continue
+            vector = self._get(key)
+            if vector is None:
+                missing[key] = text
+            else:
+                found[key] = vector
+
+        self.lookups.hit(len(texts) - len(missing))
+        self.lookups.miss(len(missing))
+
+        if missing:
+            embeddings = await fetch_misses(list(missing.values()))
+            for key, embedding in zip(missing.keys(), embeddings):
+                self._put(key, embedding)
+                found[key] = embedding
+            self._schedule_disk_write()
+
+        return [found[key].tolist() if isinstance(found[key], np.ndarray) else found[key] for key in keys]
+
+    async def close(self):
+        """Writes pending embeddings to disk and closes the store."""
+        if self.disk_task is not None:
+            await asyncio.gather(self.disk_task, return_exceptions=True)
+            self.disk_task = None
+        await self._write_disk()
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.close)
+            self.disk = None
+        if self.lock_file is not None:
+            self.lock_file.close()
+            self.lock_file = None
+
+    def stats(self) -> dict:
+        return {**self.lookups.stats(len(self.memory)), 'disk_size': len(self.disk.rows) if self.disk else 0}
@@ -0,0 +1,142 @@
+import asyncio
+import re
+import time
+from dataclasses import dataclass
+from src.logger import openai_logger
+from src.metrics import Counter, Histogram
+from src.ai.openai_client import CHAT_COMPLETION_ERROR
+from src.circuit_breaker import CircuitOpenError
+from src.config import CHAT_MODEL, CHAT_MODEL_SMALL, MODEL_ROUTING_ENABLED, ROUTER_SMALL_MAX_WORDS
+
+ROUTED_QUERIES = Counter('model_router_queries_total', 'Queries by routing tier and intent', ('tier', 'intent'))
+TIER_LATENCY = Histogram('model_router_completion_seconds', 'Chat completion latency by routing tier', ('tier',))
+FALLBACKS = Counter('model_router_fallbacks_total', 'Completions retried on the large model', ('tier',))
+
+TIER_CANNED = 'canned'
+TIER_SMALL = 'small'
+TIER_LARGE = 'large'
+
+# (intent, wzorzec całej wiadomości, odpowiedź) - wiadomości, na które odpowiadamy bez modelu i bez wyszukiwania
+CANNED_INTENTS = [
+    ('greeting', re.compile(r"(cześć|czesc|hej|siema|witam|dzień dobry|dzien dobry|dobry wieczór|elo)"),
+     "Cześć! 👋 W czym mogę pomóc?"),
+    ('greeting', re.compile(r"(hi|hello|hey|good (morning|afternoon|evening))( there)?"),
+     "Hi! 👋 How can I help you?"),
+    ('thanks', re.compile(r"(dzięki|dzieki|dziękuję|dziekuje|dziękuje|thx|dzięki wielkie|super,? dzięki)"),
+     "Nie ma sprawy! Daj znać, jeśli będziesz mieć jeszcze pytania. 🙂"),
+    ('thanks', re.compile(r"(thanks|thank you|thank you very much|thanks a lot)"),
+     "You're welcome! Let me know if you have any other questions. 🙂"),
+    ('goodbye', re.compile(r"(pa|do widzenia|na razie|do zobaczenia)"),
+     "Do usłyszenia! 👋"),
+    ('goodbye', re.compile(r"(bye|goodbye|see you)"),
+     "Goodbye! 👋"),
+    ('acknowledgement', re.compile(r"(ok|okej|okay|jasne|rozumiem|dobrze|super|spoko|great|got it|cool)"),
+     "👍"),
+]
+
+# "ok", "jasne", "dzięki" w trakcie rozmowy mogą odpowiadać na pytanie bota - wtedy odpowiada model z historią
+HISTORY_SENSITIVE_INTENTS = {'thanks', 'acknowledgement'}
+
+# Rozmowa towarzyska - odpowiada mały model, bez kontekstu z bazy wiedzy
+SMALL_TALK = re.compile(r"(jak się masz|co słychać|kim jesteś|jak masz na imię|how are you|who are you|"
+                        r"what('s| is) your name)")
+
+# Pytania wymagające rozumowania zostają na dużym modelu, niezależnie od długości
+COMPLEX_MARKERS = re.compile(r"\b(dlaczego|porównaj|porównanie|różnic\w*|wyjaśnij|przeanalizuj|zaplanuj|"
+                             r"why|compare|comparison|difference\w*|explain|analy[sz]e|step by step|"
+                             r"krok po kroku)\b")
+
+
+def normalize(text):
+    text = re.sub(r"[^\w\s']", " ", (text or '').lower())
+    return ' '.join(text.split())
+
+
+@dataclass
+class Route:
+    tier: str
+    intent: str
+    model: str | None
+    retrieval: bool = True
+    reply: str | None = None
+
+
+class ModelRouter:
+    """Picks a model tier for each query with local heuristics, before any API call is made.
+
+    Greetings, thanks and similar messages get a canned reply without retrieval or a completion call (thanks and
+    acknowledgements only when there is no chat history, since they may answer the bot's own question); small
+    talk goes to the small model without retrieval; questions of at most `small_max_words` words (0 by default,
+    i.e. none) without reasoning markers go to the small model; everything else goes to `large_model`. A failed
+    small-model completion is retried on the large one; an open circuit or a timeout of the large model is raised
+    to the caller.
+    """
+
+    def __init__(self, openai_client, small_model=CHAT_MODEL_SMALL, large_model=CHAT_MODEL,
+                 small_max_words=ROUTER_SMALL_MAX_WORDS, enabled=MODEL_ROUTING_ENABLED):
+        self.openai_client = openai_client
+        self.small_model = small_model
+        self.large_model = large_model
+        self.small_max_words = small_max_words
+        self.enabled = enabled
+
+    def route(self, question, chat_history=None) -> Route:
+        if not self.enabled:
+            route = Route(TIER_LARGE, 'question', self.large_model)
+        else:
+            route = self._classify(normalize(question), question, bool(chat_history))
+        ROUTED_QUERIES.inc(tier=route.tier, intent=route.intent)
+        openai_logger.info(f"🧭 Routed query to {route.tier} tier ({route.intent}, {route.model or 'no model'})")
+        return route
+
+    def _classify(self, text, question, has_history=False) -> Route:
+        for intent, pattern, reply in CANNED_INTENTS:
+            if has_history and intent in HISTORY_SENSITIVE_INTENTS:
+                continue
+            if pattern.fullmatch(text):
+                return Route(TIER_CANNED, intent, None, retrieval=False, reply=reply)
+        if SMALL_TALK.fullmatch(text):
+            return Route(TIER_SMALL, 'small_talk', self.small_model, retrieval=False)
+        if (len(text.split()) <= self.small_max_words and question.count('?') <= 1
+                and not COMPLEX_MARKERS.search(text)):
+            return Route(TIER_SMALL, 'simple_question', self.small_model)
+        return Route(TIER_LARGE, 'question', self.large_model)
+
+    async def complete(self, route, messages):
+        started = time.perf_counter()
+        try:
+            response = await self.openai_client.generate_chat_completion(messages, model=route.model)
+        except (CircuitOpenError, asyncio.TimeoutError):
+            if route.model == self.large_model:
+                raise
+            response = CHAT_COMPLETION_ERROR
+        if response == CHAT_COMPLETION_ERROR and route.model != self.large_model:
+            openai_logger.warning(f"⚠️ {route.model} failed, falling back to {self.large_model}")
+            FALLBACKS.inc(tier=route.tier)
+            response = await self.openai_client.generate_chat_completion(messages, model=self.large_model)
+        TIER_LATENCY.observe(time.perf_counter() - started, tier=route.tier)
+        return response
+
+    async def stream(self, route, messages):
+        started = time.perf_counter()
+        first = True
+        fallback = False
+        try:
+            async for delta in self.openai_client.stream_chat_completion(messages, model=route.model):
+                # Błąd przed pierwszym fragmentem - nic jeszcze nie wysłaliśmy, więc można przełączyć model
+                if first and delta == CHAT_COMPLETION_ERROR and route.model != self.large_model:
+                    fallback = True
+                    break
+                first = False
+                yield delta
+        except (CircuitOpenError, asyncio.TimeoutError):
+            # Rzucane tylko przed pierwszym fragmentem (później strumień kończy się ChatStreamInterrupted)
+            if route.model == self.large_model:
+                raise
+            fallback = True
+        if fallback:
+            openai_logger.warning(f"⚠️ {route.model} stream failed, falling back to {self.large_model}")
+            FALLBACKS.inc(tier=route.tier)
+            async for delta in self.openai_client.stream_chat_completion(messages, model=self.large_model):
+                yield delta
+        TIER_LATENCY.observe(time.perf_counter() - started, tier=route.tier)
@@ -1,36 +1,179 @@
-from openai import OpenAI
-from tenacity import retry, wait_random_exponential, stop_after_attempt
-# import logging
-from src.config import OPENAI_API_KEY
+import asyncio
+import time
+from openai import AsyncOpenAI
+from tenacity import retry, wait_random_exponential, stop_after_attempt, retry_if_not_exception_type
+from src.config import OPENAI_API_KEY, EMBEDDING_MODEL, CHAT_MODEL, EMBEDDING_TIMEOUT, EMBEDDING_MAX_ATTEMPTS, \
+    EMBEDDING_HEDGE_DELAY, CHAT_COMPLETION_TIMEOUT, CHAT_STREAM_IDLE_TIMEOUT
+from src.circuit_breaker import CircuitBreaker, CircuitOpenError, hedged
+from src.ai.embedding_cache import EmbeddingCache
 from src.logger import openai_logger as logger
+from src.metrics import Counter, Histogram
+
+CHAT_COMPLETION_ERROR = "An error occurred while generating the response."
+
+
+class ChatStreamInterrupted(Exception):
+    """Raised by `stream_chat_completion` when the stream fails after part of the answer was already yielded."""
+
+
+# Cennik w USD za milion tokenów (wejście, wyjście) - modele spoza listy liczone są jako 0
+MODEL_PRICES = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+}
+
+CHAT_TOKENS = Counter('chat_completion_tokens_total', 'Tokens used by chat completions', ('model', 'kind'))
+CHAT_COST = Counter('chat_completion_cost_usd_total', 'Estimated chat completion spend in USD', ('model',))
+REQUEST_SECONDS = Histogram('openai_request_seconds', 'OpenAI API call latency', ('operation', 'model'))
+REQUEST_ERRORS = Counter('openai_request_errors_total', 'Failed OpenAI API calls', ('operation', 'model'))
+RETRIES = Counter('openai_retries_total', 'Retried OpenAI API calls', ('operation',))
+
+embeddings_breaker = CircuitBreaker('embeddings')
+# Osobny breaker dla każdego modelu - awaria gpt-4o-mini nie może blokować przejścia routera na CHAT_MODEL
+chat_breakers = {}
+
+
+def chat_breaker(model) -> CircuitBreaker:
+    if model not in chat_breakers:
+        chat_breakers[model] = CircuitBreaker(f'chat:{model}')
+    return chat_breakers[model]
+
+
+def record_usage(model, usage):
+    if usage is None:
+        return
+    CHAT_TOKENS.inc(usage.prompt_tokens, model=model, kind='prompt')
+    CHAT_TOKENS.inc(usage.completion_tokens, model=model, kind='completion')
+    input_price, output_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    CHAT_COST.inc((usage.prompt_tokens * input_price + usage.completion_tokens * output_price) / 1_000_000,
+                  model=model)
 
 
 class OpenAIClient:
     def __init__(self):
-        self.client = OpenAI(api_key=OPENAI_API_KEY)
+        self.client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+        self.embedding_cache = EmbeddingCache(model=EMBEDDING_MODEL)
         logger.info("OpenAI client initialized")
 
-    @retry(wait=wait_random_exponential(min=1, max=20), stop=stop_after_attempt(3))
-    def generate_embeddings(self, text: str):
+    async def generate_embeddings(self, text: str):
+        embeddings = await self.generate_embeddings_batch([text])
+        return embeddings[0]
+
+    async def generate_embeddings_batch(self, texts: list[str], use_cache=True):
+        if not use_cache:
+            # Ingestia bazy wiedzy - jednorazowe teksty nie powinny wypychać z cache zapytań użytkowników
+            return await self._create_embeddings(texts)
+        # Z API pobieramy tylko te teksty, których nie ma w cache, jednym zapytaniem
+        return await self.embedding_cache.get_many(texts, self._create_query_embeddings)
+
+    @retry(wait=wait_random_exponential(min=1, max=20), stop=stop_after_attempt(3), reraise=True,
+           before_sleep=lambda retry_state: RETRIES.inc(operation='embeddings'))
+    async def _create_embeddings(self, texts: list[str]):
+        return await self._request_embeddings(texts)
+
+    @retry(wait=wait_random_exponential(min=0.1, max=1), stop=stop_after_attempt(EMBEDDING_MAX_ATTEMPTS),
+           retry=retry_if_not_exception_type(CircuitOpenError), reraise=True,
+           before_sleep=lambda retry_state: RETRIES.inc(operation='embeddings'))
+    async def _create_query_embeddings(self, texts: list[str]):
+        """Embeddings for a user's query: bounded by EMBEDDING_TIMEOUT per attempt, optionally hedged, and
+        failing fast while the embeddings circuit is open. Ingestion keeps the patient `_create_embeddings`."""
+        return await embeddings_breaker.call(
+            lambda: hedged('embeddings', lambda: self._request_embeddings(texts), EMBEDDING_HEDGE_DELAY),
+            timeout=EMBEDDING_TIMEOUT)
+
+    async def _request_embeddings(self, texts: list[str]):
+        started = time.perf_counter()
         try:
-            response = self.client.embeddings.create(
-                model="text-embedding-ada-002",
-                input=text
+            response = await self.client.embeddings.create(
+                model=EMBEDDING_MODEL,
+                input=texts
             )
-            logger.info("Embeddings generated successfully")
-            return response.data[0].embedding
+            logger.info(f"Embeddings generated successfully for {len(texts)} text(s)")
+            return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
         except Exception as e:
+            REQUEST_ERRORS.inc(operation='embeddings', model=EMBEDDING_MODEL)
             logger.error(f"Error generating embeddings: {e}")
             raise
+        finally:
+            REQUEST_SECONDS.observe(time.perf_counter() - started, operation='embeddings', model=EMBEDDING_MODEL)
+
+    async def generate_chat_completion(self, messages, model=CHAT_MODEL):
+        """Returns the completion text, or CHAT_COMPLETION_ERROR if the API call failed.
 
-    def generate_chat_completion(self, messages):
+        Raises CircuitOpenError while the model's circuit is open and asyncio.TimeoutError after
+        CHAT_COMPLETION_TIMEOUT, so the caller can fall back to another model or send a degraded reply."""
+        started = time.perf_counter()
         try:
-            completion = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=messages
-            )
-            logger.info("Chat completion generated successfully")
+            completion = await chat_breaker(model).call(
+                lambda: self.client.chat.completions.create(model=model, messages=messages),
+                timeout=CHAT_COMPLETION_TIMEOUT)
+            record_usage(model, completion.usage)
+            logger.info(f"Chat completion generated successfully ({model})")
             return completion.choices[0].message.content
+        except CircuitOpenError as e:
+            logger.warning(f"⚡ Skipping ChatCompletion ({model}): {e}")
+            raise
+        except asyncio.TimeoutError:
+            REQUEST_ERRORS.inc(operation='chat', model=model)
+            logger.error(f"⏱️ OpenAI ChatCompletion ({model}) timed out after {CHAT_COMPLETION_TIMEOUT}s")
+            raise
+        except Exception as e:
+            REQUEST_ERRORS.inc(operation='chat', model=model)
+            logger.error(f"Error with OpenAI ChatCompletion: {e!r}")
+            return CHAT_COMPLETION_ERROR
+        finally:
+            REQUEST_SECONDS.observe(time.perf_counter() - started, operation='chat', model=model)
+
+    async def stream_chat_completion(self, messages, model=CHAT_MODEL):
+        """Yields the completion as text deltas. On failure yields CHAT_COMPLETION_ERROR if nothing was sent yet,
+        otherwise raises ChatStreamInterrupted - the text yielded so far is truncated and must not be used as an answer.
+
+        The stream counts towards the model's circuit breaker; it fails if no chunk arrives for
+        CHAT_STREAM_IDLE_TIMEOUT. An open circuit (CircuitOpenError) or a timeout before the first delta
+        (asyncio.TimeoutError) is raised, like in `generate_chat_completion`.
+        """
+        produced = False
+        started = time.perf_counter()
+        breaker = chat_breaker(model)
+        try:
+            breaker.check()
+        except CircuitOpenError as e:
+            logger.warning(f"⚡ Skipping ChatCompletion stream ({model}): {e}")
+            raise
+        try:
+            stream = await asyncio.wait_for(self.client.chat.completions.create(
+                model=model,
+                messages=messages,
+                stream=True,
+                stream_options={"include_usage": True}
+            ), CHAT_STREAM_IDLE_TIMEOUT)
+            chunks = aiter(stream)
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(anext(chunks), CHAT_STREAM_IDLE_TIMEOUT)
+                except StopAsyncIteration:
+                    break
+                if chunk.usage is not None:
+                    record_usage(model, chunk.usage)  # ostatni fragment strumienia, bez choices
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if not produced:
+                        REQUEST_SECONDS.observe(time.perf_counter() - started, operation='chat_first_token',
+                                                model=model)
+                    produced = True
+                    yield delta
+            breaker.record_success()
+            logger.info(f"Chat completion stream finished successfully ({model})")
         except Exception as e:
-            logger.error(f"Error with OpenAI ChatCompletion: {e}")
-            return "An error occurred while generating the response."
+            breaker.record_failure()
+            REQUEST_ERRORS.inc(operation='chat_stream', model=model)
+            logger.error(f"Error with OpenAI ChatCompletion stream: {e!r}")
+            if produced:
+                raise ChatStreamInterrupted(repr(e)) from e
+            if isinstance(e, asyncio.TimeoutError):
+                raise
+            yield CHAT_COMPLETION_ERROR
+        finally:
+            REQUEST_SECONDS.observe(time.perf_counter() - started, operation='chat_stream', model=model)
@@ -0,0 +1,166 @@
+import hashlib
+from datetime import datetime
+from src.logger import main_logger, openai_logger
+from src.metrics import Histogram
+from src.config import CHAT_MODEL, PROMPT_CONTEXT_TOKEN_BUDGET, PROMPT_HISTORY_TOKEN_BUDGET, PROMPT_SCORE_MARGIN
+
+PROMPT_TOKENS = Histogram('prompt_tokens', 'Prompt size of chat completion requests in tokens', ('part',),
+                          buckets=(250, 500, 1000, 2000, 4000, 8000, 16000, 32000))
+
+# Narzut formatu czatu OpenAI: ~3 tokeny na wiadomość i 3 na początek odpowiedzi
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+_encoding = None
+
+
+def load_encoding() -> bool:
+    """Loads the tiktoken encoding of CHAT_MODEL. Blocking - tiktoken downloads the BPE file on first use - so
+    call it via `asyncio.to_thread` (RAGEngine.start does). Returns False if it could not be loaded."""
+    global _encoding
+    if _encoding is not None:
+        return True
+    try:
+        import tiktoken
+        _encoding = tiktoken.encoding_for_model(CHAT_MODEL)
+    except Exception as e:
+        openai_logger.warning(f"⚠️ Could not load tiktoken encoding for {CHAT_MODEL}, estimating tokens: {e}")
+        return False
+    openai_logger.info(f"🔤 Loaded tiktoken encoding {_encoding.name} for {CHAT_MODEL}")
+    return True
+
+
+def count_tokens(text: str) -> int:
+    """Counts tokens with tiktoken, or estimates ~4 characters per token until `load_encoding` has succeeded."""
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+def count_message_tokens(messages) -> int:
+    return sum(count_tokens(message["content"]) + TOKENS_PER_MESSAGE for message in messages) + TOKENS_PER_REPLY
+
+
+def format_result(result) -> str:
+    created_at = result.get('createdAt')
+    if created_at:
+        if isinstance(created_at, datetime):
+            created_at_str = created_at.strftime("%Y-%m-%d %H:%M:%S")
+        else:
+            created_at_str = str(created_at)
+    else:
+        created_at_str = 'N/A'
+    return (
+        f"Title: {result.get('title', 'N/A')}\n"
+        f"Page: {result.get('pageNumber', 'N/A')}\n"
+        f"Content: {result.get('content', 'N/A')}\n"
+        f"Created At: {created_at_str}\n"
+        f"Word Count: {result.get('wordCount', 'N/A')}\n\n"
+    )
+
+
+def prepare_context(results):
+    context = ''.join(format_result(result) for result in results)
+    main_logger.debug("Context prepared with %d results", len(results))
+    return context
+
+
+def prepare_messages(context, question, chat_history=None):
+    system_prompt = """You are a helpful assistant designed to provide information about the Euvic Services. 
+    Try to answer questions based on the information provided in the data content 
+    below. If you are asked a question that isn't covered in the provided data, respond based on the given information 
+    and your best judgment.
+
+    You also have access to the recent chat history. Use this history to maintain context and provide more relevant 
+    answers. The order of the chat is from the oldest to the newest, so the most recent chat is at the bottom.
+    If the current question is related to previous questions, refer to the chat history for continuity.
+
+    Data content:
+    """
+    messages = [
+        {"role": "system", "content": system_prompt + context},
+    ]
+
+    if chat_history:
+        messages.append({"role": "system", "content": "Recent chat history:"})
+        for entry in reversed(chat_history):  # Odwracamy kolejność, aby najstarsze były pierwsze
+            messages.append({"role": "user", "content": entry["query"]})
+            messages.append({"role": "assistant", "content": entry["answer"]})
+        messages.append({"role": "system", "content": "End of chat history. Now answer the following question:"})
+
+    messages.append({"role": "user", "content": question})
+
+    main_logger.debug("Messages prepared for chat completion. Total messages: %d", len(messages))
+    return messages
+
+
+class PromptBuilder:
+    """Assembles the chat completion prompt within token budgets.
+
+    Retrieved chunks are packed best-score first until `context_budget` is reached; duplicates and chunks
+    scoring more than `score_margin` below the best one are dropped. Chat history is kept newest first until
+    `history_budget` is reached, so the oldest turns are the ones truncated.
+    """
+
+    def __init__(self, context_budget=PROMPT_CONTEXT_TOKEN_BUDGET, history_budget=PROMPT_HISTORY_TOKEN_BUDGET,
+                 score_margin=PROMPT_SCORE_MARGIN):
+        self.context_budget = context_budget
+        self.history_budget = history_budget
+        self.score_margin = score_margin
+
+    def select_context(self, results):
+        """Returns (context, tokens, used_chunks)."""
+        if any('fusedScore' in result for result in results):
+            # Wyniki hybrydowe są już uszeregowane przez RRF, a ich similarityScore nie da się porównać z
+            # fragmentami znalezionymi tylko po słowach kluczowych - próg score_margin nie ma tu zastosowania
+            ranked = results
+            best_score = None
+        else:
+            ranked = sorted(results, key=lambda result: result.get('similarityScore', 0), reverse=True)
+            best_score = ranked[0].get('similarityScore') if ranked else None
+
+        parts = []
+        tokens = 0
+        seen = set()
+        for result in ranked:
+            score = result.get('similarityScore')
+            if best_score is not None and score is not None and score < best_score - self.score_margin:
+                break
+            fingerprint = hashlib.sha1(' '.join((result.get('content') or '').split()).lower().encode()).digest()
+            if fingerprint in seen:
+                continue
+            seen.add(fingerprint)
+
+            text = format_result(result)
+            text_tokens = count_tokens(text)
+            if tokens + text_tokens > self.context_budget:
+                continue  # mniejszy fragment z niższym wynikiem może się jeszcze zmieścić
+            parts.append(text)
+            tokens += text_tokens
+        return ''.join(parts), tokens, len(parts)
+
+    def select_history(self, chat_history):
+        """Returns the newest-first history truncated to the budget, and its token count."""
+        selected = []
+        tokens = 0
+        for entry in chat_history or []:
+            entry_tokens = count_tokens(entry["query"]) + count_tokens(entry["answer"]) + 2 * TOKENS_PER_MESSAGE
+            if tokens + entry_tokens > self.history_budget:
+                break
+            selected.append(entry)
+            tokens += entry_tokens
+        return selected, tokens
+
+    def build(self, question, results, chat_history=None):
+        context, context_tokens, used_chunks = self.select_context(results)
+        history, history_tokens = self.select_history(chat_history)
+        messages = prepare_messages(context, question, history)
+        prompt_tokens = count_message_tokens(messages)
+
+        PROMPT_TOKENS.observe(prompt_tokens, part='total')
+        PROMPT_TOKENS.observe(context_tokens, part='context')
+        PROMPT_TOKENS.observe(history_tokens, part='history')
+        main_logger.info(f"📏 Prompt: {prompt_tokens} tokens (context {context_tokens} from {used_chunks}/"
+                         f"{len(results)} chunks, history {history_tokens} from {len(history)}/"
+                         f"{len(chat_history or [])} turns)")
+        return messages, prompt_tokens
@@ -1,105 +1,245 @@
+import asyncio
+import logging
+import time
 from src.database.mongodb_client import MongoDBClient
-from src.ai.openai_client import OpenAIClient
-from datetime import datetime
+from src.database.local_vector_index import LocalVectorIndex
+from src.database.keyword_index import KeywordIndex, reciprocal_rank_fusion
+from src.ai.openai_client import OpenAIClient, ChatStreamInterrupted, CHAT_COMPLETION_ERROR
+from src.ai.semantic_cache import SemanticCache
+from src.database import mysql_queries
+from src.ai.prompt_builder import PromptBuilder, load_encoding
+from src.ai.model_router import ModelRouter
 from src.logger import main_logger, cosmosdb_logger, openai_logger
-import json
-
-
-def prepare_context(results):
-    context = ""
-    for result in results:
-        context += f"Title: {result.get('title', 'N/A')}\n"
-        context += f"Page: {result.get('pageNumber', 'N/A')}\n"
-        context += f"Content: {result.get('content', 'N/A')}\n"
-        created_at = result.get('createdAt')
-        if created_at:
-            if isinstance(created_at, datetime):
-                created_at_str = created_at.strftime("%Y-%m-%d %H:%M:%S")
-            else:
-                created_at_str = str(created_at)
-        else:
-            created_at_str = 'N/A'
-        context += f"Created At: {created_at_str}\n"
-        context += f"Word Count: {result.get('wordCount', 'N/A')}\n\n"
-    main_logger.debug(f"Context prepared with {len(results)} results")
-    return context
-
-
-def prepare_messages(context, question, chat_history=None):
-    system_prompt = """You are a helpful assistant designed to provide information about the Euvic Services. 
-    Try to answer questions based on the information provided in the data content 
-    below. If you are asked a question that isn't covered in the provided data, respond based on the given information 
-    and your best judgment.
-
-    You also have access to the recent chat history. Use this history to maintain context and provide more relevant 
-    answers. The order of the chat is from the oldest to the newest, so the most recent chat is at the bottom.
-    If the current question is related to previous questions, refer to the chat history for continuity.
-
-    Data content:
-    """
-    messages = [
-        {"role": "system", "content": system_prompt + context},
-    ]
-
-    if chat_history:
-        messages.append({"role": "system", "content": "Recent chat history:"})
-        for entry in reversed(chat_history):  # Odwracamy kolejność, aby najstarsze były pierwsze
-            messages.append({"role": "user", "content": entry["query"]})
-            messages.append({"role": "assistant", "content": entry["answer"]})
-        messages.append({"role": "system", "content": "End of chat history. Now answer the following question:"})
+from src.tracing import trace_stage, record_stage
+from src.circuit_breaker import CircuitOpenError
+from src.config import RETRIEVAL_BACKEND, RETRIEVAL_NUM_RESULTS, HYBRID_RETRIEVAL_ENABLED, HYBRID_NUM_RESULTS, \
+    SEMANTIC_CACHE_SHARED
 
-    messages.append({"role": "user", "content": question})
-
-    main_logger.debug(f"Messages prepared for chat completion. Total messages: {len(messages)}")
-    return messages
+# Odpowiedź, gdy zależność (OpenAI, Cosmos) jest niedostępna albo przekroczyła limit czasu
+DEGRADED_RESPONSE = "Przepraszamy, mamy chwilowe problemy z wygenerowaniem odpowiedzi. Spróbuj ponownie za kilka minut. 🙏"
 
 
 class RAGEngine:
     def __init__(self):
+        # Połączenie z MongoDB nawiązywane jest leniwie przy pierwszym zapytaniu
         self.mongodb_client = MongoDBClient()
-        self.mongodb_client.connect()  # Jawnie nawiązujemy połączenie
         self.openai_client = OpenAIClient()
-        main_logger.info("RAGEngine initialized")
-
-    def process_query(self, question, num_results=10, chat_history=None):
+        self.semantic_cache = SemanticCache(shared=SEMANTIC_CACHE_SHARED)
+        self.prompt_builder = PromptBuilder()
+        self.model_router = ModelRouter(self.openai_client)
+        self.local_index = LocalVectorIndex(self.mongodb_client) if RETRIEVAL_BACKEND == 'local' else None
+        self.keyword_index = KeywordIndex(self.mongodb_client) if HYBRID_RETRIEVAL_ENABLED else None
+        self._warm_up_task = None
+        main_logger.info(f"RAGEngine initialized (retrieval backend: {RETRIEVAL_BACKEND}, "
+                         f"hybrid: {HYBRID_RETRIEVAL_ENABLED})")
+
+    async def start(self):
+        # Bez tabeli generacji współdzielony cache nigdy nie byłby zsynchronizowany i nic by nie zwracał
+        if self.semantic_cache.shared and 'cache_generations' in mysql_queries.missing_tables:
+            self.semantic_cache.use_local("cache_generations table is missing and could not be created")
+        # Liczenie tokenów nie może pobierać kodowania w trakcie obsługi wiadomości, na pętli zdarzeń
+        encoding_loaded = await asyncio.to_thread(load_encoding)
+        # Cosmos może być chwilowo nieosiągalny - worker zaczyna przyjmować ruch od razu, a indeksy
+        # wczytują się w tle (do tego czasu zapytania idą prosto do wyszukiwania wektorowego w Cosmos)
+        self._warm_up_task = asyncio.create_task(self._warm_up(encoding_loaded))
+
+    async def _warm_up(self, encoding_loaded=True):
+        try:
+            await self.mongodb_client.ensure_vector_search_index()
+        except Exception as e:
+            # Okresowa weryfikacja spróbuje ponownie, nie blokujemy startu aplikacji
+            cosmosdb_logger.error(f"❌ Vector search index verification failed at startup: {e}")
+        self.mongodb_client.start_index_verification()
+
+        if self.local_index:
+            try:
+                await self.local_index.start()
+            except Exception as e:
+                # Bez lokalnego indeksu nadal możemy korzystać z wyszukiwania w Cosmos
+                cosmosdb_logger.error(f"❌ Could not load local vector index, falling back to Cosmos: {e}")
+
+        if self.keyword_index:
+            try:
+                await self.keyword_index.start()
+            except Exception as e:
+                cosmosdb_logger.error(f"❌ Could not load keyword index, using vector search only: {e}")
+
+        # Nieudane pobranie kodowania ponawiamy w tle, do tego czasu tokeny są szacowane
+        delay = 30
+        while not encoding_loaded:
+            await asyncio.sleep(delay)
+            encoding_loaded = await asyncio.to_thread(load_encoding)
+            delay = min(delay * 2, 600)
+
+    async def close(self):
+        if self._warm_up_task:
+            self._warm_up_task.cancel()
+            await asyncio.gather(self._warm_up_task, return_exceptions=True)
+        await self.mongodb_client.stop_index_verification()
+        if self.local_index:
+            await self.local_index.stop()
+        if self.keyword_index:
+            await self.keyword_index.stop()
+        await self.openai_client.embedding_cache.close()
+        self.mongodb_client.close()
+
+    async def retrieve(self, query_embedding, num_results=RETRIEVAL_NUM_RESULTS):
+        if self.local_index and self.local_index.loaded:
+            return self.local_index.search(query_embedding, num_results=num_results)
+        return await self.mongodb_client.vector_search(query_embedding, num_results=num_results)
+
+    async def _prepare_completion(self, question, num_results, chat_history):
+        """Runs everything before the completion call.
+
+        Returns (route, embedding, cached_response, messages, results). `embedding` is None when the answer must not
+        be stored in the semantic cache (no retrieval, or a degraded keyword-only retrieval)."""
         main_logger.info(f"🔄 Processing query: {question}")
 
+        with trace_stage('route'):
+            route = self.model_router.route(question, chat_history)
+        if route.reply is not None:
+            return route, None, route.reply, None, []
+
         if chat_history:
-            main_logger.info(f"📜 Chat history provided with {len(chat_history)} entries")
-            main_logger.debug("🔍 Full chat history:")
-            for i, entry in enumerate(chat_history, 1):
-                main_logger.debug(f"  {i}. Query: {entry['query'][:50]}...")
-                main_logger.debug(f"     Answer: {entry['answer'][:50]}...")
+            main_logger.info("📜 Chat history provided with %d entries", len(chat_history))
+            if main_logger.isEnabledFor(logging.DEBUG):
+                main_logger.debug("🔍 Full chat history:\n%s", "\n".join(
+                    f"  {i}. Query: {entry['query'][:50]}...\n     Answer: {entry['answer'][:50]}..."
+                    for i, entry in enumerate(chat_history, 1)))
         else:
             main_logger.info("⚠️ No chat history provided")
 
+        if not route.retrieval:
+            with trace_stage('prompt'):
+                messages, prompt_tokens = self.prompt_builder.build(question, [], chat_history)
+            main_logger.info(f"💬 Prepared {len(messages)} messages without retrieval ({prompt_tokens} tokens)")
+            return route, None, None, messages, []
+
+        hybrid = self.keyword_index is not None and self.keyword_index.loaded
+        if num_results is None:
+            num_results = HYBRID_NUM_RESULTS if hybrid else RETRIEVAL_NUM_RESULTS
+
+        with trace_stage('keyword_search'):
+            keyword_results = self.keyword_index.search(question, num_results=num_results) if hybrid else []
+        if keyword_results and self.keyword_index.is_exact_match(question, keyword_results):
+            # Nazwa produktu, skrót albo numer telefonu - trafienie słowne wystarcza, pomijamy embedding
+            cosmosdb_logger.info(f"🔑 Exact keyword match, answering from {len(keyword_results)} keyword results")
+            query_embedding = None
+            results = keyword_results
+        else:
+            try:
+                with trace_stage('embedding'):
+                    query_embedding = await self.openai_client.generate_embeddings(question)
+            except (CircuitOpenError, asyncio.TimeoutError) as e:
+                if not keyword_results:
+                    raise
+                # Embeddingi niedostępne - wystarczy nam wynik wyszukiwania słów kluczowych
+                openai_logger.warning(f"⚡ Embeddings unavailable ({e!r}), answering from "
+                                      f"{len(keyword_results)} keyword results")
+                query_embedding = None
+                results = keyword_results
+            else:
+                main_logger.debug("📊 Query embedding generated")
+
+                # Odpowiedzi bez historii zależą tylko od pytania, więc można je współdzielić między użytkownikami
+                if not chat_history:
+                    with trace_stage('semantic_cache'):
+                        await self.semantic_cache.sync()
+                        cached_response = self.semantic_cache.lookup(query_embedding)
+                    if cached_response is not None:
+                        main_logger.info(f"✅ Query answered from semantic cache {self.semantic_cache.stats()}")
+                        return route, query_embedding, cached_response, None, []
+
+                try:
+                    with trace_stage('vector_search'):
+                        results = await self.retrieve(query_embedding, num_results=num_results)
+                except (CircuitOpenError, asyncio.TimeoutError) as e:
+                    if not keyword_results:
+                        raise
+                    cosmosdb_logger.warning(f"⚡ Vector search unavailable ({e!r}), answering from "
+                                            f"{len(keyword_results)} keyword results")
+                    # Odpowiedź bez wyników wektorowych jest gorsza - nie trafia do cache semantycznego
+                    query_embedding = None
+                    results = []
+                cosmosdb_logger.info(f"🔎 Vector search completed with {len(results)} results")
+                if keyword_results:
+                    results = reciprocal_rank_fusion([results, keyword_results])[:num_results]
+                    cosmosdb_logger.info(f"🔀 Fused with {len(keyword_results)} keyword results into "
+                                         f"{len(results)}")
+
+        with trace_stage('prompt'):
+            messages, prompt_tokens = self.prompt_builder.build(question, results, chat_history)
+        main_logger.info(f"💬 Prepared {len(messages)} messages for OpenAI ({prompt_tokens} tokens)")
+        if main_logger.isEnabledFor(logging.DEBUG):
+            main_logger.debug("📄 Messages content:\n%s", "\n".join(
+                f"  {i}. Role: {msg['role']}, Content: {msg['content'][:50]}..." for i, msg in enumerate(messages, 1)))
+
+        return route, query_embedding, None, messages, results
+
+    def _finish_completion(self, question, query_embedding, results, response, chat_history):
+        # Odpowiedź wygenerowana bez kontekstu (np. podczas awarii Cosmos) nie może być serwowana z cache po naprawie
+        if not chat_history and query_embedding is not None and results and response != CHAT_COMPLETION_ERROR:
+            self.semantic_cache.store(question, query_embedding, response)
+
+        main_logger.info("✅ Query processed successfully")
+        main_logger.debug("🗨️ AI Response: %.100s...", response)
+
+    async def process_query(self, question, num_results=None, chat_history=None):
         try:
-            self.mongodb_client.ensure_vector_search_index()
+            route, query_embedding, cached_response, messages, results = await self._prepare_completion(
+                question, num_results, chat_history)
+            if cached_response is not None:
+                return cached_response
 
-            query_embedding = self.openai_client.generate_embeddings(question)
-            main_logger.debug("📊 Query embedding generated")
-
-            results = self.mongodb_client.vector_search(query_embedding, num_results=num_results)
-            cosmosdb_logger.info(f"🔎 Vector search completed with {len(results)} results")
-
-            context = prepare_context(results)
-            main_logger.debug(f"📝 Context prepared (length: {len(context)} characters)")
-
-            messages = prepare_messages(context, question, chat_history)
-            main_logger.info(f"💬 Prepared {len(messages)} messages for OpenAI")
-            main_logger.debug("📄 Messages content:")
-            for i, msg in enumerate(messages, 1):
-                main_logger.debug(f"  {i}. Role: {msg['role']}, Content: {msg['content'][:50]}...")
-
-            response = self.openai_client.generate_chat_completion(messages)
+            with trace_stage('completion'):
+                response = await self.model_router.complete(route, messages)
             openai_logger.info("✅ Chat completion generated")
 
-            main_logger.info("✅ Query processed successfully")
-            main_logger.debug(f"🗨️ AI Response: {response[:100]}...")
-
+            self._finish_completion(question, query_embedding, results, response, chat_history)
             return response
+        except (CircuitOpenError, asyncio.TimeoutError) as e:
+            main_logger.warning(f"⚡ Dependency unavailable ({e!r}), sending degraded response")
+            return DEGRADED_RESPONSE
         except Exception as e:
             main_logger.error(f"❌ Error processing query: {e}", exc_info=True)
             return f"Kurza twarz! Wystąpił niezidentyfikowany błąd: 🐞 ERROR: [{e}]."
-        # finally:
-        #     self.mongodb_client.close()
+
+    async def process_query_stream(self, question, num_results=None, chat_history=None):
+        """Same pipeline as `process_query`, but yields the answer as completion deltas as they arrive.
+
+        If the stream breaks mid-answer, ChatStreamInterrupted propagates and nothing is cached."""
+        try:
+            route, query_embedding, cached_response, messages, results = await self._prepare_completion(
+                question, num_results, chat_history)
+        except (CircuitOpenError, asyncio.TimeoutError) as e:
+            main_logger.warning(f"⚡ Dependency unavailable ({e!r}), sending degraded response")
+            yield DEGRADED_RESPONSE
+            return
+        except Exception as e:
+            main_logger.error(f"❌ Error processing query: {e}", exc_info=True)
+            yield f"Kurza twarz! Wystąpił niezidentyfikowany błąd: 🐞 ERROR: [{e}]."
+            return
+
+        if cached_response is not None:
+            yield cached_response
+            return
+
+        parts = []
+        started = time.perf_counter()
+        try:
+            async for delta in self.model_router.stream(route, messages):
+                if not parts:
+                    record_stage('first_token', time.perf_counter() - started)
+                parts.append(delta)
+                yield delta
+        except (CircuitOpenError, asyncio.TimeoutError) as e:
+            if parts:
+                raise ChatStreamInterrupted(repr(e)) from e
+            main_logger.warning(f"⚡ Chat completion unavailable ({e!r}), sending degraded response")
+            yield DEGRADED_RESPONSE
+            return
+        # Obejmuje też wysyłkę fragmentów, bo strumień jest konsumowany w trakcie generowania
+        record_stage('completion_stream', time.perf_counter() - started)
+        openai_logger.info("✅ Chat completion streamed")
+
+        self._finish_completion(question, query_embedding, results, ''.join(parts), chat_history)
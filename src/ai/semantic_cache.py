@@ -0,0 +1,130 @@
+import time
+import numpy as np
+from src.logger import main_logger
+from src.metrics import CacheMetrics
+from src.config import SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_MAX_SIZE, SEMANTIC_CACHE_TTL_SECONDS, \
+    SEMANTIC_CACHE_SYNC_INTERVAL
+from src.database.mysql_queries import fetch_cache_generation, bump_cache_generation
+
+GENERATION_NAME = 'semantic_cache'
+
+
+class SemanticCache:
+    """Answer cache keyed by query embedding similarity.
+
+    Embeddings of cached questions are stored as L2-normalised rows of a preallocated float32 matrix, so a
+    lookup is a single matrix-vector product. Only answers generated without chat history are cached, since
+    those depend on the question alone. Slots expire after `ttl` seconds and the least recently used slot is
+    reused when the cache is full.
+
+    Every worker process has its own copy. Invalidation is shared through a generation number in MySQL
+    (`cache_generations`): `sync` drops the local answers once the number changes, and `in_sync` stays False
+    while it cannot be read, so no possibly stale answer is served. With `shared=False` (a single process that
+    needs no MySQL) the cache is always in sync; `use_local` switches a shared cache to that mode when the
+    generation table is unavailable.
+    """
+
+    def __init__(self, threshold=SEMANTIC_CACHE_THRESHOLD, max_size=SEMANTIC_CACHE_MAX_SIZE,
+                 ttl=SEMANTIC_CACHE_TTL_SECONDS, shared=True, sync_interval=SEMANTIC_CACHE_SYNC_INTERVAL):
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl = ttl
+        self.shared = shared
+        self.sync_interval = sync_interval
+        self.generation = None
+        self.in_sync = not shared
+        self.synced_at = float('-inf')
+        self.matrix = None  # allocated on first insert, once the embedding size is known
+        self.questions = [None] * max_size
+        self.answers = [None] * max_size
+        self.expires_at = np.zeros(max_size, dtype=np.float64)  # 0 oznacza pusty slot
+        self.last_used = np.zeros(max_size, dtype=np.float64)
+        self.lookups = CacheMetrics('semantic')
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def use_local(self, reason):
+        """Stops sharing invalidations, so the cache keeps working in this process without MySQL."""
+        self.shared = False
+        self.in_sync = True
+        main_logger.warning(f"⚠️ Semantic cache falls back to per-process invalidation: {reason}")
+
+    async def sync(self) -> bool:
+        """Checks the shared generation (at most every `sync_interval` seconds). Returns `in_sync`."""
+        now = time.monotonic()
+        if not self.shared or self.max_size <= 0 or now - self.synced_at < self.sync_interval:
+            return self.in_sync
+        self.synced_at = now
+        generation = await fetch_cache_generation(GENERATION_NAME)
+        if generation is None:
+            self.in_sync = False
+            return False
+        if self.generation is not None and generation != self.generation:
+            self.invalidate(reason=f"generation {generation} set by another process")
+        self.generation = generation
+        self.in_sync = True
+        return True
+
+    def lookup(self, embedding):
+        if self.max_size <= 0 or self.matrix is None or not self.in_sync:
+            self.lookups.miss()
+            return None
+
+        now = time.monotonic()
+        valid = self.expires_at > now
+        if not valid.any():
+            self.lookups.miss()
+            return None
+
+        scores = self.matrix @ self._normalize(embedding)
+        scores[~valid] = -np.inf
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            self.lookups.miss()
+            return None
+
+        self.lookups.hit()
+        self.last_used[best] = now
+        main_logger.info(f"🎯 Semantic cache hit (similarity {scores[best]:.4f}) for cached question: "
+                         f"{self.questions[best][:50]}")
+        return self.answers[best]
+
+    def store(self, question, embedding, answer):
+        if self.max_size <= 0 or not self.in_sync:
+            return
+        vector = self._normalize(embedding)
+        if self.matrix is None:
+            self.matrix = np.zeros((self.max_size, vector.shape[0]), dtype=np.float32)
+
+        now = time.monotonic()
+        expired = np.flatnonzero(self.expires_at <= now)
+        slot = int(expired[0]) if expired.size else int(np.argmin(self.last_used))
+
+        self.matrix[slot] = vector
+        self.questions[slot] = question
+        self.answers[slot] = answer
+        self.expires_at[slot] = now + self.ttl
+        self.last_used[slot] = now
+
+    def invalidate(self, reason="knowledge base changed"):
+        """Drops every cached answer. Call it whenever the documents behind the answers change."""
+        self.expires_at[:] = 0
+        self.questions = [None] * self.max_size
+        self.answers = [None] * self.max_size
+        main_logger.info(f"🧹 Semantic cache invalidated: {reason}")
+
+    async def invalidate_everywhere(self, reason="knowledge base changed"):
+        """Invalidates this copy and, through the shared generation, the copies of all other workers."""
+        self.invalidate(reason)
+        if self.shared:
+            generation = await bump_cache_generation(GENERATION_NAME)
+            if generation is not None:
+                self.generation = generation
+                self.synced_at = time.monotonic()
+
+    def stats(self) -> dict:
+        return self.lookups.stats(int((self.expires_at > time.monotonic()).sum()))
@@ -1,3 +1,5 @@
 from .webhook import webhook_bp
+from .admin import admin_bp
+from .metrics import metrics_bp
 
-__all__ = ['webhook_bp']
\ No newline at end of file
+__all__ = ['webhook_bp', 'admin_bp', 'metrics_bp']
\ No newline at end of file
@@ -0,0 +1,49 @@
+from functools import wraps
+from hmac import compare_digest
+from quart import Blueprint, request, jsonify
+from src.logger import main_logger
+from src.config import SECRET_KEY
+from src.api.webhook import get_rag_engine
+from src.circuit_breaker import breaker_stats
+
+admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
+
+
+def require_admin_token(func):
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        token = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+        if not SECRET_KEY or not compare_digest(token, SECRET_KEY):
+            main_logger.warning(f'🔒 Rejected admin request to {request.path}')
+            return 'Unauthorized', 401
+        return await func(*args, **kwargs)
+
+    return wrapper
+
+
+@admin_bp.route('/semantic-cache', methods=['GET'])
+@require_admin_token
+async def semantic_cache_stats():
+    return jsonify(get_rag_engine().semantic_cache.stats()), 200
+
+
+@admin_bp.route('/semantic-cache/invalidate', methods=['POST'])
+@require_admin_token
+async def invalidate_semantic_cache():
+    rag_engine = get_rag_engine()
+    await rag_engine.semantic_cache.invalidate_everywhere(reason='admin request')
+    return jsonify(rag_engine.semantic_cache.stats()), 200
+
+
+@admin_bp.route('/vector-index/rebuild', methods=['POST'])
+@require_admin_token
+async def rebuild_vector_index():
+    rag_engine = get_rag_engine()
+    await rag_engine.mongodb_client.rebuild_vector_search_index()
+    return jsonify(rag_engine.mongodb_client.vector_index_options()), 200
+
+
+@admin_bp.route('/circuit-breakers', methods=['GET'])
+@require_admin_token
+async def circuit_breakers():
+    return jsonify(breaker_stats()), 200
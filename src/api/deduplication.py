@@ -0,0 +1,80 @@
+import asyncio
+import time
+from collections import OrderedDict
+from src.logger import whatsapp_logger
+from src.metrics import CacheMetrics
+from src.config import DEDUP_TTL_SECONDS, DEDUP_MAX_SIZE, DEDUP_BACKEND
+from src.database.mysql_queries import claim_message_id, release_message_id, purge_processed_messages
+
+
+class MessageDeduplicator:
+    """Drops webhook redeliveries by WhatsApp message id.
+
+    Ids are kept in an in-process LRU set with a TTL (DEDUP_BACKEND=local). With DEDUP_BACKEND=mysql every new
+    id is also claimed in the `processed_messages` table, so replicas sharing the database see each other's
+    messages.
+    """
+
+    def __init__(self, ttl=DEDUP_TTL_SECONDS, max_size=DEDUP_MAX_SIZE, backend=DEDUP_BACKEND):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.backend = backend
+        self.seen = OrderedDict()  # message_id -> expiry (monotonic)
+        self.lookups = CacheMetrics('dedup')
+        self.last_purge = time.monotonic()
+        self.purge_task = None
+
+    async def is_duplicate(self, message_id) -> bool:
+        if not message_id:
+            return False
+
+        now = time.monotonic()
+        expires_at = self.seen.get(message_id)
+        if expires_at is not None and expires_at > now:
+            self.seen.move_to_end(message_id)
+            self.lookups.hit()
+            return True
+
+        # Zaznaczamy od razu, żeby równoległe redelivery nie przeszły w trakcie zapytania do MySQL
+        self._remember(message_id, now)
+
+        if self.backend == 'mysql':
+            claimed = await claim_message_id(message_id)
+            # None oznacza błąd bazy - wolimy przetworzyć wiadomość niż ją zgubić
+            if claimed is False:
+                self.lookups.hit()
+                return True
+            self._maybe_purge(now)
+
+        self.lookups.miss()
+        return False
+
+    async def forget(self, message_id):
+        """Releases an id that was claimed but not processed, so Meta's retry is not dropped."""
+        if not message_id:
+            return
+        self.seen.pop(message_id, None)
+        if self.backend == 'mysql':
+            await release_message_id(message_id)
+
+    def _remember(self, message_id, now):
+        self.seen[message_id] = now + self.ttl
+        self.seen.move_to_end(message_id)
+        while self.seen:
+            oldest_id, oldest_expiry = next(iter(self.seen.items()))
+            if len(self.seen) <= self.max_size and oldest_expiry > now:
+                break
+            del self.seen[oldest_id]
+
+    def _maybe_purge(self, now):
+        if now - self.last_purge < self.ttl or (self.purge_task and not self.purge_task.done()):
+            return
+        self.last_purge = now
+        # Trzymamy referencję, żeby zadanie nie zostało usunięte przez GC w trakcie działania
+        self.purge_task = asyncio.create_task(purge_processed_messages(self.ttl))
+
+    def stats(self) -> dict:
+        return self.lookups.stats(len(self.seen))
+
+    def log_duplicate(self, message_id):
+        whatsapp_logger.info(f'♻️ Dropping redelivered message {message_id} (dedup stats: {self.stats()})')
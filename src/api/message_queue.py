@@ -0,0 +1,147 @@
+import asyncio
+import time
+import traceback
+from collections import deque
+from contextlib import nullcontext
+from src.logger import main_logger
+from src.tracing import record_stage
+from src.config import MESSAGE_WORKER_COUNT, MESSAGE_QUEUE_MAX_SIZE, MESSAGE_QUEUE_DRAIN_TIMEOUT, \
+    MESSAGE_COALESCE_WINDOW, MESSAGE_COALESCE_MAX_WAIT, MESSAGE_COALESCE_MAX_MESSAGES
+
+
+class MessageQueue:
+    """In-process ingestion queue drained by a fixed pool of asyncio workers.
+
+    The webhook only parses the payload and calls `enqueue`, so Meta gets its 200 right away while the
+    RAG pipeline runs in the background. Messages are grouped by key (the sender's phone number): different
+    senders are processed concurrently, while a sender never has more than one pipeline in flight.
+
+    A message from an idle sender is ready right away. Messages that arrive while that sender's pipeline is
+    running wait until it finishes and then for `coalesce_window` seconds without a new message (but no longer
+    than `coalesce_max_wait` after the first one); the worker then receives every message that piled up, so
+    rapid-fire texts are handled by a single `handler(messages)` call. The debounce runs on loop timers, so
+    waiting senders do not occupy a worker. The queue is bounded: when it is full `enqueue` returns False
+    and the caller is expected to push back.
+
+    Ordering only holds within one process. With several worker processes, `key_lock(key)` returns an async
+    context manager held around every handler call, e.g. a MySQL named lock per sender. Such a lock keeps one
+    sender's batches from running at the same time in different processes, but does not order them.
+    """
+
+    def __init__(self, handler, worker_count=MESSAGE_WORKER_COUNT, max_size=MESSAGE_QUEUE_MAX_SIZE,
+                 coalesce_window=MESSAGE_COALESCE_WINDOW, coalesce_max_wait=MESSAGE_COALESCE_MAX_WAIT,
+                 coalesce_max_messages=MESSAGE_COALESCE_MAX_MESSAGES, key_lock=None):
+        self.handler = handler
+        self.key_lock = key_lock
+        self.worker_count = worker_count
+        self.max_size = max_size
+        self.coalesce_window = coalesce_window
+        self.coalesce_max_wait = coalesce_max_wait
+        self.coalesce_max_messages = coalesce_max_messages
+        self.pending = {}  # key -> deque of messages waiting for that key
+        self.scheduled = set()  # keys that are debouncing, in `ready` or being processed by a worker
+        self.first_arrival = {}  # key -> monotonic time the current batch started collecting
+        self.last_arrival = {}  # key -> monotonic time of the newest pending message
+        self.timers = {}  # key -> TimerHandle of a debouncing key
+        self.size = 0
+        self.ready = None
+        self.workers = []
+        self.accepting = False
+
+    async def start(self):
+        if self.workers:
+            return
+        self.ready = asyncio.Queue()
+        self.workers = [asyncio.create_task(self._worker(i + 1)) for i in range(self.worker_count)]
+        self.accepting = True
+        main_logger.info(f"🧵 Message queue started with {self.worker_count} workers (max size {self.max_size}, "
+                         f"coalesce window {self.coalesce_window}s)")
+
+    def enqueue(self, key, message) -> bool:
+        if not self.accepting:
+            main_logger.warning("⚠️ Message queue is not accepting new messages")
+            return False
+        if self.size >= self.max_size:
+            main_logger.warning(f"⚠️ Message queue is full ({self.max_size}), rejecting message")
+            return False
+
+        now = time.monotonic()
+        self.pending.setdefault(key, deque()).append(message)
+        self.size += 1
+        self.last_arrival[key] = now
+        if key not in self.scheduled:
+            self.scheduled.add(key)
+            self.first_arrival[key] = now
+            # Nadawca bez wiadomości w toku - nie ma na co czekać, odpowiadamy od razu
+            self.ready.put_nowait(key)
+        elif key in self.timers:
+            # Nowa wiadomość w trakcie oczekiwania przesuwa moment przetworzenia (debounce)
+            self.timers.pop(key).cancel()
+            self._arm(key)
+        return True
+
+    def _arm(self, key):
+        deadline = min(self.last_arrival[key] + self.coalesce_window,
+                       self.first_arrival[key] + self.coalesce_max_wait)
+        delay = deadline - time.monotonic()
+        if self.coalesce_window <= 0 or delay <= 0:
+            self.ready.put_nowait(key)
+        else:
+            self.timers[key] = asyncio.get_running_loop().call_later(delay, self._make_ready, key)
+
+    def _make_ready(self, key):
+        self.timers.pop(key, None)
+        self.ready.put_nowait(key)
+
+    def depth(self) -> int:
+        return self.size
+
+    async def drain(self, timeout=MESSAGE_QUEUE_DRAIN_TIMEOUT):
+        if not self.workers:
+            return
+        self.accepting = False
+        main_logger.info(f"⏳ Draining message queue ({self.depth()} pending)")
+
+        # Przy zamykaniu nie czekamy na kolejne wiadomości - wszyscy nadawcy od razu trafiają do kolejki
+        self.coalesce_window = 0
+        for key in list(self.timers):
+            self.timers.pop(key).cancel()
+            self.ready.put_nowait(key)
+
+        try:
+            await asyncio.wait_for(self.ready.join(), timeout=timeout)
+            main_logger.info("✅ Message queue drained")
+        except asyncio.TimeoutError:
+            main_logger.error(f"⏱️ Message queue drain timed out with {self.depth()} messages left")
+
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+        main_logger.info("🚪 Message queue workers stopped")
+
+    async def _worker(self, worker_id):
+        while True:
+            key = await self.ready.get()
+            try:
+                queue = self.pending[key]
+                messages = [queue.popleft() for _ in range(min(len(queue), self.coalesce_max_messages))]
+                self.size -= len(messages)
+                # Czas od pierwszej wiadomości paczki, łącznie z oknem łączenia wiadomości
+                record_stage('queue_wait', time.monotonic() - self.first_arrival[key])
+                async with self.key_lock(key) if self.key_lock else nullcontext():
+                    await self.handler(messages)
+            except Exception as e:
+                main_logger.error(f"❌ Worker {worker_id} failed to process messages: {e}")
+                main_logger.error(traceback.format_exc())
+            finally:
+                # Wiadomości, które przyszły w trakcie przetwarzania, czekają na kolejną rundę
+                if self.pending.get(key):
+                    self.first_arrival[key] = time.monotonic()
+                    self._arm(key)
+                else:
+                    self.pending.pop(key, None)
+                    self.first_arrival.pop(key, None)
+                    self.last_arrival.pop(key, None)
+                    self.scheduled.discard(key)
+                self.ready.task_done()
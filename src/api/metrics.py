@@ -0,0 +1,76 @@
+import asyncio
+from hmac import compare_digest
+from quart import Blueprint, request
+from src.logger import main_logger
+from src.config import METRICS_TOKEN, METRICS_DIR, METRICS_EXPORT_INTERVAL
+from src.metrics import Gauge, render, write_snapshot, read_snapshots, remove_snapshot
+from src.api.webhook import message_queue, deduplicator, get_rag_engine
+from src.database.mysql_queries import query_log_writer, chat_history_cache
+
+metrics_bp = Blueprint('metrics', __name__)
+
+MESSAGE_QUEUE_DEPTH = Gauge('message_queue_depth', 'Messages waiting for a worker')
+QUERY_LOG_PENDING = Gauge('query_log_pending_rows', 'Query/answer rows waiting to be written to MySQL')
+
+_export_task = None
+
+
+def refresh_gauges():
+    # Stan kolejek odczytujemy w momencie scrapowania (lub eksportu do METRICS_DIR)
+    MESSAGE_QUEUE_DEPTH.set(message_queue.depth())
+    QUERY_LOG_PENDING.set(query_log_writer.depth())
+    # stats() publikuje też rozmiar każdego cache jako cache_entries
+    rag_engine = get_rag_engine()
+    for cache in (rag_engine.semantic_cache, rag_engine.openai_client.embedding_cache, chat_history_cache,
+                  deduplicator):
+        cache.stats()
+
+
+async def export_metrics():
+    refresh_gauges()
+    await asyncio.to_thread(write_snapshot, METRICS_DIR)
+
+
+async def _export_loop():
+    while True:
+        try:
+            await export_metrics()
+        except OSError as e:
+            main_logger.error(f'❌ Could not export metrics to {METRICS_DIR}: {e}')
+        await asyncio.sleep(METRICS_EXPORT_INTERVAL)
+
+
+async def start_metrics_export():
+    """With METRICS_DIR set (WORKERS > 1), periodically saves this worker's metrics for the merged /metrics."""
+    global _export_task
+    if METRICS_DIR and _export_task is None:
+        _export_task = asyncio.create_task(_export_loop())
+        main_logger.info(f'📈 Exporting metrics to {METRICS_DIR} every {METRICS_EXPORT_INTERVAL}s')
+
+
+async def stop_metrics_export():
+    global _export_task
+    if _export_task is not None:
+        _export_task.cancel()
+        await asyncio.gather(_export_task, return_exceptions=True)
+        _export_task = None
+        await asyncio.to_thread(remove_snapshot, METRICS_DIR)
+
+
+@metrics_bp.route('/metrics', methods=['GET'])
+async def metrics():
+    if METRICS_TOKEN:
+        token = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+        if not compare_digest(token, METRICS_TOKEN):
+            main_logger.warning('🔒 Rejected metrics request')
+            return 'Unauthorized', 401
+
+    if METRICS_DIR:
+        # Scrape trafia do losowego workera - zwracamy sumę metryk wszystkich procesów
+        await export_metrics()
+        snapshots = await asyncio.to_thread(read_snapshots, METRICS_DIR, 3 * METRICS_EXPORT_INTERVAL)
+        body = render(snapshots)
+    else:
+        refresh_gauges()
+        body = render()
+    return body, 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
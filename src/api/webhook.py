@@ -1,59 +1,173 @@
 from quart import Blueprint, request, current_app
-from src.logger import whatsapp_logger, main_logger
-from src.config import WEBHOOK_VERIFY_TOKEN
+from src.logger import whatsapp_logger, main_logger, set_request_id, request_id_var
+from src.config import WEBHOOK_VERIFY_TOKEN, STREAMING_ENABLED, SENDER_LOCK_BACKEND, SENDER_LOCK_TIMEOUT
 from src.ai import RAGEngine
+from src.ai.openai_client import ChatStreamInterrupted
 from src.whatsapp.whatsapp_client import WhatsAppClient
-from src.database.mysql_queries import insert_data_mysql, get_recent_queries
+from src.whatsapp.message_chunker import StreamChunker
+from src.database.mysql_queries import insert_data_mysql, get_recent_queries, hold_named_lock
+from src.api.message_queue import MessageQueue
+from src.api.deduplication import MessageDeduplicator
+from src.tracing import start_trace, end_trace, trace_stage, trace_call, record_stage, format_timings
 import traceback
 import asyncio
 import json
+import time
 
 webhook_bp = Blueprint('webhook', __name__)
-rag_engine = RAGEngine()
+STREAM_INTERRUPTED_NOTICE = "⚠️ Przepraszamy, odpowiedź została przerwana. Spróbuj zadać pytanie ponownie."
+_rag_engine = None
 
 
-@webhook_bp.route('/webhook', methods=['POST'])
-async def webhook():
+def get_rag_engine() -> RAGEngine:
+    """The process-wide RAGEngine, created on first use - each Hypercorn worker builds its own in before_serving
+    instead of every process doing it at import time."""
+    global _rag_engine
+    if _rag_engine is None:
+        _rag_engine = RAGEngine()
+    return _rag_engine
+
+
+async def process_messages(incoming_messages):
+    """Answers a batch of consecutive text messages from one sender with a single RAG run."""
+    # Id ostatniej wiadomości z paczki trafia do każdego wpisu w logach (LOG_FORMAT=json)
+    token = set_request_id(incoming_messages[-1].get("id"))
+    trace = start_trace()
     try:
-        data = await request.get_json()
-        main_request_body = data['entry'][0]['changes'][0]['value']
+        with trace_stage('total'):
+            await answer_messages(incoming_messages)
+    finally:
+        main_logger.info(f'⏱️ Message handled: {format_timings()}')
+        end_trace(trace)
+        request_id_var.reset(token)
+
+
+async def answer_messages(incoming_messages):
+    sender_phone_number = int(incoming_messages[0].get("from"))
+    user_query = '\n'.join(message['text'].get('body') for message in incoming_messages)
+    if len(incoming_messages) > 1:
+        whatsapp_logger.info(f'🧩 Coalesced {len(incoming_messages)} messages from {sender_phone_number}')
+
+    # Pobierz historię zapytań
+    with trace_stage('history'):
+        chat_history = await get_recent_queries(sender_phone_number)
+
+    # Przetwórz zapytanie z uwzględnieniem historii
+    main_logger.info(f'🔄 Processing query: {user_query}')
+
+    if STREAMING_ENABLED:
+        ai_answer = await stream_answer(user_query, chat_history, sender_phone_number)
+        if ai_answer is None:
+            # Urwana odpowiedź nie trafia do historii rozmowy
+            return
+        whatsapp_logger.info('🤖 RAGEngine streamed answer with chat history')
+        with trace_stage('insert'):
+            await insert_data_mysql(sender_phone_number, user_query, ai_answer)
+        whatsapp_logger.info('✅ AI answer sent and data inserted into MySQL')
+        return
+
+    ai_answer = await get_rag_engine().process_query(user_query, chat_history=chat_history)
+    whatsapp_logger.info('🤖 RAGEngine processed query with chat history')
+
+    # Wysyłka odpowiedzi i zapis do MySQL są od siebie niezależne, więc wykonujemy je równolegle
+    await asyncio.gather(
+        trace_call('send', WhatsAppClient.send_message(ai_answer, sender_phone_number)),
+        trace_call('insert', insert_data_mysql(sender_phone_number, user_query, ai_answer))
+    )
+
+    whatsapp_logger.info('✅ AI answer sent and data inserted into MySQL')
+
+
+async def stream_answer(user_query, chat_history, sender_phone_number) -> str | None:
+    """Sends the answer in paragraph-sized WhatsApp messages while it is still being generated.
+
+    Returns None if the stream broke mid-answer; the user then gets STREAM_INTERRUPTED_NOTICE instead of the rest."""
+    chunker = StreamChunker()
+    parts = []
+    try:
+        async for delta in get_rag_engine().process_query_stream(user_query, chat_history=chat_history):
+            parts.append(delta)
+            for chunk in chunker.feed(delta):
+                with trace_stage('send'):
+                    await WhatsAppClient.send_message(chunk, sender_phone_number)
+    except ChatStreamInterrupted as e:
+        whatsapp_logger.error(f'❌ Answer stream interrupted after {len("".join(parts))} characters: {e}')
+        with trace_stage('send'):
+            await WhatsAppClient.send_message(STREAM_INTERRUPTED_NOTICE, sender_phone_number)
+        return None
+    for chunk in chunker.flush():
+        with trace_stage('send'):
+            await WhatsAppClient.send_message(chunk, sender_phone_number)
+    return ''.join(parts)
+
+
+def sender_lock(sender_phone_number):
+    # Kolejność wiadomości jednego nadawcy między procesami - nazwana blokada MySQL (max 64 znaki). Nie jest
+    # to kolejka FIFO: gdy paczki tego samego nadawcy czekają na blokadę w dwóch procesach, mogą zostać
+    # obsłużone w dowolnej kolejności (w obrębie jednego procesu kolejność jest zachowana)
+    return hold_named_lock(f"whatsapp-sender:{sender_phone_number}", SENDER_LOCK_TIMEOUT)
 
-        errors = main_request_body.get('errors')
-        statuses = main_request_body.get('statuses')
-        messages = main_request_body.get('messages')
 
-        if errors:
-            whatsapp_logger.warn(f"⚙️ Request contained an errors field: \tErrors: {errors}")
-        if statuses:
-            whatsapp_logger.info(f'⚙️ Message status: {statuses[0].get("status")}')
-        if messages:
-            incoming_message = messages[0]
-            sender_phone_number = int(incoming_message.get("from"))
+message_queue = MessageQueue(process_messages, key_lock=sender_lock if SENDER_LOCK_BACKEND == 'mysql' else None)
+deduplicator = MessageDeduplicator()
 
-            if incoming_message.get('type') == 'text':
-                user_query = incoming_message['text'].get('body')
-                whatsapp_logger.info(f'✅ Received message: {user_query} from {sender_phone_number}')
 
-                # Pobierz historię zapytań
-                chat_history = await get_recent_queries(sender_phone_number)
+def iter_change_values(data):
+    """Yields the `value` of every change in every entry of a webhook delivery."""
+    for entry in data.get('entry') or []:
+        for change in entry.get('changes') or []:
+            value = change.get('value')
+            if value:
+                yield value
 
-                # Przetwórz zapytanie z uwzględnieniem historii
-                main_logger.info(f'🔄 Processing query: {user_query}')
 
-                ai_answer = await asyncio.to_thread(rag_engine.process_query, user_query, chat_history=chat_history)
-                whatsapp_logger.info('🤖 RAGEngine processed query with chat history')
+async def accept_message(incoming_message) -> bool:
+    """Deduplicates and enqueues a single message. Returns False only if the queue rejected it."""
+    message_id = incoming_message.get('id')
+    if await deduplicator.is_duplicate(message_id):
+        deduplicator.log_duplicate(message_id)
+        return True
 
-                # Use asyncio to run these potentially blocking operations concurrently
-                # -> TODO change to asyncio.task_group
-                await asyncio.gather(
-                    WhatsAppClient.send_message(ai_answer, sender_phone_number),
-                    insert_data_mysql(sender_phone_number, user_query, ai_answer)
-                )
+    sender_phone_number = int(incoming_message.get("from"))
 
-                whatsapp_logger.info('✅ AI answer sent and data inserted into MySQL')
+    if incoming_message.get('type') != 'text':
+        whatsapp_logger.warning(f"⚠️ Received non-text message type: {incoming_message.get('type')}")
+        return True
 
-            else:
-                whatsapp_logger.warn(f"⚠️ Received non-text message type: {incoming_message.get('type')}")
+    user_query = incoming_message['text'].get('body')
+    whatsapp_logger.info(f'✅ Received message: {user_query} from {sender_phone_number}')
+
+    # Odpowiedź generujemy w tle, Meta dostaje 200 od razu
+    if not message_queue.enqueue(sender_phone_number, incoming_message):
+        await deduplicator.forget(message_id)
+        return False
+    return True
+
+
+@webhook_bp.route('/webhook', methods=['POST'])
+async def webhook():
+    started = time.perf_counter()
+    try:
+        data = await request.get_json()
+        rejected = 0
+
+        for main_request_body in iter_change_values(data):
+            errors = main_request_body.get('errors')
+            statuses = main_request_body.get('statuses') or []
+            messages = main_request_body.get('messages') or []
+
+            if errors:
+                whatsapp_logger.warning(f"⚙️ Request contained an errors field: \tErrors: {errors}")
+            for status in statuses:
+                whatsapp_logger.info(f'⚙️ Message status: {status.get("status")}')
+            for incoming_message in messages:
+                if not await accept_message(incoming_message):
+                    rejected += 1
+
+        if rejected:
+            # Meta ponowi całą paczkę, już przyjęte wiadomości odfiltruje deduplikacja
+            whatsapp_logger.warning(f'⏳ Rejected {rejected} message(s), asking Meta to retry')
+            return '⏳', 503
 
         return '✅', 200
 
@@ -61,6 +175,8 @@ async def webhook():
         whatsapp_logger.error(f'❌ Error processing HTTP request: {e}')
         whatsapp_logger.error(traceback.format_exc())
         return '❌', 400
+    finally:
+        record_stage('webhook', time.perf_counter() - started)
 
 
 @webhook_bp.route('/webhook', methods=['GET'])
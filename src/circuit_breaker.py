@@ -0,0 +1,147 @@
+import asyncio
+import time
+from src.config import CIRCUIT_BREAKER_FAILURE_THRESHOLD, CIRCUIT_BREAKER_RESET_TIMEOUT
+from src.logger import main_logger
+from src.metrics import Counter, Gauge
+
+CLOSED = 'closed'
+HALF_OPEN = 'half_open'
+OPEN = 'open'
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+BREAKER_STATE = Gauge('circuit_breaker_state', 'Circuit breaker state (0 closed, 1 half-open, 2 open)', ('name',))
+BREAKER_OPENED = Counter('circuit_breaker_opened_total', 'Times a circuit breaker opened', ('name',))
+BREAKER_REJECTED = Counter('circuit_breaker_rejected_total', 'Calls failed fast by an open circuit', ('name',))
+HEDGED_REQUESTS = Counter('hedged_requests_total', 'Backup requests sent because the first one was slow',
+                          ('operation', 'winner'))
+
+BREAKERS = {}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose circuit is open."""
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker for one dependency.
+
+    After `failure_threshold` failures in a row the circuit opens and calls fail fast with `CircuitOpenError`.
+    Once `reset_timeout` has passed a single probe call is let through (half-open): success closes the circuit,
+    failure opens it again. Timeouts count as failures.
+    """
+
+    def __init__(self, name, failure_threshold=CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout=CIRCUIT_BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probe_started = None
+        BREAKERS[name] = self
+        BREAKER_STATE.set(0, name=name)
+
+    def _set_state(self, state):
+        if state == self.state:
+            return
+        self.state = state
+        BREAKER_STATE.set(STATE_VALUES[state], name=self.name)
+        if state == OPEN:
+            BREAKER_OPENED.inc(name=self.name)
+            main_logger.error(f"⚡ Circuit '{self.name}' opened after {self.failures} failure(s), "
+                              f"failing fast for {self.reset_timeout:.0f}s")
+        elif state == CLOSED:
+            main_logger.info(f"✅ Circuit '{self.name}' closed")
+
+    def allow(self) -> bool:
+        """True if a call may go through now. Every allowed call must end in record_success/record_failure."""
+        if self.state == CLOSED or self.failure_threshold <= 0:
+            return True
+        now = time.monotonic()
+        if self.state == OPEN and now - self.opened_at < self.reset_timeout:
+            BREAKER_REJECTED.inc(name=self.name)
+            return False
+        # Jedno zapytanie próbne naraz; jeśli próba utknęła (np. anulowane zadanie), po czasie wpuszczamy kolejną
+        if self.probe_started is not None and now - self.probe_started < self.reset_timeout:
+            BREAKER_REJECTED.inc(name=self.name)
+            return False
+        self._set_state(HALF_OPEN)
+        self.probe_started = now
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self.probe_started = None
+        self._set_state(CLOSED)
+
+    def record_failure(self):
+        self.failures += 1
+        self.probe_started = None
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold > 0:
+            self.opened_at = time.monotonic()
+            self._set_state(OPEN)
+
+    def check(self):
+        if not self.allow():
+            raise CircuitOpenError(f"Circuit '{self.name}' is open")
+
+    async def call(self, func, timeout=None):
+        """Awaits `func()` within `timeout` seconds, failing fast while the circuit is open."""
+        self.check()
+        try:
+            result = await asyncio.wait_for(func(), timeout)
+        except asyncio.CancelledError:
+            # Anulowanie z zewnątrz nie mówi nic o stanie zależności
+            self.probe_started = None
+            raise
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+    def stats(self) -> dict:
+        return {
+            'state': self.state,
+            'failures': self.failures,
+            'retry_in': max(self.reset_timeout - (time.monotonic() - self.opened_at), 0.0)
+            if self.state == OPEN else 0.0,
+        }
+
+
+def breaker_stats() -> dict:
+    return {name: breaker.stats() for name, breaker in BREAKERS.items()}
+
+
+async def hedged(operation, func, delay):
+    """Awaits `func()`; if it has not finished after `delay` seconds, starts a second `func()` and returns
+    whichever succeeds first, cancelling the other. `delay <= 0` disables hedging."""
+    if delay <= 0:
+        return await func()
+
+    first = asyncio.ensure_future(func())
+    try:
+        done, _ = await asyncio.wait({first}, timeout=delay)
+    except asyncio.CancelledError:
+        first.cancel()
+        raise
+    if done:
+        return first.result()
+
+    backup = asyncio.ensure_future(func())
+    pending = {first, backup}
+    error = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    HEDGED_REQUESTS.inc(operation=operation, winner='backup' if task is backup else 'first')
+                    return task.result()
+                error = task.exception()
+        HEDGED_REQUESTS.inc(operation=operation, winner='none')
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
@@ -8,8 +8,64 @@ COSMOSDB_CONNECTION_STRING = os.getenv("COSMOSDB_CONNECTION_STRING")
 DB_NAME = os.getenv("DB_NAME")
 COSMOS_COLLECTION_NAME = os.getenv("COSMOS_COLLECTION_NAME")
 
+# Cosmos Vector Index Configuration (changing the options requires a rebuild: python -m src.database.manage_index rebuild)
+VECTOR_INDEX_NAME = os.getenv("VECTOR_INDEX_NAME", "vectorSearchIndex")
+VECTOR_INDEX_NUM_LISTS = int(os.getenv("VECTOR_INDEX_NUM_LISTS", 1))
+VECTOR_INDEX_SIMILARITY = os.getenv("VECTOR_INDEX_SIMILARITY", "COS")  # COS | IP | L2
+VECTOR_INDEX_DIMENSIONS = int(os.getenv("VECTOR_INDEX_DIMENSIONS", 1536))
+VECTOR_INDEX_VERIFY_INTERVAL = int(os.getenv("VECTOR_INDEX_VERIFY_INTERVAL", 60 * 60))
+
+# Retrieval Configuration
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "cosmos")  # cosmos | local
+LOCAL_INDEX_REFRESH_INTERVAL = int(os.getenv("LOCAL_INDEX_REFRESH_INTERVAL", 300))
+VECTOR_SEARCH_MIN_SCORE = float(os.getenv("VECTOR_SEARCH_MIN_SCORE", 0))  # 0 = bez progu
+RETRIEVAL_NUM_RESULTS = int(os.getenv("RETRIEVAL_NUM_RESULTS", 10))
+
+# Hybrid Retrieval Configuration (BM25 keyword index fused with vector results)
+HYBRID_RETRIEVAL_ENABLED = os.getenv("HYBRID_RETRIEVAL_ENABLED", "true").lower() == "true"
+HYBRID_NUM_RESULTS = int(os.getenv("HYBRID_NUM_RESULTS", 6))
+KEYWORD_SHORTCUT_MAX_TERMS = int(os.getenv("KEYWORD_SHORTCUT_MAX_TERMS", 3))
+KEYWORD_SHORTCUT_MAX_DOCS = int(os.getenv("KEYWORD_SHORTCUT_MAX_DOCS", 5))
+
+# Knowledge Base Ingestion Configuration (python -m src.database.ingestion)
+INGEST_CHUNK_SIZE = int(os.getenv("INGEST_CHUNK_SIZE", 300))  # words per chunk
+INGEST_CHUNK_OVERLAP = int(os.getenv("INGEST_CHUNK_OVERLAP", 50))
+INGEST_EMBEDDING_BATCH_SIZE = int(os.getenv("INGEST_EMBEDDING_BATCH_SIZE", 128))
+INGEST_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", 4))
+
 # OpenAI Configuration
 OPENAI_API_KEY = os.getenv("OPEN_AI_KEY")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-ada-002")
+CHAT_MODEL = os.getenv("CHAT_MODEL", "gpt-4o")
+
+# Latency Budget Configuration (per-attempt timeouts; EMBEDDING_HEDGE_DELAY=0 disables hedged embedding requests)
+EMBEDDING_TIMEOUT = float(os.getenv("EMBEDDING_TIMEOUT", 5))
+EMBEDDING_MAX_ATTEMPTS = int(os.getenv("EMBEDDING_MAX_ATTEMPTS", 2))
+EMBEDDING_HEDGE_DELAY = float(os.getenv("EMBEDDING_HEDGE_DELAY", 0))
+CHAT_COMPLETION_TIMEOUT = float(os.getenv("CHAT_COMPLETION_TIMEOUT", 45))
+CHAT_STREAM_IDLE_TIMEOUT = float(os.getenv("CHAT_STREAM_IDLE_TIMEOUT", 15))
+VECTOR_SEARCH_TIMEOUT = float(os.getenv("VECTOR_SEARCH_TIMEOUT", 5))
+
+# Circuit Breaker Configuration (a dependency failing this many times in a row is skipped for the reset timeout)
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_BREAKER_FAILURE_THRESHOLD", 5))
+CIRCUIT_BREAKER_RESET_TIMEOUT = float(os.getenv("CIRCUIT_BREAKER_RESET_TIMEOUT", 30))
+
+# Model Routing Configuration (greetings get canned replies, small talk goes to CHAT_MODEL_SMALL)
+MODEL_ROUTING_ENABLED = os.getenv("MODEL_ROUTING_ENABLED", "true").lower() == "true"
+CHAT_MODEL_SMALL = os.getenv("CHAT_MODEL_SMALL", "gpt-4o-mini")
+# Questions of at most this many words also go to CHAT_MODEL_SMALL. 0 keeps every knowledge-base question on
+# CHAT_MODEL; raise it only after comparing the small model's answers on real traffic
+ROUTER_SMALL_MAX_WORDS = int(os.getenv("ROUTER_SMALL_MAX_WORDS", 0))
+
+# Prompt Assembly Configuration (token budgets for retrieved chunks and chat history)
+PROMPT_CONTEXT_TOKEN_BUDGET = int(os.getenv("PROMPT_CONTEXT_TOKEN_BUDGET", 3000))
+PROMPT_HISTORY_TOKEN_BUDGET = int(os.getenv("PROMPT_HISTORY_TOKEN_BUDGET", 1500))
+PROMPT_SCORE_MARGIN = float(os.getenv("PROMPT_SCORE_MARGIN", 0.1))
+
+# Embedding Cache Configuration (EMBEDDING_CACHE_DIR enables the persistent on-disk tier)
+EMBEDDING_CACHE_MAX_SIZE = int(os.getenv("EMBEDDING_CACHE_MAX_SIZE", 10_000))
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR")
+EMBEDDING_CACHE_DISK_CAPACITY = int(os.getenv("EMBEDDING_CACHE_DISK_CAPACITY", 100_000))
 
 # WhatsApp API Configuration
 ACCESS_TOKEN = os.getenv("ACCESS_TOKEN")
@@ -17,6 +73,19 @@ META_ENDPOINT = os.getenv("META_ENDPOINT")
 PHONE_NUMBER_ID = os.getenv("PHONE_NUMBER_ID")
 WEBHOOK_VERIFY_TOKEN = os.getenv("WEBHOOK_VERIFY_TOKEN")
 
+# WhatsApp HTTP Client Configuration (Meta's default throughput tier is 80 messages per second)
+WHATSAPP_MAX_CONNECTIONS_PER_HOST = int(os.getenv("WHATSAPP_MAX_CONNECTIONS_PER_HOST", 20))
+WHATSAPP_SEND_TIMEOUT = float(os.getenv("WHATSAPP_SEND_TIMEOUT", 15))
+WHATSAPP_SEND_MAX_RETRIES = int(os.getenv("WHATSAPP_SEND_MAX_RETRIES", 3))
+WHATSAPP_RETRY_BASE_DELAY = float(os.getenv("WHATSAPP_RETRY_BASE_DELAY", 0.5))
+WHATSAPP_RETRY_MAX_DELAY = float(os.getenv("WHATSAPP_RETRY_MAX_DELAY", 10))
+WHATSAPP_RATE_LIMIT_PER_SECOND = float(os.getenv("WHATSAPP_RATE_LIMIT_PER_SECOND", 80))
+
+# Streaming Configuration (answers are sent in chunks while GPT-4o is still generating)
+STREAMING_ENABLED = os.getenv("STREAMING_ENABLED", "false").lower() == "true"
+STREAM_CHUNK_MIN_LENGTH = int(os.getenv("STREAM_CHUNK_MIN_LENGTH", 200))
+STREAM_CHUNK_MAX_LENGTH = int(os.getenv("STREAM_CHUNK_MAX_LENGTH", 1000))
+
 # Flask Configuration
 SECRET_KEY = os.getenv("SECRET_KEY")
 
@@ -26,11 +95,74 @@ MYSQL_PORT = os.getenv("MYSQL_PORT")
 MYSQL_USER = os.getenv("MYSQL_USER")
 MYSQL_PASSWORD = os.getenv("MYSQL_PASSWORD")
 MYSQL_DATABASE = os.getenv("MYSQL_DATABASE")
-POOL_CONNECT_TIMEOUT = 10
-POOL_MIN_SIZE = 3
-POOL_MAX_SIZE = 5
-ACQUIRE_CONN_TIMEOUT = 5
+MYSQL_READ_HOSTS = os.getenv("MYSQL_READ_HOSTS")  # optional read replicas: "host1:3306,host2:3306"
+POOL_CONNECT_TIMEOUT = int(os.getenv("MYSQL_POOL_CONNECT_TIMEOUT", 10))
+READ_POOL_MIN_SIZE = int(os.getenv("MYSQL_READ_POOL_MIN_SIZE", 3))
+READ_POOL_MAX_SIZE = int(os.getenv("MYSQL_READ_POOL_MAX_SIZE", 15))
+WRITE_POOL_MIN_SIZE = int(os.getenv("MYSQL_WRITE_POOL_MIN_SIZE", 3))
+WRITE_POOL_MAX_SIZE = int(os.getenv("MYSQL_WRITE_POOL_MAX_SIZE", 15))
+ACQUIRE_CONN_TIMEOUT = float(os.getenv("MYSQL_ACQUIRE_CONN_TIMEOUT", 5))
+
+# Worker Processes Configuration (WORKERS > 1 runs several Hypercorn processes; state shared between them then
+# defaults to MySQL: message dedup, per-sender ordering locks and chat history)
+WORKERS = int(os.getenv("WORKERS", 1))
+SHARED_STATE_DEFAULT = "mysql" if WORKERS > 1 else "local"
+SENDER_LOCK_BACKEND = os.getenv("SENDER_LOCK_BACKEND", SHARED_STATE_DEFAULT)  # local | mysql
+SENDER_LOCK_TIMEOUT = int(os.getenv("SENDER_LOCK_TIMEOUT", 60))
+
+# Chat History Configuration (the history cache is capped by sender count and approximate size)
+# local: per-process write-through cache with write-behind inserts; mysql: every read and write goes to MySQL
+CHAT_HISTORY_BACKEND = os.getenv("CHAT_HISTORY_BACKEND", SHARED_STATE_DEFAULT)  # local | mysql
+CHAT_HISTORY_MAX_TURNS = int(os.getenv("CHAT_HISTORY_MAX_TURNS", 5))
+CHAT_HISTORY_WINDOW_SECONDS = int(os.getenv("CHAT_HISTORY_WINDOW_SECONDS", 2 * 60 * 60))
+CHAT_HISTORY_CACHE_MAX_SENDERS = int(os.getenv("CHAT_HISTORY_CACHE_MAX_SENDERS", 10_000))
+CHAT_HISTORY_CACHE_MAX_BYTES = int(os.getenv("CHAT_HISTORY_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+USER_ID_CACHE_MAX_SIZE = int(os.getenv("USER_ID_CACHE_MAX_SIZE", 100_000))
+
+# Logging Configuration (LOG_FORMAT: text | json, json adds the request id to every line)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_DIR = os.getenv("LOG_DIR", "logs")
+
+# Query Log Write-Behind Configuration
+QUERY_LOG_BATCH_SIZE = int(os.getenv("QUERY_LOG_BATCH_SIZE", 50))
+QUERY_LOG_FLUSH_INTERVAL = float(os.getenv("QUERY_LOG_FLUSH_INTERVAL", 1.0))
+QUERY_LOG_MAX_PENDING = int(os.getenv("QUERY_LOG_MAX_PENDING", 10_000))
+QUERY_LOG_SPILL_PATH = os.getenv("QUERY_LOG_SPILL_PATH", os.path.join(LOG_DIR, "query_log_spill.jsonl"))
+
+# Message Queue Configuration
+MESSAGE_WORKER_COUNT = int(os.getenv("MESSAGE_WORKER_COUNT", 8))
+# Sender locks (SENDER_LOCK_BACKEND=mysql) hold a connection from their own pool for a whole pipeline run;
+# one per message worker means a lock never waits for a connection and the write pool is left alone
+SENDER_LOCK_POOL_SIZE = int(os.getenv("SENDER_LOCK_POOL_SIZE", MESSAGE_WORKER_COUNT))
+MESSAGE_QUEUE_MAX_SIZE = int(os.getenv("MESSAGE_QUEUE_MAX_SIZE", 1000))
+MESSAGE_QUEUE_DRAIN_TIMEOUT = float(os.getenv("MESSAGE_QUEUE_DRAIN_TIMEOUT", 30))
+# Messages a sender sends while their previous one is being answered are merged once the sender pauses
+# for the window (0 disables waiting); a message from an idle sender is processed immediately
+MESSAGE_COALESCE_WINDOW = float(os.getenv("MESSAGE_COALESCE_WINDOW", 0.4))
+MESSAGE_COALESCE_MAX_WAIT = float(os.getenv("MESSAGE_COALESCE_MAX_WAIT", 5))
+MESSAGE_COALESCE_MAX_MESSAGES = int(os.getenv("MESSAGE_COALESCE_MAX_MESSAGES", 10))
+
+# Webhook Deduplication Configuration
+DEDUP_TTL_SECONDS = int(os.getenv("DEDUP_TTL_SECONDS", 24 * 60 * 60))
+DEDUP_MAX_SIZE = int(os.getenv("DEDUP_MAX_SIZE", 100_000))
+DEDUP_BACKEND = os.getenv("DEDUP_BACKEND", SHARED_STATE_DEFAULT)  # local | mysql
+
+# Semantic Answer Cache Configuration (SEMANTIC_CACHE_MAX_SIZE=0 disables the cache)
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.97))
+SEMANTIC_CACHE_MAX_SIZE = int(os.getenv("SEMANTIC_CACHE_MAX_SIZE", 2000))
+SEMANTIC_CACHE_TTL_SECONDS = int(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", 6 * 60 * 60))
+# Shared: invalidation goes through the MySQL cache_generations table (needed with WORKERS > 1, or for the
+# ingestion CLI to invalidate a running app); otherwise the cache works without MySQL
+SEMANTIC_CACHE_SHARED = os.getenv("SEMANTIC_CACHE_SHARED", str(WORKERS > 1)).lower() == "true"
+# Co tyle sekund worker sprawdza w MySQL, czy inny proces nie unieważnił cache (0 = przy każdym odczycie)
+SEMANTIC_CACHE_SYNC_INTERVAL = float(os.getenv("SEMANTIC_CACHE_SYNC_INTERVAL", 2))
 
+# Metrics Configuration (GET /metrics requires "Authorization: Bearer <METRICS_TOKEN>" when set)
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+# Z WORKERS > 1 każdy worker zapisuje swoje metryki do METRICS_DIR, a /metrics zwraca ich sumę
+METRICS_DIR = os.getenv("METRICS_DIR", os.path.join(LOG_DIR, "metrics") if WORKERS > 1 else "")
+METRICS_EXPORT_INTERVAL = float(os.getenv("METRICS_EXPORT_INTERVAL", 5))
 
 # Server Configuration
 PORT = int(os.getenv("PORT", 8080))
@@ -0,0 +1,91 @@
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+from src.config import CHAT_HISTORY_MAX_TURNS, CHAT_HISTORY_WINDOW_SECONDS, CHAT_HISTORY_CACHE_MAX_SENDERS, \
+    CHAT_HISTORY_CACHE_MAX_BYTES
+from src.metrics import CacheMetrics
+
+# Przybliżony narzut pamięci na jeden wpis (dict, deque, krotka) poza samym tekstem
+ENTRY_OVERHEAD_BYTES = 400
+
+
+class ChatHistoryCache:
+    """Write-through cache of the last turns of each conversation.
+
+    Each sender has a ring buffer of at most `max_turns` entries, each with its own expiry at the end of the
+    history window. A cached sender is authoritative: once loaded from MySQL, new turns are appended by
+    `insert_data_mysql`, so reads never go back to the database. Senders are evicted least recently used
+    first when either `max_senders` or the approximate `max_bytes` budget is exceeded.
+    """
+
+    def __init__(self, max_turns=CHAT_HISTORY_MAX_TURNS, window_seconds=CHAT_HISTORY_WINDOW_SECONDS,
+                 max_senders=CHAT_HISTORY_CACHE_MAX_SENDERS, max_bytes=CHAT_HISTORY_CACHE_MAX_BYTES):
+        self.max_turns = max_turns
+        self.window_seconds = window_seconds
+        self.max_senders = max_senders
+        self.max_bytes = max_bytes
+        self.buffers = OrderedDict()  # whatsapp_number_id -> deque of (expires_at, entry), oldest first
+        self.sizes = {}  # whatsapp_number_id -> approximate bytes
+        self.total_bytes = 0
+        self.lookups = CacheMetrics('chat_history')
+
+    @staticmethod
+    def _entry_size(entry):
+        return len(entry['query']) + len(entry['answer']) + ENTRY_OVERHEAD_BYTES
+
+    def get(self, whatsapp_number_id):
+        """Returns the history newest first (like the SQL query), or None if the sender is not cached."""
+        buffer = self.buffers.get(whatsapp_number_id)
+        if buffer is None:
+            self.lookups.miss()
+            return None
+
+        now = time.monotonic()
+        while buffer and buffer[0][0] <= now:
+            _, entry = buffer.popleft()
+            self._resize(whatsapp_number_id, -self._entry_size(entry))
+
+        self.buffers.move_to_end(whatsapp_number_id)
+        self.lookups.hit()
+        return [entry for _, entry in reversed(buffer)]
+
+    def load(self, whatsapp_number_id, chat_history, ages):
+        """Stores history read from MySQL (newest first) with each entry's age in seconds."""
+        self.evict(whatsapp_number_id)
+        now = time.monotonic()
+        buffer = deque(maxlen=self.max_turns)
+        for entry, age in zip(reversed(chat_history), reversed(ages)):
+            buffer.append((now + self.window_seconds - age, entry))
+        self.buffers[whatsapp_number_id] = buffer
+        self.sizes[whatsapp_number_id] = 0
+        self._resize(whatsapp_number_id, sum(self._entry_size(entry) for _, entry in buffer))
+        self._enforce_limits()
+
+    def append(self, whatsapp_number_id, query, answer):
+        buffer = self.buffers.get(whatsapp_number_id)
+        if buffer is None:
+            # Niezaładowany nadawca: następny odczyt i tak pójdzie do MySQL
+            return
+        entry = {"query": query, "answer": answer, "created_at": datetime.now().isoformat()}
+        if len(buffer) == buffer.maxlen:
+            self._resize(whatsapp_number_id, -self._entry_size(buffer[0][1]))
+        buffer.append((time.monotonic() + self.window_seconds, entry))
+        self._resize(whatsapp_number_id, self._entry_size(entry))
+        self.buffers.move_to_end(whatsapp_number_id)
+        self._enforce_limits()
+
+    def evict(self, whatsapp_number_id):
+        if self.buffers.pop(whatsapp_number_id, None) is not None:
+            self.total_bytes -= self.sizes.pop(whatsapp_number_id, 0)
+
+    def _resize(self, whatsapp_number_id, delta):
+        self.sizes[whatsapp_number_id] += delta
+        self.total_bytes += delta
+
+    def _enforce_limits(self):
+        while self.buffers and (len(self.buffers) > self.max_senders or self.total_bytes > self.max_bytes):
+            oldest_sender = next(iter(self.buffers))
+            self.evict(oldest_sender)
+
+    def stats(self) -> dict:
+        return {**self.lookups.stats(len(self.buffers)), 'bytes': self.total_bytes}
@@ -0,0 +1,174 @@
+"""Knowledge base ingestion into the Cosmos collection.
+
+Usage:
+    python -m src.database.ingestion docs/                # every .txt / .md file under docs/
+    python -m src.database.ingestion handbook.txt --dry-run
+
+Pages are separated by form feeds (as produced by `pdftotext`), the file name becomes the title. Every page is
+split into overlapping word chunks, and chunks whose content hash is already stored are skipped, so re-running
+the ingestion only embeds what changed. When anything was written or deleted, the semantic answer cache of the
+running app is invalidated through MySQL (see `SemanticCache`).
+"""
+import argparse
+import asyncio
+import hashlib
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from src.logger import cosmosdb_logger
+from src.config import EMBEDDING_MODEL, INGEST_CHUNK_SIZE, INGEST_CHUNK_OVERLAP, INGEST_EMBEDDING_BATCH_SIZE, \
+    INGEST_CONCURRENCY
+from src.ai.openai_client import OpenAIClient
+from src.database.mongodb_client import MongoDBClient, count_words
+from src.database.mysql_queries import initialize_connection_pools, close_connection_pools, bump_cache_generation
+from src.ai.semantic_cache import GENERATION_NAME
+
+SUPPORTED_SUFFIXES = ('.txt', '.md')
+
+
+def iter_source_files(paths):
+    for path in map(Path, paths):
+        if path.is_dir():
+            yield from sorted(p for p in path.rglob('*') if p.suffix.lower() in SUPPORTED_SUFFIXES)
+        else:
+            yield path
+
+
+def chunk_words(text, chunk_size=INGEST_CHUNK_SIZE, overlap=INGEST_CHUNK_OVERLAP):
+    words = text.split()
+    step = max(chunk_size - overlap, 1)
+    for start in range(0, len(words), step):
+        yield ' '.join(words[start:start + chunk_size])
+        if start + chunk_size >= len(words):
+            break
+
+
+def content_hash(title, page_number, content):
+    # Model embeddingów jest częścią hasha - zmiana modelu wymusza ponowne przeliczenie wektorów
+    return hashlib.sha256(f"{EMBEDDING_MODEL}\0{title}\0{page_number}\0{content}".encode('utf-8')).hexdigest()
+
+
+def read_chunks(path, chunk_size=INGEST_CHUNK_SIZE, overlap=INGEST_CHUNK_OVERLAP):
+    text = path.read_text(encoding='utf-8')
+    title = path.stem.replace('_', ' ')
+    chunks = []
+    for page_number, page in enumerate(text.split('\f'), 1):
+        for chunk_index, content in enumerate(chunk_words(page, chunk_size, overlap)):
+            chunks.append({
+                "source": str(path),
+                "title": title,
+                "pageNumber": page_number,
+                "chunkIndex": chunk_index,
+                "content": content,
+                "wordCount": count_words(content),
+                "contentHash": content_hash(title, page_number, content),
+            })
+    return chunks
+
+
+class Ingestion:
+    def __init__(self, mongodb_client, openai_client, batch_size=INGEST_EMBEDDING_BATCH_SIZE,
+                 concurrency=INGEST_CONCURRENCY, dry_run=False):
+        self.mongodb_client = mongodb_client
+        self.openai_client = openai_client
+        self.batch_size = batch_size
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.dry_run = dry_run
+        self.stats = {'chunks': 0, 'skipped': 0, 'embedded': 0, 'written': 0, 'failed': 0, 'deleted': 0}
+
+    async def run(self, paths, chunk_size=INGEST_CHUNK_SIZE, overlap=INGEST_CHUNK_OVERLAP):
+        started = time.perf_counter()
+        if not self.dry_run:
+            await self.mongodb_client.ensure_ingestion_indexes()
+
+        pending = []
+        sources = {}  # source -> hashes of its current chunks
+        for path in iter_source_files(paths):
+            chunks = read_chunks(path, chunk_size, overlap)
+            hashes = {chunk["contentHash"] for chunk in chunks}
+            existing = await self.mongodb_client.existing_content_hashes(hashes) if hashes else set()
+            changed = [chunk for chunk in chunks if chunk["contentHash"] not in existing]
+            self.stats['chunks'] += len(chunks)
+            self.stats['skipped'] += len(chunks) - len(changed)
+            pending.extend(changed)
+            sources[str(path)] = hashes
+            cosmosdb_logger.info(f"📄 {path}: {len(chunks)} chunk(s), {len(changed)} new or changed")
+
+        batches = [pending[start:start + self.batch_size] for start in range(0, len(pending), self.batch_size)]
+        await asyncio.gather(*(self._process_batch(batch) for batch in batches))
+
+        # Stare wersje fragmentów usuwamy dopiero po zapisaniu nowych, i tylko gdy nic się nie wysypało
+        if not self.dry_run and not self.stats['failed']:
+            for source, hashes in sources.items():
+                self.stats['deleted'] += await self.mongodb_client.delete_stale_chunks(source, hashes)
+
+        elapsed = time.perf_counter() - started
+        rate = self.stats['embedded'] / elapsed if elapsed else 0
+        cosmosdb_logger.info(f"✅ Ingestion finished in {elapsed:.1f}s ({rate:.1f} chunks/s): {self.stats}")
+        return self.stats
+
+    async def _process_batch(self, batch):
+        async with self.semaphore:
+            if self.dry_run:
+                return
+            try:
+                # _create_embeddings ponawia zapytanie z wykładniczym opóźnieniem, tu trafia dopiero ostateczny błąd
+                embeddings = await self.openai_client.generate_embeddings_batch(
+                    [chunk["content"] for chunk in batch], use_cache=False)
+                self.stats['embedded'] += len(batch)
+
+                created_at = datetime.now(timezone.utc)
+                for chunk, embedding in zip(batch, embeddings):
+                    chunk["vector"] = embedding
+                    # Lokalny indeks dociąga zmiany po createdAt, więc zmieniony fragment dostaje nową datę
+                    chunk["createdAt"] = created_at
+                self.stats['written'] += await self.mongodb_client.upsert_chunks(batch)
+            except Exception as e:
+                self.stats['failed'] += len(batch)
+                cosmosdb_logger.error(f"❌ Failed to ingest a batch of {len(batch)} chunk(s): {e}")
+
+
+async def invalidate_answers():
+    # Odpowiedzi w cache semantycznym aplikacji mogą opierać się na zmienionych fragmentach
+    if not await initialize_connection_pools():
+        cosmosdb_logger.warning("⚠️ MySQL unavailable, invalidate the semantic cache with "
+                                "POST /admin/semantic-cache/invalidate")
+        return
+    try:
+        if await bump_cache_generation(GENERATION_NAME) is not None:
+            cosmosdb_logger.info("🧹 Semantic cache invalidated for all workers")
+    finally:
+        await close_connection_pools()
+
+
+async def run(args):
+    mongodb_client = MongoDBClient()
+    openai_client = OpenAIClient()
+    try:
+        ingestion = Ingestion(mongodb_client, openai_client, batch_size=args.batch_size,
+                              concurrency=args.concurrency, dry_run=args.dry_run)
+        stats = await ingestion.run(args.paths, chunk_size=args.chunk_size, overlap=args.overlap)
+        if stats['written'] or stats['deleted']:
+            await invalidate_answers()
+        return 1 if stats['failed'] else 0
+    finally:
+        await openai_client.embedding_cache.close()
+        mongodb_client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Knowledge base ingestion into Cosmos")
+    parser.add_argument('paths', nargs='+', help="files or directories to ingest")
+    parser.add_argument('--chunk-size', type=int, default=INGEST_CHUNK_SIZE, help="words per chunk")
+    parser.add_argument('--overlap', type=int, default=INGEST_CHUNK_OVERLAP, help="words shared by adjacent chunks")
+    parser.add_argument('--batch-size', type=int, default=INGEST_EMBEDDING_BATCH_SIZE,
+                        help="chunks per embeddings request")
+    parser.add_argument('--concurrency', type=int, default=INGEST_CONCURRENCY,
+                        help="embeddings requests in flight")
+    parser.add_argument('--dry-run', action='store_true', help="only report which chunks would be embedded")
+    args = parser.parse_args()
+    raise SystemExit(asyncio.run(run(args)))
+
+
+if __name__ == '__main__':
+    main()
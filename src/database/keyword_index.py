@@ -0,0 +1,185 @@
+import asyncio
+import math
+import re
+from collections import Counter
+from src.logger import cosmosdb_logger
+from src.config import LOCAL_INDEX_REFRESH_INTERVAL, KEYWORD_SHORTCUT_MAX_TERMS, KEYWORD_SHORTCUT_MAX_DOCS
+
+WORD_PATTERN = re.compile(r"\w+")
+# Numery telefonów i identyfikatory zapisywane z separatorami ("+48 123-456-789") indeksujemy też jako same cyfry
+NUMBER_PATTERN = re.compile(r"\+?\d[\d\s\-./]{4,}\d")
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+RRF_K = 60
+
+
+def tokenize(text):
+    text = (text or '').lower()
+    tokens = WORD_PATTERN.findall(text)
+    for number in NUMBER_PATTERN.findall(text):
+        digits = re.sub(r"\D", "", number)
+        if digits not in tokens:
+            tokens.append(digits)
+    return tokens
+
+
+def reciprocal_rank_fusion(result_lists, k=RRF_K):
+    """Merges ranked result lists by summing 1 / (k + rank). Documents are matched by `_id`, and the first
+    occurrence keeps its fields (so vector results keep their `similarityScore`)."""
+    fused = {}
+    for results in result_lists:
+        for rank, result in enumerate(results, 1):
+            entry = fused.get(result['_id'])
+            if entry is None:
+                entry = fused[result['_id']] = {**result, 'fusedScore': 0.0}
+            entry['fusedScore'] += 1.0 / (k + rank)
+    return sorted(fused.values(), key=lambda result: result['fusedScore'], reverse=True)
+
+
+class KeywordIndex:
+    """In-memory BM25 inverted index over the same Cosmos chunks as the vector search.
+
+    Embeddings are weak on short queries such as product names, acronyms or phone numbers, while an exact
+    term match ranks them well; the two result lists are merged with `reciprocal_rank_fusion`. Documents are
+    loaded without their vectors and refreshed incrementally by `createdAt`, like `LocalVectorIndex`, which also
+    drops documents deleted in Cosmos on every periodic refresh.
+    """
+
+    def __init__(self, mongodb_client, refresh_interval=LOCAL_INDEX_REFRESH_INTERVAL):
+        self.mongodb_client = mongodb_client
+        self.refresh_interval = refresh_interval
+        self.postings = {}  # term -> {row: term frequency}
+        self.documents = []
+        self.lengths = []
+        self.terms = []  # row -> terms of the document, needed to drop its postings when it is replaced
+        self.rows = {}  # _id -> row
+        self.total_length = 0
+        self.last_created_at = None
+        self.loaded = False
+        self._refresh_lock = asyncio.Lock()
+        self._refresh_task = None
+
+    async def start(self):
+        await self.refresh()
+        if self.refresh_interval > 0 and self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_periodically())
+
+    async def stop(self):
+        if self._refresh_task:
+            self._refresh_task.cancel()
+            await asyncio.gather(self._refresh_task, return_exceptions=True)
+            self._refresh_task = None
+
+    async def _refresh_periodically(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh(reconcile=True)
+            except Exception as e:
+                cosmosdb_logger.error(f"❌ Keyword index refresh failed: {e}")
+
+    async def refresh(self, reconcile=False):
+        async with self._refresh_lock:
+            if reconcile:
+                await self._reconcile()
+            documents = await self.mongodb_client.fetch_vector_documents(created_after=self.last_created_at,
+                                                                         include_vector=False)
+            for document in documents:
+                self._upsert(document)
+            if documents:
+                cosmosdb_logger.info(f"📥 Keyword index loaded {len(documents)} document(s), "
+                                     f"{len(self.documents)} in total, {len(self.postings)} terms")
+            self.loaded = True
+
+    async def _reconcile(self):
+        existing = await self.mongodb_client.fetch_vector_document_ids()
+        removed = [document_id for document_id in self.rows if document_id not in existing]
+        for document_id in removed:
+            self._remove(document_id)
+        if removed:
+            cosmosdb_logger.info(f"🗑️ Keyword index dropped {len(removed)} deleted document(s), "
+                                 f"{len(self.documents)} left")
+
+    def _drop_postings(self, row):
+        for term in self.terms[row]:
+            postings = self.postings[term]
+            postings.pop(row, None)
+            if not postings:
+                del self.postings[term]
+
+    def _remove(self, document_id):
+        # Ostatni dokument przenosimy na miejsce usuniętego, razem z jego wpisami w postings
+        row = self.rows.pop(document_id)
+        self._drop_postings(row)
+        self.total_length -= self.lengths[row]
+        last = len(self.documents) - 1
+        if row != last:
+            for term in self.terms[last]:
+                postings = self.postings[term]
+                postings[row] = postings.pop(last)
+            self.documents[row] = self.documents[last]
+            self.lengths[row] = self.lengths[last]
+            self.terms[row] = self.terms[last]
+            self.rows[self.documents[row]['_id']] = row
+        self.documents.pop()
+        self.lengths.pop()
+        self.terms.pop()
+
+    def _upsert(self, document):
+        counts = Counter(tokenize(f"{document.get('title') or ''} {document.get('content') or ''}"))
+        length = sum(counts.values())
+
+        row = self.rows.get(document['_id'])
+        if row is None:
+            row = len(self.documents)
+            self.rows[document['_id']] = row
+            self.documents.append(document)
+            self.lengths.append(length)
+            self.terms.append(tuple(counts))
+        else:
+            self._drop_postings(row)
+            self.total_length -= self.lengths[row]
+            self.documents[row] = document
+            self.lengths[row] = length
+            self.terms[row] = tuple(counts)
+
+        self.total_length += length
+        for term, count in counts.items():
+            self.postings.setdefault(term, {})[row] = count
+
+        created_at = document.get('createdAt')
+        if created_at is not None and (self.last_created_at is None or created_at > self.last_created_at):
+            self.last_created_at = created_at
+
+    def search(self, query, num_results=10):
+        """Returns up to `num_results` documents ranked by BM25, each with its `keywordScore`."""
+        if not self.documents:
+            return []
+        count = len(self.documents)
+        average_length = self.total_length / count or 1
+        scores = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for row, frequency in postings.items():
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[row] / average_length)
+                scores[row] = scores.get(row, 0.0) + idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:int(num_results)]
+        return [{**self.documents[row], 'keywordScore': score} for row, score in ranked]
+
+    def is_exact_match(self, query, results):
+        """True for short queries whose every term is rare in the corpus and present in the best result, e.g. a
+        product name or phone number. Such queries are answered from keyword results without an embedding."""
+        terms = set(tokenize(query))
+        if not results or not terms or len(terms) > KEYWORD_SHORTCUT_MAX_TERMS:
+            return False
+        best_row = self.rows.get(results[0]['_id'])
+        for term in terms:
+            postings = self.postings.get(term)
+            if not postings or len(postings) > KEYWORD_SHORTCUT_MAX_DOCS or best_row not in postings:
+                return False
+        return True
@@ -0,0 +1,137 @@
+import asyncio
+import numpy as np
+from src.logger import cosmosdb_logger
+from src.config import LOCAL_INDEX_REFRESH_INTERVAL, VECTOR_SEARCH_MIN_SCORE
+from src.database.mongodb_client import count_words
+
+
+def top_k(scores, k):
+    """Indices of the `k` highest scores, best first, without sorting the whole array."""
+    k = min(k, scores.shape[0])
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < scores.shape[0]:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(scores.shape[0])
+    return candidates[np.argsort(-scores[candidates])]
+
+
+class LocalVectorIndex:
+    """In-process replacement for the Cosmos `$search` stage.
+
+    All documents with a `vector` are loaded once into a contiguous, L2-normalised float32 matrix, so a
+    top-k cosine query is one matmul plus `argpartition`. New documents are picked up incrementally by polling
+    for `createdAt` values at or after the newest one already loaded; every periodic refresh also compares the
+    loaded `_id`s with Cosmos and drops documents that were deleted there.
+    """
+
+    def __init__(self, mongodb_client, refresh_interval=LOCAL_INDEX_REFRESH_INTERVAL):
+        self.mongodb_client = mongodb_client
+        self.refresh_interval = refresh_interval
+        self.matrix = None
+        self.size = 0
+        self.documents = []  # metadata without the vector, row-aligned with `matrix`
+        self.rows = {}  # _id -> row
+        self.last_created_at = None
+        self.loaded = False
+        self._refresh_lock = asyncio.Lock()
+        self._refresh_task = None
+
+    async def start(self):
+        await self.refresh()
+        if self.refresh_interval > 0 and self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._refresh_periodically())
+
+    async def stop(self):
+        if self._refresh_task:
+            self._refresh_task.cancel()
+            await asyncio.gather(self._refresh_task, return_exceptions=True)
+            self._refresh_task = None
+
+    async def _refresh_periodically(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh(reconcile=True)
+            except Exception as e:
+                cosmosdb_logger.error(f"❌ Local vector index refresh failed: {e}")
+
+    async def refresh(self, reconcile=False):
+        async with self._refresh_lock:
+            if reconcile:
+                await self._reconcile()
+            documents = await self.mongodb_client.fetch_vector_documents(created_after=self.last_created_at)
+            for document in documents:
+                self._upsert(document)
+            if documents:
+                cosmosdb_logger.info(f"📥 Local vector index loaded {len(documents)} document(s), "
+                                     f"{self.size} in total")
+            self.loaded = True
+
+    async def _reconcile(self):
+        existing = await self.mongodb_client.fetch_vector_document_ids()
+        removed = [document_id for document_id in self.rows if document_id not in existing]
+        for document_id in removed:
+            self._remove(document_id)
+        if removed:
+            cosmosdb_logger.info(f"🗑️ Local vector index dropped {len(removed)} deleted document(s), "
+                                 f"{self.size} left")
+
+    def _remove(self, document_id):
+        # Ostatni wiersz przenosimy na miejsce usuniętego, żeby macierz pozostała ciągła
+        row = self.rows.pop(document_id)
+        last = self.size - 1
+        if row != last:
+            self.matrix[row] = self.matrix[last]
+            self.documents[row] = self.documents[last]
+            self.rows[self.documents[row]['_id']] = row
+        self.documents.pop()
+        self.size -= 1
+
+    def _upsert(self, document):
+        vector = np.array(document.pop('vector'), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if norm:
+            vector /= norm
+
+        if self.matrix is None:
+            self.matrix = np.zeros((1024, vector.shape[0]), dtype=np.float32)
+        elif vector.shape[0] != self.matrix.shape[1]:
+            cosmosdb_logger.warning(f"⚠️ Skipping document {document.get('_id')} with a "
+                                    f"{vector.shape[0]}-dimensional vector")
+            return
+
+        if 'wordCount' not in document:
+            document['wordCount'] = count_words(document.get('content'))  # dokumenty sprzed backfillu
+
+        row = self.rows.get(document['_id'])
+        if row is None:
+            row = self.size
+            if row == self.matrix.shape[0]:
+                self.matrix = np.concatenate([self.matrix, np.zeros_like(self.matrix)])
+            self.size += 1
+            self.rows[document['_id']] = row
+            self.documents.append(document)
+        else:
+            self.documents[row] = document
+
+        self.matrix[row] = vector
+        created_at = document.get('createdAt')
+        if created_at is not None and (self.last_created_at is None or created_at > self.last_created_at):
+            self.last_created_at = created_at
+
+    def search(self, query_embedding, num_results=10, min_score=VECTOR_SEARCH_MIN_SCORE):
+        if not self.size:
+            return []
+        query = np.asarray(query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+
+        scores = self.matrix[:self.size] @ query
+        return [
+            {**self.documents[row], 'similarityScore': float(scores[row])}
+            for row in top_k(scores, int(num_results))
+            if not min_score or scores[row] >= min_score
+        ]
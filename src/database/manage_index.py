@@ -0,0 +1,38 @@
+"""Vector index maintenance for the Cosmos collection.
+
+Usage:
+    python -m src.database.manage_index verify   # create the index if it is missing
+    python -m src.database.manage_index rebuild  # drop and recreate it with the configured options
+    python -m src.database.manage_index backfill-word-count  # store wordCount on documents that lack it
+"""
+import argparse
+import asyncio
+from src.logger import cosmosdb_logger
+from src.database.mongodb_client import MongoDBClient
+
+
+async def run(command):
+    mongodb_client = MongoDBClient()
+    try:
+        if command == 'backfill-word-count':
+            await mongodb_client.backfill_word_counts()
+            cosmosdb_logger.info("✅ Word count backfill finished")
+            return
+        if command == 'rebuild':
+            await mongodb_client.rebuild_vector_search_index()
+        else:
+            await mongodb_client.ensure_vector_search_index(force=True)
+        cosmosdb_logger.info(f"✅ Vector index {command} finished with options {MongoDBClient.vector_index_options()}")
+    finally:
+        mongodb_client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cosmos vector index maintenance")
+    parser.add_argument('command', choices=['verify', 'rebuild', 'backfill-word-count'])
+    args = parser.parse_args()
+    asyncio.run(run(args.command))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,23 @@
-from pymongo import MongoClient
+import asyncio
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
 from pymongo.errors import ConnectionFailure
 import logging
-from src.config import COSMOSDB_CONNECTION_STRING, DB_NAME, COSMOS_COLLECTION_NAME
+from src.tracing import trace_stage
+from src.circuit_breaker import CircuitBreaker, CircuitOpenError
+from src.config import COSMOSDB_CONNECTION_STRING, DB_NAME, COSMOS_COLLECTION_NAME, VECTOR_INDEX_NAME, \
+    VECTOR_INDEX_NUM_LISTS, VECTOR_INDEX_SIMILARITY, VECTOR_INDEX_DIMENSIONS, VECTOR_INDEX_VERIFY_INTERVAL, \
+    VECTOR_SEARCH_MIN_SCORE, VECTOR_SEARCH_TIMEOUT
+
+# Pola dokumentu zwracane przez wyszukiwanie - tylko to, czego potrzebuje prompt (bez wektora)
+SEARCH_RESULT_FIELDS = ("content", "title", "pageNumber", "createdAt", "wordCount")
+
+vector_search_breaker = CircuitBreaker('vector_search')
+
+
+def count_words(content) -> int:
+    """Word count stored with every document at ingestion time, so searches do not have to compute it."""
+    return len((content or '').split(' '))
 
 
 class MongoDBClient:
@@ -19,79 +35,212 @@ class MongoDBClient:
         self.client = None
         self.db = None
         self.collection = None
+        self._connect_lock = asyncio.Lock()
+        self._index_lock = asyncio.Lock()
+        self._index_verified = False
+        self._index_verification_task = None
         self.__initialized = True
 
-    def connect(self):
-        if self.client is None:
+    async def connect(self):
+        async with self._connect_lock:
+            if self.client is not None:
+                return
+            client = AsyncIOMotorClient(COSMOSDB_CONNECTION_STRING)
             try:
-                self.client = MongoClient(COSMOSDB_CONNECTION_STRING)
-                self.client.admin.command("ismaster")
-                self.db = self.client[DB_NAME]
-                self.collection = self.db[COSMOS_COLLECTION_NAME]
-                logging.info("MongoDB connection established successfully.")
+                await client.admin.command("ismaster")
             except ConnectionFailure as e:
+                client.close()
                 logging.error(f"Could not connect to MongoDB due to: {e}")
                 raise ConnectionError("Failed to connect to MongoDB.") from e
+            except asyncio.CancelledError:
+                # Przekroczony limit czasu wyszukiwania - nie zostawiamy otwartego klienta
+                client.close()
+                raise
+            self.client = client
+            self.db = self.client[DB_NAME]
+            self.collection = self.db[COSMOS_COLLECTION_NAME]
+            logging.info("MongoDB connection established successfully.")
 
-    def ensure_connection(self):
+    async def ensure_connection(self):
         if self.client is None or self.db is None or self.collection is None:
-            self.connect()
+            await self.connect()
 
-    def ensure_vector_search_index(self):
-        self.ensure_connection()
-        try:
-            index_name = "vectorSearchIndex"
-            existing_indexes = list(self.collection.list_indexes())
-            if any(index["name"] == index_name for index in existing_indexes):
-                logging.info(f"Vector search index {index_name} already exists")
+    @staticmethod
+    def vector_index_options():
+        return {
+            "kind": "vector-ivf",
+            "numLists": VECTOR_INDEX_NUM_LISTS,
+            "similarity": VECTOR_INDEX_SIMILARITY,
+            "dimensions": VECTOR_INDEX_DIMENSIONS
+        }
+
+    async def ensure_vector_search_index(self, force=False):
+        """Creates the vector index if it is missing. The result is cached, so only the first call (or a forced
+        re-check) costs a `list_indexes()` round trip."""
+        if self._index_verified and not force:
+            return
+        await self.ensure_connection()
+        async with self._index_lock:
+            if self._index_verified and not force:
                 return
+            try:
+                with trace_stage('ensure_vector_index'):
+                    existing_indexes = await self.collection.list_indexes().to_list(length=None)
+                if any(index["name"] == VECTOR_INDEX_NAME for index in existing_indexes):
+                    logging.info(f"Vector search index {VECTOR_INDEX_NAME} already exists")
+                else:
+                    await self.collection.create_index(
+                        [("vector", "cosmosSearch")],
+                        name=VECTOR_INDEX_NAME,
+                        cosmosSearchOptions=self.vector_index_options()
+                    )
+                    logging.info(f"Index {VECTOR_INDEX_NAME} created successfully")
+                self._index_verified = True
+            except Exception as e:
+                self._index_verified = False
+                logging.error(f"Error creating vector search index: {e}", exc_info=True)
+                raise
 
-            self.collection.create_index(
-                [("vector", "cosmosSearch")],
-                name=index_name,
-                cosmosSearchOptions={
-                    "kind": "vector-ivf",
-                    "numLists": 1,
-                    "similarity": "COS",
-                    "dimensions": 1536
-                }
-            )
-            logging.info(f"Index {index_name} created successfully")
-        except Exception as e:
-            logging.error(f"Error creating vector search index: {e}", exc_info=True)
-            raise
+    async def rebuild_vector_search_index(self):
+        """Drops and recreates the vector index, e.g. after changing numLists, similarity or dimensions."""
+        await self.ensure_connection()
+        async with self._index_lock:
+            self._index_verified = False
+            existing_indexes = await self.collection.list_indexes().to_list(length=None)
+            if any(index["name"] == VECTOR_INDEX_NAME for index in existing_indexes):
+                await self.collection.drop_index(VECTOR_INDEX_NAME)
+                logging.info(f"Index {VECTOR_INDEX_NAME} dropped")
+        await self.ensure_vector_search_index(force=True)
+
+    def start_index_verification(self, interval=VECTOR_INDEX_VERIFY_INTERVAL):
+        if interval > 0 and self._index_verification_task is None:
+            self._index_verification_task = asyncio.create_task(self._verify_index_periodically(interval))
+
+    async def stop_index_verification(self):
+        if self._index_verification_task:
+            self._index_verification_task.cancel()
+            await asyncio.gather(self._index_verification_task, return_exceptions=True)
+            self._index_verification_task = None
+
+    async def _verify_index_periodically(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.ensure_vector_search_index(force=True)
+            except Exception as e:
+                logging.error(f"Periodic vector search index verification failed: {e}")
 
-    def vector_search(self, query_embedding, num_results=10):
-        self.ensure_connection()
+    async def vector_search(self, query_embedding, num_results=10, min_score=VECTOR_SEARCH_MIN_SCORE,
+                            fields=SEARCH_RESULT_FIELDS):
+        """Returns up to `num_results` documents with their `similarityScore`. Only `fields` are projected, and
+        documents scoring below `min_score` are filtered out server-side (a falsy `min_score` disables it).
+        Bounded by VECTOR_SEARCH_TIMEOUT. A timeout or an open circuit is raised, so callers can tell an outage
+        from an empty result; other errors are logged and give []."""
         try:
-            k = int(num_results)
-            results = self.collection.aggregate([
-                {
-                    "$search": {
-                        "cosmosSearch": {
-                            "vector": query_embedding,
-                            "path": "vector",
-                            "k": k
-                        }
-                    }
-                },
-                {
-                    "$project": {
-                        "similarityScore": {"$meta": "searchScore"},
-                        "content": 1,
-                        "_id": 1,
-                        "title": 1,
-                        "pageNumber": 1,
-                        "createdAt": 1,
-                        "wordCount": {"$size": {"$split": ["$content", " "]}}
+            return await vector_search_breaker.call(
+                lambda: self._vector_search(query_embedding, num_results, min_score, fields),
+                timeout=VECTOR_SEARCH_TIMEOUT)
+        except (CircuitOpenError, asyncio.TimeoutError) as e:
+            logging.error(f"Vector search unavailable: {e!r}")
+            raise
+        except Exception as e:
+            logging.error(f"Vector search operation failed: {e!r}", exc_info=True)
+            return []
+
+    async def _vector_search(self, query_embedding, num_results, min_score, fields):
+        await self.ensure_connection()
+        k = int(num_results)
+        pipeline = [
+            {
+                "$search": {
+                    "cosmosSearch": {
+                        "vector": query_embedding,
+                        "path": "vector",
+                        "k": k
                     }
                 }
-            ])
+            },
+            {
+                "$project": {
+                    "similarityScore": {"$meta": "searchScore"},
+                    **{field: 1 for field in fields}
+                }
+            }
+        ]
+        if min_score:
+            pipeline.append({"$match": {"similarityScore": {"$gte": min_score}}})
+        cursor = self.collection.aggregate(pipeline)
 
-            return list(results)
-        except Exception as e:
-            logging.error(f"Vector search operation failed: {e}", exc_info=True)
-            return []
+        return await cursor.to_list(length=None)
+
+    async def fetch_vector_documents(self, created_after=None, include_vector=True):
+        """Returns every document with a `vector`, optionally only those created at or after `created_after`."""
+        await self.ensure_connection()
+        query = {"vector": {"$exists": True}}
+        if created_after is not None:
+            # $gte, a nie $gt - dokumenty z tym samym createdAt mogły dojść później, duplikaty nadpisujemy po _id
+            query["createdAt"] = {"$gte": created_after}
+        projection = {field: 1 for field in SEARCH_RESULT_FIELDS}
+        if include_vector:
+            projection["vector"] = 1
+        cursor = self.collection.find(query, projection)
+        return await cursor.to_list(length=None)
+
+    async def backfill_word_counts(self, batch_size=500):
+        """Stores `wordCount` on documents ingested before it was computed at ingestion time."""
+        await self.ensure_connection()
+        cursor = self.collection.find({"wordCount": {"$exists": False}}, {"content": 1})
+        updated = 0
+        operations = []
+        async for document in cursor:
+            operations.append(UpdateOne({"_id": document["_id"]},
+                                        {"$set": {"wordCount": count_words(document.get("content"))}}))
+            if len(operations) >= batch_size:
+                await self.collection.bulk_write(operations, ordered=False)
+                updated += len(operations)
+                operations = []
+        if operations:
+            await self.collection.bulk_write(operations, ordered=False)
+            updated += len(operations)
+        logging.info(f"Stored wordCount on {updated} document(s)")
+        return updated
+
+    async def existing_content_hashes(self, content_hashes):
+        """Returns the subset of `content_hashes` already stored, so ingestion can skip unchanged chunks."""
+        await self.ensure_connection()
+        cursor = self.collection.find({"contentHash": {"$in": list(content_hashes)}}, {"contentHash": 1, "_id": 0})
+        return {document["contentHash"] for document in await cursor.to_list(length=None)}
+
+    async def fetch_vector_document_ids(self) -> set:
+        """`_id` of every document with a `vector` - lets in-memory indexes drop documents deleted in Cosmos."""
+        await self.ensure_connection()
+        cursor = self.collection.find({"vector": {"$exists": True}}, {"_id": 1})
+        return {document["_id"] for document in await cursor.to_list(length=None)}
+
+    async def upsert_chunks(self, chunks):
+        """Writes chunks in one unordered bulk_write, keyed by (source, pageNumber, chunkIndex)."""
+        await self.ensure_connection()
+        operations = [
+            UpdateOne(
+                {"source": chunk["source"], "pageNumber": chunk["pageNumber"], "chunkIndex": chunk["chunkIndex"]},
+                {"$set": chunk},
+                upsert=True
+            )
+            for chunk in chunks
+        ]
+        result = await self.collection.bulk_write(operations, ordered=False)
+        return result.upserted_count + result.modified_count
+
+    async def delete_stale_chunks(self, source, content_hashes):
+        """Removes chunks of `source` that are no longer produced by its current content."""
+        await self.ensure_connection()
+        result = await self.collection.delete_many({"source": source, "contentHash": {"$nin": list(content_hashes)}})
+        return result.deleted_count
+
+    async def ensure_ingestion_indexes(self):
+        await self.ensure_connection()
+        await self.collection.create_index("contentHash")
+        await self.collection.create_index([("source", 1), ("pageNumber", 1), ("chunkIndex", 1)])
 
     def close(self):
         if self.client:
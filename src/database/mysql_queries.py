@@ -1,102 +1,138 @@
 import json
-from typing import Union, List
+import logging
+from contextlib import asynccontextmanager
 from functools import wraps
-import asyncmy
-from asyncmy import Pool
 from src.logger import mysql_logger
-from src.config import MYSQL_HOST, MYSQL_PORT, MYSQL_USER, MYSQL_PASSWORD, MYSQL_DATABASE, POOL_CONNECT_TIMEOUT, \
-    POOL_MIN_SIZE, POOL_MAX_SIZE, ACQUIRE_CONN_TIMEOUT
+from src.config import MYSQL_HOST, MYSQL_PORT, MYSQL_USER, MYSQL_PASSWORD, MYSQL_DATABASE, MYSQL_READ_HOSTS, \
+    POOL_CONNECT_TIMEOUT, READ_POOL_MIN_SIZE, READ_POOL_MAX_SIZE, WRITE_POOL_MIN_SIZE, WRITE_POOL_MAX_SIZE, \
+    ACQUIRE_CONN_TIMEOUT, CHAT_HISTORY_MAX_TURNS, CHAT_HISTORY_WINDOW_SECONDS, CHAT_HISTORY_BACKEND, \
+    SENDER_LOCK_BACKEND, SENDER_LOCK_POOL_SIZE
+from src.database.pool_manager import PoolManager
+from src.database.chat_history_cache import ChatHistoryCache
+from src.database.user_id_cache import UserIdCache
+from src.database.write_behind import QueryLogWriter
 import asyncio
-import random
-
-# Multiple pools for read and write operations
-read_pools: List[Pool] = []
-write_pools: List[Pool] = []
+import time
+
+# One pool manager per role ("read", "write" and, with MySQL sender locks, "lock"), created in
+# initialize_connection_pools
+pool_managers: dict[str, PoolManager] = {}
+
+# Ostatnie wiadomości każdej rozmowy, żeby nie czytać historii z MySQL przy każdej wiadomości
+chat_history_cache = ChatHistoryCache()
+user_id_cache = UserIdCache()
+# Zapis par zapytanie-odpowiedź w tle, poza ścieżką odpowiedzi do użytkownika
+query_log_writer = QueryLogWriter(flush=lambda rows: insert_interactions(rows))
+
+# Tabele stanu współdzielonego między workerami, tworzone przy starcie (CREATE TABLE IF NOT EXISTS)
+SCHEMA = {
+    'processed_messages': """
+        CREATE TABLE IF NOT EXISTS processed_messages (
+            message_id VARCHAR(128) PRIMARY KEY,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            INDEX idx_processed_messages_created_at (created_at)
+        )""",
+    'cache_generations': """
+        CREATE TABLE IF NOT EXISTS cache_generations (
+            name VARCHAR(64) PRIMARY KEY,
+            generation BIGINT NOT NULL DEFAULT 0
+        )""",
+}
+# Tables from SCHEMA that could not be created, filled in by initialize_connection_pools
+missing_tables: set[str] = set()
+
+
+def parse_hosts(hosts: str, default_port: int) -> list[tuple[str, int]]:
+    """Parses "host1:3306,host2" into [("host1", 3306), ("host2", default_port)]."""
+    parsed = []
+    for item in hosts.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        host, _, port = item.partition(':')
+        parsed.append((host, int(port) if port else default_port))
+    return parsed
 
 
 async def initialize_connection_pools():
-    global read_pools, write_pools, pool
+    global pool_managers, missing_tables
     try:
-        # Initialize multiple read pools
-        for i in range(3):  # You can choose the number of read pools you need
-            pool = await asyncmy.create_pool(
-                minsize=POOL_MIN_SIZE,
-                maxsize=POOL_MAX_SIZE,
-                host=MYSQL_HOST,
-                port=int(MYSQL_PORT),
-                user=MYSQL_USER,
-                password=MYSQL_PASSWORD,
-                db=MYSQL_DATABASE
-            )
-            read_pools.append(pool)
-            mysql_logger.info(f"✅ Read pool {i + 1} initialized.")
-
-        # Initialize multiple write pools
-        for i in range(3):  # You can choose the number of write pools you need
-            pool = await asyncmy.create_pool(
-                minsize=POOL_MIN_SIZE,
-                maxsize=POOL_MAX_SIZE,
-                host=MYSQL_HOST,
-                port=int(MYSQL_PORT),
-                user=MYSQL_USER,
-                password=MYSQL_PASSWORD,
-                db=MYSQL_DATABASE
-            )
-            write_pools.append(pool)
-            mysql_logger.info(f"✅ Write pool {i + 1} initialized.")
-
-        await create_test_connection(random.choice(read_pools))
-        await create_test_connection(random.choice(write_pools))
-        return read_pools, write_pools
+        connect_kwargs = {
+            'user': MYSQL_USER,
+            'password': MYSQL_PASSWORD,
+            'db': MYSQL_DATABASE,
+            'connect_timeout': POOL_CONNECT_TIMEOUT,
+        }
+        primary = [(MYSQL_HOST, int(MYSQL_PORT))]
+        # Odczyty mogą iść na repliki, zapisy zawsze na serwer główny
+        read_hosts = parse_hosts(MYSQL_READ_HOSTS, int(MYSQL_PORT)) if MYSQL_READ_HOSTS else primary
+
+        managers = {
+            'read': PoolManager('read', read_hosts, READ_POOL_MIN_SIZE, READ_POOL_MAX_SIZE,
+                                ACQUIRE_CONN_TIMEOUT, connect_kwargs),
+            'write': PoolManager('write', primary, WRITE_POOL_MIN_SIZE, WRITE_POOL_MAX_SIZE,
+                                 ACQUIRE_CONN_TIMEOUT, connect_kwargs),
+        }
+        if SENDER_LOCK_BACKEND == 'mysql':
+            # Blokady nadawców trzymają połączenie przez cały przebieg RAG - osobna pula, żeby nie zabierały
+            # połączeń zapisom (log zapytań, użytkownicy, deduplikacja)
+            managers['lock'] = PoolManager('lock', primary, 1, SENDER_LOCK_POOL_SIZE, ACQUIRE_CONN_TIMEOUT,
+                                           connect_kwargs)
+        try:
+            for manager in managers.values():
+                await manager.open()
+                await manager.ping()
+        except Exception:
+            for manager in managers.values():
+                await manager.close()
+            raise
+        pool_managers = managers
+
+        missing = await ensure_tables()
+        missing_tables = set(SCHEMA) if missing is None else missing
+        await query_log_writer.start()
+        return pool_managers
 
     except Exception as e:
         mysql_logger.critical('❌ An error occurred during creating connection pools.')
         mysql_logger.critical(f'Error message: {e}')
-        return None, None
+        return None
 
 
 async def close_connection_pools():
-    global read_pools, write_pools
+    global pool_managers
     try:
-        # Close read pools
-        for i, pool in enumerate(read_pools):
-            pool.close()
-            await pool.wait_closed()
-            mysql_logger.info(f"🚪️ Read pool {i + 1} closed.")
-
-        # Close write pools
-        for i, pool in enumerate(write_pools):
-            pool.close()
-            await pool.wait_closed()
-            mysql_logger.info(f"🚪️ Write pool {i + 1} closed.")
+        # Flush buffered writes while the write pools are still open
+        await query_log_writer.close()
+
+        for manager in pool_managers.values():
+            await manager.close()
+        pool_managers = {}
 
     except Exception as e:
         mysql_logger.error("🚪️ ❌ An error occurred during closing the connection pools.")
         mysql_logger.error(f"Error message: {e}")
 
 
-async def get_pool(pool_type: str):
-    if pool_type == 'read':
-        if not read_pools:
-            raise RuntimeError("❌ No read pools initialized")
-        return random.choice(read_pools)  # Select a random read pool
-    elif pool_type == 'write':
-        if not write_pools:
-            raise RuntimeError("❌ No write pools initialized")
-        return random.choice(write_pools)  # Select a random write pool
-    else:
+def get_pool(pool_type: str) -> PoolManager:
+    if pool_type not in ('read', 'write', 'lock'):
         raise ValueError(f"Unknown pool type: {pool_type}")
+    manager = pool_managers.get(pool_type)
+    if manager is None:
+        raise RuntimeError(f"❌ No {pool_type} pools initialized")
+    return manager
 
 
 def with_connection(pool_type="read", error_message="❌ A database error occurred."):
     def decorator(func):
         @wraps(func)
         async def wrapper(*args, **kwargs):
-            pool = None
+            manager = None
+            routed = None
             conn = None
             try:
-                pool = await get_pool(pool_type)
-                conn = await asyncio.wait_for(pool.acquire(), timeout=ACQUIRE_CONN_TIMEOUT)
+                manager = get_pool(pool_type)
+                routed, conn = await manager.acquire()
                 async with conn.cursor() as cur:
                     return await func(cur, conn, *args, **kwargs)
             except asyncio.TimeoutError:
@@ -107,7 +143,7 @@ def with_connection(pool_type="read", error_message="❌ A database error occurr
             finally:
                 if conn:
                     try:
-                        await pool.release(conn)
+                        await manager.release(routed, conn)
                         mysql_logger.info(f"🔓 Connection released back to the pool.")
                     except Exception as e:
                         mysql_logger.error(f"❌ Error releasing connection: {e}")
@@ -118,89 +154,215 @@ def with_connection(pool_type="read", error_message="❌ A database error occurr
     return decorator
 
 
-@with_connection(pool_type="read",
-                 error_message="❌ Failed to establish a test connection. Pool probably isn't working correctly.")
-async def create_test_connection(cur, conn, *args, **kwargs):
-    await cur.execute("SELECT 1")
-    result = await cur.fetchone()
-    if result[0] == 1:
-        mysql_logger.info("✅ Successfully established a test connection.")
-    else:
-        raise RuntimeError("result[0] != 1")
-
-
-@with_connection(pool_type="write", error_message="❌ Failed to insert or retrieve a user.")
-async def insert_or_get_user(cur, conn, whatsapp_number_id: int) -> int | None:
-    # First, try to get the existing user
-    await cur.execute("SELECT id FROM users WHERE whatsapp_number_id = %s", (whatsapp_number_id,))
-    result = await cur.fetchone()
-
-    if result:
-        mysql_logger.info("➡️ Existing user retrieved successfully.")
-        return result[0]
-
-    # If user doesn't exist, insert a new one
-    await cur.execute("INSERT INTO users (whatsapp_number_id) VALUES (%s)", (whatsapp_number_id,))
+@with_connection(pool_type="write", error_message="❌ Failed to create the shared state tables.")
+async def ensure_tables(cur, conn) -> set[str]:
+    """Creates the tables in SCHEMA that do not exist yet. Returns the names of those that are still missing."""
+    missing = set()
+    for name, ddl in SCHEMA.items():
+        try:
+            await cur.execute(ddl)
+        except Exception as e:
+            mysql_logger.error(f"❌ Could not create table {name}: {e}")
+            missing.add(name)
     await conn.commit()
+    return missing
 
-    # Check if the insert was successful
-    if cur.rowcount > 0:
-        mysql_logger.info("➡️ New user inserted successfully.")
-        return cur.lastrowid
-    else:
-        raise RuntimeError("Failed to insert new user")
 
+async def upsert_user(cur, whatsapp_number_id: int) -> int:
+    # Wymaga UNIQUE KEY na users.whatsapp_number_id. LAST_INSERT_ID(id) sprawia, że lastrowid zwraca id
+    # również wtedy, gdy użytkownik już istnieje - jedno zapytanie zamiast SELECT + INSERT.
+    await cur.execute("""
+        INSERT INTO users (whatsapp_number_id) VALUES (%s)
+        ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id)
+    """, (whatsapp_number_id,))
+    if not cur.lastrowid:
+        raise RuntimeError("Failed to insert or retrieve user")
+    return cur.lastrowid
 
-@with_connection(pool_type="write", error_message="❌ Failed to insert an answer-query pair.")
-async def insert_query(cur, conn, user_id: int, query: str, answer: str):
-    await cur.execute("INSERT INTO queries (user_id, query, answer) VALUES (%s, %s, %s)",
-                      (user_id, query, answer))
-    await conn.commit()
 
-    # Check if the insert was successful
-    if cur.rowcount > 0:
-        mysql_logger.info("➡️ New answer-query pair inserted successfully.")
-    else:
-        raise RuntimeError("cur.rowcount == 0")
+@with_connection(pool_type="write", error_message="❌ Failed to insert a batch of answer-query pairs.")
+async def insert_interactions(cur, conn, rows: list[dict]) -> bool:
+    """Writes a batch from the query log writer: user upserts plus one multi-row INSERT, in one transaction."""
+    numbers = list(dict.fromkeys(row["whatsapp_number_id"] for row in rows))
+    user_ids = {}
+    try:
+        for whatsapp_number_id in numbers:
+            user_id = user_id_cache.get(whatsapp_number_id)
+            user_ids[whatsapp_number_id] = user_id if user_id is not None else await upsert_user(
+                cur, whatsapp_number_id)
+
+        # created_at liczymy po stronie MySQL (NOW() minus czas oczekiwania w buforze), żeby uniknąć
+        # rozjazdu stref czasowych między aplikacją a bazą
+        now = time.time()
+        placeholders = ", ".join(["(%s, %s, %s, NOW() - INTERVAL %s MICROSECOND)"] * len(rows))
+        params = []
+        for row in rows:
+            delay_us = max(0, int((now - row["submitted_at"]) * 1_000_000))
+            params.extend((user_ids[row["whatsapp_number_id"]], row["query"], row["answer"], delay_us))
+        await cur.execute(f"INSERT INTO queries (user_id, query, answer, created_at) VALUES {placeholders}",
+                          params)
+        if cur.rowcount != len(rows):
+            raise RuntimeError(f"cur.rowcount == {cur.rowcount}, expected {len(rows)}")
+        await conn.commit()
+    except Exception:
+        await conn.rollback()
+        # Użytkownik z cache mógł zostać usunięty - następnym razem pobierzemy id od nowa
+        for whatsapp_number_id in numbers:
+            user_id_cache.evict(whatsapp_number_id)
+        raise
+
+    for whatsapp_number_id, user_id in user_ids.items():
+        user_id_cache.put(whatsapp_number_id, user_id)
+    return True
 
 
 @with_connection(pool_type="read", error_message="❌ Failed to retrieve recent queries form chat history.")
-async def get_recent_queries(cur, conn, whatsapp_number_id: int) -> list:
+async def fetch_recent_queries(cur, conn, whatsapp_number_id: int) -> tuple[list, list]:
     await cur.execute("""
-        SELECT q.query, q.answer, q.created_at
+        SELECT q.query, q.answer, q.created_at, TIMESTAMPDIFF(SECOND, q.created_at, NOW())
         FROM queries q
         JOIN users u ON q.user_id = u.id
         WHERE u.whatsapp_number_id = %s
-        AND q.created_at >= NOW() - INTERVAL 2 HOUR
+        AND q.created_at >= NOW() - INTERVAL %s SECOND
         ORDER BY q.created_at DESC
-        LIMIT 5
-    """, (whatsapp_number_id,))
+        LIMIT %s
+    """, (whatsapp_number_id, CHAT_HISTORY_WINDOW_SECONDS, CHAT_HISTORY_MAX_TURNS))
     results = await cur.fetchall()
     mysql_logger.info("➡️ Chat history retrieved successfully.")
 
     if results:
         chat_history = [{"query": query, "answer": answer, "created_at": created_at.isoformat()} for
-                        query, answer, created_at in results]
+                        query, answer, created_at, _ in results]
+        ages = [age for _, _, _, age in results]
+
+        # Szczegółowe logowanie historii czatu - tylko na poziomie DEBUG, żeby nie budować tekstu przy każdym zapytaniu
+        mysql_logger.info("📜 Retrieved %d entries from chat history for user %s", len(chat_history),
+                          whatsapp_number_id)
+        if mysql_logger.isEnabledFor(logging.DEBUG):
+            mysql_logger.debug("📜 Chat history for user %s:\n%s", whatsapp_number_id, "\n".join(
+                f"  {i}. 🗨️ Query: {entry['query'][:50]}{'...' if len(entry['query']) > 50 else ''}\n"
+                f"     💬 Answer: {entry['answer'][:50]}{'...' if len(entry['answer']) > 50 else ''}\n"
+                f"     🕒 Time: {entry['created_at']}"
+                for i, entry in enumerate(chat_history, 1)))
+            mysql_logger.debug("Full chat history: %s", json.dumps(chat_history, indent=2))
+
+        return chat_history, ages
+    else:
+        mysql_logger.info("😑 Retrieved chat history is empty.")
+        return [], []
 
-        # Szczegółowe logowanie historii czatu
-        log_message = f"📜 Retrieved {len(chat_history)} entries from chat history for user {whatsapp_number_id}:\n"
-        for i, entry in enumerate(chat_history, 1):
-            log_message += f"  {i}. 🗨️ Query: {entry['query'][:50]}{'...' if len(entry['query']) > 50 else ''}\n"
-            log_message += f"     💬 Answer: {entry['answer'][:50]}{'...' if len(entry['answer']) > 50 else ''}\n"
-            log_message += f"     🕒 Time: {entry['created_at']}\n"
 
-        mysql_logger.info(log_message)
-        mysql_logger.debug(f"Full chat history: {json.dumps(chat_history, indent=2)}")
+async def get_recent_queries(whatsapp_number_id: int) -> list | None:
+    if CHAT_HISTORY_BACKEND == "mysql":
+        # Kilka procesów - cache innego workera mógłby nie znać ostatniej odpowiedzi, czytamy zawsze z MySQL
+        result = await fetch_recent_queries(whatsapp_number_id)
+        return None if result is None else result[0]
 
+    chat_history = chat_history_cache.get(whatsapp_number_id)
+    if chat_history is not None:
+        mysql_logger.info(f"📜 Chat history for user {whatsapp_number_id} served from cache "
+                          f"({len(chat_history)} entries).")
         return chat_history
-    else:
-        mysql_logger.info("😑 Retrieved chat history is empty.")
-        return []
+
+    result = await fetch_recent_queries(whatsapp_number_id)
+    if result is None:
+        return None
+    chat_history, ages = result
+    chat_history_cache.load(whatsapp_number_id, chat_history, ages)
+    return chat_history
 
 
 async def insert_data_mysql(whatsapp_number_id: int, user_query: str, ai_answer: str):
-    user_id = await insert_or_get_user(whatsapp_number_id)
-    if user_id:
-        await insert_query(user_id, user_query, ai_answer)
-    else:
-        mysql_logger.error("❌ Failed to insert or retrieve user.")
+    if CHAT_HISTORY_BACKEND == "mysql":
+        # Zapis przed zwolnieniem blokady nadawcy, żeby kolejna wiadomość (na dowolnym workerze) widziała tę parę
+        row = {"whatsapp_number_id": whatsapp_number_id, "query": user_query, "answer": ai_answer,
+               "submitted_at": time.time()}
+        if not await insert_interactions([row]):
+            await query_log_writer.submit(whatsapp_number_id, user_query, ai_answer)
+        return
+
+    # Historia w cache aktualizowana od razu, zapis do MySQL odbywa się w tle w paczkach
+    chat_history_cache.append(whatsapp_number_id, user_query, ai_answer)
+    await query_log_writer.submit(whatsapp_number_id, user_query, ai_answer)
+
+
+@asynccontextmanager
+async def hold_named_lock(name: str, timeout: int):
+    """Holds MySQL `GET_LOCK(name)` for the duration of the block, so only one worker process at a time runs it.
+
+    GET_LOCK belongs to the session, so a connection of the dedicated "lock" pool stays checked out until the
+    block ends. If the lock cannot be taken within `timeout` seconds, or MySQL is unavailable, the block runs
+    anyway (logged) - a message is never dropped because of the lock.
+
+    GET_LOCK does not serve waiters in arrival order. Blocks waiting for the same name in different processes
+    run one at a time, but not necessarily in the order they started waiting.
+    """
+    manager = None
+    routed = None
+    conn = None
+    acquired = False
+    try:
+        manager = get_pool("lock")
+        routed, conn = await manager.acquire()
+        async with conn.cursor() as cur:
+            await cur.execute("SELECT GET_LOCK(%s, %s)", (name, timeout))
+            (acquired,) = await cur.fetchone()
+        if acquired != 1:
+            mysql_logger.warning(f"⏱️ Could not take lock {name} within {timeout}s, continuing without it.")
+    except Exception as e:
+        mysql_logger.error(f"❌ Failed to take lock {name}, continuing without it: {e}")
+
+    try:
+        yield
+    finally:
+        if conn:
+            try:
+                if acquired == 1:
+                    async with conn.cursor() as cur:
+                        await cur.execute("SELECT RELEASE_LOCK(%s)", (name,))
+            except Exception as e:
+                mysql_logger.error(f"❌ Failed to release lock {name}: {e}")
+            finally:
+                await manager.release(routed, conn)
+
+
+@with_connection(pool_type="write", error_message="❌ Failed to claim a WhatsApp message id.")
+async def claim_message_id(cur, conn, message_id: str) -> bool:
+    await cur.execute("INSERT IGNORE INTO processed_messages (message_id) VALUES (%s)", (message_id,))
+    await conn.commit()
+    # rowcount == 0 oznacza, że inna replika już przetwarza tę wiadomość
+    return cur.rowcount > 0
+
+
+@with_connection(pool_type="write", error_message="❌ Failed to release a WhatsApp message id.")
+async def release_message_id(cur, conn, message_id: str):
+    await cur.execute("DELETE FROM processed_messages WHERE message_id = %s", (message_id,))
+    await conn.commit()
+
+
+@with_connection(pool_type="write", error_message="❌ Failed to purge processed message ids.")
+async def purge_processed_messages(cur, conn, ttl_seconds: int):
+    await cur.execute("DELETE FROM processed_messages WHERE created_at < NOW() - INTERVAL %s SECOND",
+                      (int(ttl_seconds),))
+    await conn.commit()
+    mysql_logger.info(f"🧹 Purged {cur.rowcount} expired processed message ids.")
+
+
+# Czytamy z puli zapisu - odczyt z repliki mógłby zobaczyć stary numer już po unieważnieniu
+@with_connection(pool_type="write", error_message="❌ Failed to read a cache generation.")
+async def fetch_cache_generation(cur, conn, name: str) -> int:
+    await cur.execute("SELECT generation FROM cache_generations WHERE name = %s", (name,))
+    row = await cur.fetchone()
+    return row[0] if row else 0
+
+
+@with_connection(pool_type="write", error_message="❌ Failed to bump a cache generation.")
+async def bump_cache_generation(cur, conn, name: str) -> int:
+    """Increments the shared generation of a cache; every worker drops its copy once it sees the new number."""
+    await cur.execute("INSERT INTO cache_generations (name, generation) VALUES (%s, 1) "
+                      "ON DUPLICATE KEY UPDATE generation = generation + 1", (name,))
+    await cur.execute("SELECT generation FROM cache_generations WHERE name = %s", (name,))
+    (generation,) = await cur.fetchone()
+    await conn.commit()
+    mysql_logger.info(f"🔢 Cache {name} moved to generation {generation}.")
+    return generation
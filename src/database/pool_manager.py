@@ -0,0 +1,104 @@
+import asyncio
+import time
+import asyncmy
+from src.logger import mysql_logger
+from src.metrics import Counter, Gauge, Histogram
+
+ACQUIRE_WAIT_SECONDS = Histogram('mysql_pool_acquire_wait_seconds', 'Time spent waiting for a pooled connection',
+                                 ('role', 'host'))
+CONNECTIONS_IN_USE = Gauge('mysql_pool_connections_in_use', 'Connections currently checked out', ('role', 'host'))
+ACQUIRE_TIMEOUTS = Counter('mysql_pool_acquire_timeouts_total', 'Acquires that hit ACQUIRE_CONN_TIMEOUT',
+                           ('role', 'host'))
+
+
+class RoutedPool:
+    def __init__(self, role, host, port, pool):
+        self.role = role
+        self.host = host
+        self.port = port
+        self.pool = pool
+        self.outstanding = 0  # connections checked out plus acquires still waiting
+        self.in_use = 0
+
+
+class PoolManager:
+    """All connection pools of one role ("read", "write" or "lock").
+
+    There is one asyncmy pool per host. `acquire` routes to the pool with the fewest outstanding acquires, so
+    a busy host is not picked while another one sits idle. Acquire wait time, connections in use and
+    timeouts are recorded in `src.metrics`.
+    """
+
+    def __init__(self, role, hosts, min_size, max_size, acquire_timeout, connect_kwargs):
+        self.role = role
+        self.hosts = hosts  # list of (host, port)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.connect_kwargs = connect_kwargs
+        self.pools: list[RoutedPool] = []
+
+    async def open(self):
+        for host, port in self.hosts:
+            pool = await asyncmy.create_pool(
+                minsize=self.min_size,
+                maxsize=self.max_size,
+                host=host,
+                port=port,
+                **self.connect_kwargs
+            )
+            self.pools.append(RoutedPool(self.role, host, port, pool))
+            mysql_logger.info(f"✅ {self.role.capitalize()} pool for {host}:{port} initialized "
+                              f"({self.min_size}-{self.max_size} connections).")
+
+    async def ping(self):
+        """Runs `SELECT 1` on every pool, so a misconfigured host fails at startup rather than on first use."""
+        for routed in self.pools:
+            async with routed.pool.acquire() as conn:
+                async with conn.cursor() as cur:
+                    await cur.execute("SELECT 1")
+                    result = await cur.fetchone()
+            if result[0] != 1:
+                raise RuntimeError(f"SELECT 1 on {routed.host}:{routed.port} returned {result[0]}")
+            mysql_logger.info(f"✅ Successfully established a test connection to {routed.host}:{routed.port}.")
+
+    async def close(self):
+        for routed in self.pools:
+            routed.pool.close()
+            await routed.pool.wait_closed()
+            mysql_logger.info(f"🚪️ {self.role.capitalize()} pool for {routed.host}:{routed.port} closed.")
+        self.pools = []
+
+    def _route(self) -> RoutedPool:
+        if not self.pools:
+            raise RuntimeError(f"❌ No {self.role} pools initialized")
+        return min(self.pools, key=lambda routed: routed.outstanding)
+
+    async def acquire(self):
+        """Returns (routed_pool, connection). Raises asyncio.TimeoutError after `acquire_timeout` seconds."""
+        routed = self._route()
+        routed.outstanding += 1
+        started = time.perf_counter()
+        try:
+            conn = await asyncio.wait_for(routed.pool.acquire(), timeout=self.acquire_timeout)
+        except asyncio.TimeoutError:
+            routed.outstanding -= 1
+            ACQUIRE_TIMEOUTS.inc(role=self.role, host=routed.host)
+            raise
+        except BaseException:
+            routed.outstanding -= 1
+            raise
+        finally:
+            ACQUIRE_WAIT_SECONDS.observe(time.perf_counter() - started, role=self.role, host=routed.host)
+
+        routed.in_use += 1
+        CONNECTIONS_IN_USE.set(routed.in_use, role=self.role, host=routed.host)
+        return routed, conn
+
+    async def release(self, routed, conn):
+        try:
+            await routed.pool.release(conn)
+        finally:
+            routed.outstanding -= 1
+            routed.in_use -= 1
+            CONNECTIONS_IN_USE.set(routed.in_use, role=self.role, host=routed.host)
@@ -0,0 +1,27 @@
+from collections import OrderedDict
+from src.config import USER_ID_CACHE_MAX_SIZE
+
+
+class UserIdCache:
+    """Bounded LRU map of WhatsApp phone number -> `users.id`. User ids never change, so there is no TTL."""
+
+    def __init__(self, max_size=USER_ID_CACHE_MAX_SIZE):
+        self.max_size = max_size
+        self.ids = OrderedDict()
+
+    def get(self, whatsapp_number_id):
+        user_id = self.ids.get(whatsapp_number_id)
+        if user_id is not None:
+            self.ids.move_to_end(whatsapp_number_id)
+        return user_id
+
+    def put(self, whatsapp_number_id, user_id):
+        if self.max_size <= 0:
+            return
+        self.ids[whatsapp_number_id] = user_id
+        self.ids.move_to_end(whatsapp_number_id)
+        while len(self.ids) > self.max_size:
+            self.ids.popitem(last=False)
+
+    def evict(self, whatsapp_number_id):
+        self.ids.pop(whatsapp_number_id, None)
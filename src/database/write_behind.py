@@ -0,0 +1,209 @@
+import asyncio
+import json
+import os
+import time
+from src.logger import mysql_logger
+from src.file_lock import try_lock_file
+from src.config import QUERY_LOG_BATCH_SIZE, QUERY_LOG_FLUSH_INTERVAL, QUERY_LOG_MAX_PENDING, QUERY_LOG_SPILL_PATH
+
+# Po tylu nieudanych odtworzeniach wiersz trafia do pliku kwarantanny zamiast z powrotem do pliku spill
+MAX_REPLAY_FAILURES = 3
+
+
+class QueryLogWriter:
+    """Write-behind buffer for query/answer rows.
+
+    Rows are queued by `submit` and written by a background task as multi-row inserts, whenever
+    `batch_size` rows are waiting or `flush_interval` seconds have passed. If the queue is full or a flush
+    fails, rows are appended to a local JSON-lines spill file, which is replayed the next time the writer
+    starts. `flush(rows)` must return True on success.
+
+    Replay survives a damaged spill file: unparsable lines (e.g. a write cut short by a crash) and rows that
+    failed to insert MAX_REPLAY_FAILURES times are moved to `<spill_path>.quarantine` for manual inspection.
+    """
+
+    def __init__(self, flush, batch_size=QUERY_LOG_BATCH_SIZE, flush_interval=QUERY_LOG_FLUSH_INTERVAL,
+                 max_pending=QUERY_LOG_MAX_PENDING, spill_path=QUERY_LOG_SPILL_PATH):
+        self.flush = flush
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.spill_path = spill_path
+        self.quarantine_path = f"{spill_path}.quarantine"
+        self.queue = None
+        self.task = None
+
+    async def start(self):
+        if self.task is not None:
+            return
+        self.queue = asyncio.Queue(maxsize=self.max_pending)
+        self.task = asyncio.create_task(self._run(self.queue))
+        await self._replay_spill()
+        mysql_logger.info(f"🧺 Query log writer started (batch {self.batch_size}, every {self.flush_interval}s)")
+
+    async def submit(self, whatsapp_number_id: int, query: str, answer: str):
+        row = {"whatsapp_number_id": whatsapp_number_id, "query": query, "answer": answer,
+               "submitted_at": time.time()}
+        if self.queue is None:
+            mysql_logger.warning("⚠️ Query log writer is not running, spilling row to disk.")
+            await self._spill_in_thread([row])
+            return
+        try:
+            self.queue.put_nowait(row)
+        except asyncio.QueueFull:
+            mysql_logger.warning(f"⚠️ Query log queue is full ({self.max_pending}), spilling row to disk.")
+            await self._spill_in_thread([row])
+
+    def depth(self) -> int:
+        return self.queue.qsize() if self.queue else 0
+
+    async def _run(self, queue):
+        stopping = False
+        while not stopping:
+            batch = [await queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout=timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # None to znacznik końca wstawiany przez close()
+            if None in batch:
+                stopping = True
+                batch = [row for row in batch if row is not None]
+            if batch:
+                await self._write(batch)
+
+    async def _flush(self, batch) -> bool:
+        try:
+            written = await self.flush(batch)
+        except Exception as e:
+            mysql_logger.error(f"❌ Query log flush raised: {e}")
+            written = False
+        if written:
+            mysql_logger.info(f"➡️ Flushed {len(batch)} answer-query pair(s) to MySQL.")
+        return bool(written)
+
+    async def _write(self, batch):
+        if not await self._flush(batch):
+            mysql_logger.error(f"❌ Could not flush {len(batch)} answer-query pair(s), spilling to disk.")
+            await self._spill_in_thread(batch)
+
+    async def _spill_in_thread(self, rows, path=None):
+        # Zapis do pliku poza pętlą zdarzeń
+        try:
+            await asyncio.to_thread(self._spill, rows, path)
+        except OSError as e:
+            mysql_logger.critical(f"❌ Lost {len(rows)} answer-query pair(s), spill file not writable: {e}")
+
+    def _spill(self, rows, path=None):
+        path = path or self.spill_path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'a', encoding='utf-8') as f:
+            for row in rows:
+                f.write((row if isinstance(row, str) else json.dumps(row, ensure_ascii=False)) + '\n')
+
+    async def _replay_spill(self):
+        # Plik spill jest wspólny dla workerów - odtwarza go tylko ten, który zdobędzie blokadę
+        lock_file = try_lock_file(f"{self.spill_path}.lock")
+        if lock_file is None:
+            mysql_logger.info("♻️ Spilled rows are being replayed by another worker.")
+            return
+        try:
+            await self._replay_spill_locked()
+        finally:
+            lock_file.close()
+
+    async def _replay_spill_locked(self):
+        # Zmieniamy nazwę przed odczytem, żeby nieudany zapis trafił do nowego pliku, a nie do czytanego.
+        # Plik .replaying, który już istnieje, to pozostałość po przerwanym odtwarzaniu.
+        replay_path = f"{self.spill_path}.replaying"
+        try:
+            if not os.path.exists(replay_path):
+                os.replace(self.spill_path, replay_path)
+            rows, damaged = await asyncio.to_thread(self._read_spill, replay_path)
+        except FileNotFoundError:
+            return
+        if damaged:
+            mysql_logger.error(f"❌ Skipping {len(damaged)} unparsable spilled line(s), moved to "
+                               f"{self.quarantine_path}.")
+            await self._spill_in_thread(damaged, self.quarantine_path)
+        mysql_logger.info(f"♻️ Replaying {len(rows)} spilled answer-query pair(s).")
+        await self._replay_rows(rows)
+        try:
+            os.remove(replay_path)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _read_spill(path):
+        """Returns (rows, damaged lines) of a spill file."""
+        rows, damaged = [], []
+        with open(path, encoding='utf-8', errors='replace') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    damaged.append(line)
+                    continue
+                if isinstance(row, dict):
+                    rows.append(row)
+                else:
+                    damaged.append(line)
+        return rows, damaged
+
+    async def _replay_rows(self, rows):
+        failed = []
+        for start in range(0, len(rows), self.batch_size):
+            batch = rows[start:start + self.batch_size]
+            if await self._flush(batch):
+                continue
+            # Paczka nie przeszła - zapisujemy wiersze pojedynczo, żeby jeden zły wiersz nie blokował reszty
+            any_written = False
+            for index, row in enumerate(batch):
+                if await self._flush([row]):
+                    any_written = True
+                    continue
+                failed.append(row)
+                if not any_written and len(failed) >= 2:
+                    # Kolejne wiersze też nie przechodzą - baza jest raczej niedostępna, odkładamy resztę bez zmian
+                    rest = failed + batch[index + 1:] + rows[start + self.batch_size:]
+                    mysql_logger.error(f"❌ MySQL unavailable during replay, spilling {len(rest)} pair(s) back "
+                                       f"to disk.")
+                    await self._spill_in_thread(rest)
+                    return
+
+        if not failed:
+            return
+        for row in failed:
+            row['replay_failures'] = row.get('replay_failures', 0) + 1
+        rejected = [row for row in failed if row['replay_failures'] >= MAX_REPLAY_FAILURES]
+        retried = [row for row in failed if row['replay_failures'] < MAX_REPLAY_FAILURES]
+        if rejected:
+            mysql_logger.critical(f"❌ {len(rejected)} spilled pair(s) failed {MAX_REPLAY_FAILURES} replays, moved "
+                                  f"to {self.quarantine_path}.")
+            await self._spill_in_thread(rejected, self.quarantine_path)
+        if retried:
+            mysql_logger.error(f"❌ {len(retried)} spilled pair(s) could not be written, keeping them for the next "
+                               f"replay.")
+            await self._spill_in_thread(retried)
+
+    async def close(self):
+        """Flushes everything still queued and stops the background task."""
+        if self.task is None:
+            return
+        queue, self.queue = self.queue, None  # nowe wiersze trafią od razu do pliku
+        pending = queue.qsize()
+        await queue.put(None)
+        await self.task
+        self.task = None
+        mysql_logger.info(f"🚪 Query log writer stopped after flushing {pending} pending row(s).")
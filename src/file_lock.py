@@ -0,0 +1,22 @@
+import os
+try:
+    import fcntl
+except ImportError:  # Windows - bez blokady, zakładamy jeden proces
+    fcntl = None
+
+
+def try_lock_file(path):
+    """Takes a non-blocking exclusive flock on `path`. Returns the open lock file (closing it releases the lock),
+    or None when another process, e.g. a sibling Hypercorn worker, already holds it."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    lock_file = open(path, 'w')
+    if fcntl is None:
+        return lock_file
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
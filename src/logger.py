@@ -1,17 +1,39 @@
+import atexit
+import contextvars
+import json
 import logging
 import os
-from logging.handlers import RotatingFileHandler
+import queue
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 from datetime import datetime
 import pytz
+from src.config import LOG_FORMAT, LOG_LEVEL, LOG_DIR
 
 # Define the timezone for Poland
 POLAND_TZ = pytz.timezone('Europe/Warsaw')
 
+# Id of the request (WhatsApp message) being processed, attached to every record logged inside it
+request_id_var = contextvars.ContextVar('request_id', default=None)
+
+
+def set_request_id(request_id):
+    return request_id_var.set(request_id)
+
 
 class PolandFormatter(logging.Formatter):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cached_second = None
+        self._cached_dt = None
+
     def formatTime(self, record, datefmt=None):
-        # Convert the timestamp to the Poland timezone
-        dt = datetime.fromtimestamp(record.created, POLAND_TZ)
+        # Convert the timestamp to the Poland timezone. Offset zmienia się co najwyżej raz na sekundę, więc
+        # konwersję strefy liczymy raz na sekundę i podmieniamy tylko mikrosekundy
+        second = int(record.created)
+        if second != self._cached_second:
+            self._cached_dt = datetime.fromtimestamp(second, POLAND_TZ)
+            self._cached_second = second
+        dt = self._cached_dt.replace(microsecond=int((record.created - second) * 1_000_000))
         if datefmt:
             s = dt.strftime(datefmt)
         else:
@@ -22,20 +44,76 @@ class PolandFormatter(logging.Formatter):
         return s
 
 
-def setup_logger(name, log_file, level=logging.INFO):
-    logger = logging.getLogger(name)
-    if logger.hasHandlers():
-        formatter = PolandFormatter('%(asctime)s %(levelname)s %(message)s')
+class JsonFormatter(PolandFormatter):
+    """One JSON object per line, for log collectors."""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'request_id': getattr(record, 'request_id', None),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class RequestIdFilter(logging.Filter):
+    # Działa w wątku wywołującym (przed kolejką), gdzie kontekst żądania jest jeszcze dostępny
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class RoutingHandler(logging.Handler):
+    """Runs on the listener thread and passes each record to the handlers of the logger that emitted it."""
 
-        file_handler = RotatingFileHandler(log_file, maxBytes=10 * 1024 * 1024, backupCount=5)
-        file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
+    def __init__(self):
+        super().__init__()
+        self.routes = {}
 
-        # Add console handler
-        console_handler = logging.StreamHandler()
-        console_handler.setFormatter(formatter)
-        console_handler.encoding = 'utf-8'
-        logger.addHandler(console_handler)
+    def add_route(self, name, handlers):
+        self.routes[name] = handlers
+
+    def handle(self, record):
+        for handler in self.routes.get(record.name, ()):
+            if record.levelno >= handler.level:
+                handler.handle(record)
+        return True
+
+    def close(self):
+        for handlers in self.routes.values():
+            for handler in handlers:
+                handler.close()
+        super().close()
+
+
+def create_formatter():
+    if LOG_FORMAT == 'json':
+        return JsonFormatter()
+    return PolandFormatter('%(asctime)s %(levelname)s %(message)s')
+
+
+# Handlery z I/O (plik, konsola) działają w wątku QueueListener, a pętla zdarzeń tylko wrzuca rekord do kolejki
+log_queue = queue.SimpleQueue()
+routing_handler = RoutingHandler()
+queue_handler = QueueHandler(log_queue)
+queue_handler.addFilter(RequestIdFilter())
+console_handler = logging.StreamHandler()
+console_handler.setFormatter(create_formatter())
+listener = QueueListener(log_queue, routing_handler)
+
+
+def setup_logger(name, log_file, level=LOG_LEVEL):
+    logger = logging.getLogger(name)
+    if not logger.handlers:
+        file_handler = RotatingFileHandler(log_file, maxBytes=10 * 1024 * 1024, backupCount=5, encoding='utf-8')
+        file_handler.setFormatter(create_formatter())
+        routing_handler.add_route(name, [file_handler, console_handler])
+        logger.addHandler(queue_handler)
+        logger.propagate = False
 
     logger.setLevel(level)
 
@@ -43,7 +121,7 @@ def setup_logger(name, log_file, level=logging.INFO):
 
 
 # Ensure log directory exists
-log_dir = "logs"
+log_dir = LOG_DIR
 os.makedirs(log_dir, exist_ok=True)
 
 # Create loggers
@@ -52,3 +130,6 @@ mysql_logger = setup_logger('[Mysql]', os.path.join(log_dir, 'mysql.log'))
 cosmosdb_logger = setup_logger('[Cosmosdb]', os.path.join(log_dir, 'cosmosdb.log'))
 openai_logger = setup_logger('[Openai]', os.path.join(log_dir, 'openai.log'))
 whatsapp_logger = setup_logger('[Whatsapp]', os.path.join(log_dir, 'whatsapp.log'))
+
+listener.start()
+atexit.register(listener.stop)  # stop() opróżnia kolejkę, więc ostatnie rekordy trafiają do plików
@@ -0,0 +1,218 @@
+import bisect
+import json
+import os
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+REGISTRY = []
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, description, labelnames=()):
+        self.name = name
+        self.description = description
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(label, '')) for label in self.labelnames)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name, description, labelnames=()):
+        super().__init__(name, description, labelnames)
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, description, labelnames=()):
+        super().__init__(name, description, labelnames)
+        self.values = {}
+
+    def set(self, value, **labels):
+        with self._lock:
+            self.values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def get(self, **labels):
+        return self.values.get(self._key(labels), 0)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, description, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, description, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.values = {}  # labels -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bisect.bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def count(self, **labels):
+        series = self.values.get(self._key(labels))
+        return sum(series[:-1]) if series else 0
+
+
+CACHE_LOOKUPS = Counter('cache_lookups_total', 'Lookups in the in-process caches by result', ('cache', 'result'))
+CACHE_ENTRIES = Gauge('cache_entries', 'Entries held by the in-process caches', ('cache',))
+
+
+class CacheMetrics:
+    """Hit/miss accounting of one cache, exported as `cache_lookups_total{cache, result}`."""
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.hits = 0
+        self.misses = 0
+
+    def hit(self, count=1):
+        self.hits += count
+        CACHE_LOOKUPS.inc(count, cache=self.cache, result='hit')
+
+    def miss(self, count=1):
+        self.misses += count
+        CACHE_LOOKUPS.inc(count, cache=self.cache, result='miss')
+
+    def stats(self, size) -> dict:
+        """Hit/miss summary for logs and admin endpoints; also publishes `size` as `cache_entries`."""
+        CACHE_ENTRIES.set(size, cache=self.cache)
+        total = self.hits + self.misses
+        return {'size': size, 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0}
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in (*zip(names, values), *extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _values(metric):
+    with metric._lock:
+        return {key: list(value) if isinstance(value, list) else value for key, value in metric.values.items()}
+
+
+def snapshot() -> dict:
+    """Current values of every registered metric as JSON-friendly `name -> [[label values, value], ...]`."""
+    return {metric.name: [[list(key), value] for key, value in _values(metric).items()] for metric in REGISTRY}
+
+
+def write_snapshot(directory):
+    """Saves this process's `snapshot()` as `<directory>/<pid>.json` (atomically), for `read_snapshots`."""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{os.getpid()}.json')
+    with open(f'{path}.tmp', 'w', encoding='utf-8') as f:
+        json.dump(snapshot(), f)
+    os.replace(f'{path}.tmp', path)
+
+
+def remove_snapshot(directory):
+    try:
+        os.remove(os.path.join(directory, f'{os.getpid()}.json'))
+    except FileNotFoundError:
+        pass
+
+
+def read_snapshots(directory, max_age) -> dict:
+    """Worker pid -> snapshot for every file in `directory`; files older than `max_age` seconds belong to workers
+    that are gone and are deleted."""
+    snapshots = {}
+    now = time.time()
+    for name in os.listdir(directory):
+        if not name.endswith('.json'):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            if now - os.path.getmtime(path) > max_age:
+                os.remove(path)
+                continue
+            with open(path, encoding='utf-8') as f:
+                snapshots[name.removesuffix('.json')] = json.load(f)
+        except (OSError, ValueError):
+            continue  # plik usunięty lub podmieniany w trakcie odczytu
+    return snapshots
+
+
+def _merge(metric, snapshots):
+    # Liczniki i histogramy sumujemy, wartości chwilowe (gauge) zostają osobno dla każdego workera
+    merged = {}
+    for worker, data in snapshots.items():
+        for key, value in data.get(metric.name, []):
+            key = tuple(key)
+            if metric.kind == 'gauge':
+                merged[key + (worker,)] = value
+            elif metric.kind == 'counter':
+                merged[key] = merged.get(key, 0) + value
+            elif key in merged:
+                merged[key] = [total + part for total, part in zip(merged[key], value)]
+            else:
+                merged[key] = list(value)
+    return merged
+
+
+def render(snapshots=None) -> str:
+    """All registered metrics in the Prometheus text exposition format.
+
+    Given `snapshots` (from `read_snapshots`), renders their merge across worker processes instead of this
+    process's own values."""
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f'# HELP {metric.name} {metric.description}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        if snapshots is None:
+            labelnames, values = metric.labelnames, _values(metric)
+        else:
+            labelnames = metric.labelnames + (('worker',) if metric.kind == 'gauge' else ())
+            values = _merge(metric, snapshots)
+        for key, value in values.items():
+            if metric.kind != 'histogram':
+                lines.append(f'{metric.name}{_labels(labelnames, key)} {_number(value)}')
+                continue
+            cumulative = 0
+            for bound, count in zip(metric.buckets + (float('inf'),), value[:-1]):
+                cumulative += count
+                lines.append(f'{metric.name}_bucket{_labels(metric.labelnames, key, [("le", _number(bound))])} '
+                             f'{cumulative}')
+            lines.append(f'{metric.name}_sum{_labels(metric.labelnames, key)} {_number(value[-1])}')
+            lines.append(f'{metric.name}_count{_labels(metric.labelnames, key)} {cumulative}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,51 @@
+import contextvars
+import time
+from contextlib import contextmanager
+from src.metrics import Counter, Histogram
+
+STAGE_SECONDS = Histogram('pipeline_stage_seconds', 'Time spent in each stage of answering a message', ('stage',))
+STAGE_ERRORS = Counter('pipeline_stage_errors_total', 'Stages that raised an exception', ('stage',))
+
+# Czasy etapów bieżącego żądania (stage -> sekundy), None poza start_trace()
+_timings = contextvars.ContextVar('timings', default=None)
+
+
+def start_trace():
+    """Starts collecting a per-request timing breakdown in the current context."""
+    return _timings.set({})
+
+
+def end_trace(token):
+    _timings.reset(token)
+
+
+def record_stage(name, seconds):
+    STAGE_SECONDS.observe(seconds, stage=name)
+    timings = _timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+@contextmanager
+def trace_stage(name):
+    """Times the block into `pipeline_stage_seconds` and the current request's breakdown."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(stage=name)
+        raise
+    finally:
+        record_stage(name, time.perf_counter() - started)
+
+
+async def trace_call(name, awaitable):
+    """`trace_stage` for an awaitable, handy inside asyncio.gather."""
+    with trace_stage(name):
+        return await awaitable
+
+
+def format_timings():
+    """E.g. "history=3ms embedding=182ms completion=2410ms", for the request's summary log line."""
+    timings = _timings.get() or {}
+    return ' '.join(f'{name}={seconds * 1000:.0f}ms' for name, seconds in timings.items())
@@ -0,0 +1,82 @@
+import re
+from src.config import STREAM_CHUNK_MIN_LENGTH, STREAM_CHUNK_MAX_LENGTH
+
+# Limit długości pola text.body w WhatsApp Cloud API
+WHATSAPP_MAX_BODY_LENGTH = 4096
+
+SENTENCE_END = re.compile(r'[.!?…](?:\s|$)')
+
+
+def find_split(text: str, limit: int) -> int:
+    """Position of the most natural break in `text[:limit]`: paragraph, line, sentence, word, then a hard cut."""
+    window = text[:limit]
+    for separator in ('\n\n', '\n'):
+        index = window.rfind(separator)
+        if index > 0:
+            return index + len(separator)
+
+    sentence_ends = [match.end() for match in SENTENCE_END.finditer(window)]
+    if sentence_ends:
+        return sentence_ends[-1]
+
+    index = window.rfind(' ')
+    if index > 0:
+        return index + 1
+    return limit
+
+
+def split_message(text: str, limit: int = WHATSAPP_MAX_BODY_LENGTH) -> list[str]:
+    """Splits `text` into WhatsApp-sized messages, preferring paragraph and sentence boundaries."""
+    chunks = []
+    while len(text) > limit:
+        cut = find_split(text, limit)
+        chunk = text[:cut].strip()
+        if chunk:
+            chunks.append(chunk)
+        text = text[cut:]
+    if text.strip():
+        chunks.append(text.strip())
+    return chunks
+
+
+class StreamChunker:
+    """Turns a stream of completion deltas into paragraph- or sentence-sized WhatsApp messages.
+
+    A chunk is released at a paragraph break once at least `min_length` characters are buffered, at a sentence
+    break once `max_length` is exceeded, and never exceeds the WhatsApp body limit.
+    """
+
+    def __init__(self, min_length=STREAM_CHUNK_MIN_LENGTH, max_length=STREAM_CHUNK_MAX_LENGTH,
+                 limit=WHATSAPP_MAX_BODY_LENGTH):
+        self.min_length = min_length
+        self.max_length = min(max_length, limit)
+        self.limit = limit
+        self.buffer = ''
+
+    def feed(self, delta: str) -> list[str]:
+        self.buffer += delta
+        chunks = []
+        while True:
+            chunk = self._next_chunk()
+            if chunk is None:
+                return chunks
+            if chunk:
+                chunks.append(chunk)
+
+    def _next_chunk(self):
+        paragraph_end = self.buffer.rfind('\n\n', 0, self.max_length)
+        if paragraph_end >= self.min_length:
+            return self._cut(paragraph_end + 2)
+
+        if len(self.buffer) > self.max_length:
+            return self._cut(find_split(self.buffer, self.max_length))
+        return None
+
+    def _cut(self, position):
+        chunk, self.buffer = self.buffer[:position].strip(), self.buffer[position:]
+        return chunk
+
+    def flush(self) -> list[str]:
+        chunks = split_message(self.buffer, self.limit)
+        self.buffer = ''
+        return chunks
@@ -0,0 +1,29 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """Async token bucket: allows `rate` acquisitions per second with bursts of up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        # Lock ustawia oczekujących w kolejce FIFO, więc nikt nie jest zagłodzony
+        async with self._lock:
+            self._refill()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
@@ -1,12 +1,72 @@
-import requests
+import asyncio
+import random
 from src.logger import whatsapp_logger
 import aiohttp
-from src.config import META_ENDPOINT, PHONE_NUMBER_ID, ACCESS_TOKEN
+from src.config import META_ENDPOINT, PHONE_NUMBER_ID, ACCESS_TOKEN, WHATSAPP_MAX_CONNECTIONS_PER_HOST, \
+    WHATSAPP_SEND_TIMEOUT, WHATSAPP_SEND_MAX_RETRIES, WHATSAPP_RETRY_BASE_DELAY, WHATSAPP_RETRY_MAX_DELAY, \
+    WHATSAPP_RATE_LIMIT_PER_SECOND, WORKERS
+from src.whatsapp.message_chunker import split_message
+from src.whatsapp.rate_limiter import TokenBucket
+from src.metrics import Counter
+from src.circuit_breaker import CircuitBreaker
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+SEND_RETRIES = Counter('whatsapp_send_retries_total', 'Retried WhatsApp send attempts')
+SEND_FAILURES = Counter('whatsapp_send_failures_total', 'WhatsApp messages that could not be sent', ('reason',))
+
+send_breaker = CircuitBreaker('whatsapp_send')
 
 
 class WhatsAppClient:
+    # Jedna sesja z pulą połączeń keep-alive na cały proces, otwierana w before_serving
+    _session: aiohttp.ClientSession | None = None
+    # Limit Meta dotyczy całego numeru, więc każdy z WORKERS procesów dostaje jego równą część
+    _rate_limiter = TokenBucket(WHATSAPP_RATE_LIMIT_PER_SECOND / max(WORKERS, 1))
+
+    @classmethod
+    async def start(cls):
+        if cls._session is not None and not cls._session.closed:
+            return
+        connector = aiohttp.TCPConnector(limit_per_host=WHATSAPP_MAX_CONNECTIONS_PER_HOST, keepalive_timeout=60)
+        cls._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=WHATSAPP_SEND_TIMEOUT),
+            headers={'Authorization': f'Bearer {ACCESS_TOKEN}'}
+        )
+        whatsapp_logger.info(f'🔌 WhatsApp HTTP session opened '
+                             f'({WHATSAPP_MAX_CONNECTIONS_PER_HOST} connections per host)')
+
+    @classmethod
+    async def close(cls):
+        if cls._session is not None:
+            await cls._session.close()
+            cls._session = None
+            whatsapp_logger.info('🚪 WhatsApp HTTP session closed.')
+
+    @staticmethod
+    async def send_message(ai_response, sender_phone_number) -> bool:
+        # WhatsApp odrzuca wiadomości dłuższe niż 4096 znaków, więc dzielimy je na kilka
+        sent = True
+        for body in split_message(ai_response):
+            sent = await WhatsAppClient._send_text(body, sender_phone_number) and sent
+        return sent
+
     @staticmethod
-    async def send_message(ai_response, sender_phone_number):
+    def _retry_delay(attempt, retry_after=None):
+        if retry_after:
+            try:
+                return min(float(retry_after), WHATSAPP_RETRY_MAX_DELAY)
+            except ValueError:
+                pass
+        # Full jitter: losowe opóźnienie z rosnącego przedziału
+        return random.uniform(0, min(WHATSAPP_RETRY_MAX_DELAY, WHATSAPP_RETRY_BASE_DELAY * 2 ** attempt))
+
+    @classmethod
+    async def _send_text(cls, body, sender_phone_number) -> bool:
+        if cls._session is None or cls._session.closed:
+            await cls.start()
+
         url = f'{META_ENDPOINT}{PHONE_NUMBER_ID}/messages'
         payload = {
             'messaging_product': 'whatsapp',
@@ -15,16 +75,59 @@ class WhatsAppClient:
             'type': 'text',
             'text': {
                 'preview_url': False,
-                'body': ai_response,
+                'body': body,
             },
         }
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': f'Bearer {ACCESS_TOKEN}'
-        }
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=payload, headers=headers) as response:
-                if response.status == 200:
-                    whatsapp_logger.info('✅ AI answer sent successfully!')
-                else:
-                    whatsapp_logger.error(f'❌ Failed to send message: {response.status} {response.reason}.')
+
+        # Przy niedostępnym Graph API nie czekamy na kolejne timeouty - wiadomość przepada od razu
+        if not send_breaker.allow():
+            whatsapp_logger.error('⚡ WhatsApp send circuit is open, message not sent.')
+            SEND_FAILURES.inc(reason='circuit_open')
+            return False
+
+        for attempt in range(WHATSAPP_SEND_MAX_RETRIES + 1):
+            await cls._rate_limiter.acquire()
+            retry_after = None
+            throttled = False
+            try:
+                async with cls._session.post(url, json=payload) as response:
+                    if response.status == 200:
+                        send_breaker.record_success()
+                        whatsapp_logger.info('✅ AI answer sent successfully!')
+                        return True
+                    if response.status not in RETRYABLE_STATUSES:
+                        # 4xx to błąd po naszej stronie, API działa
+                        send_breaker.record_success()
+                        whatsapp_logger.error(f'❌ Failed to send message: {response.status} {response.reason}.')
+                        SEND_FAILURES.inc(reason=str(response.status))
+                        return False
+                    # 429 to limit dla odbiorcy lub progu przepustowości, a nie awaria API
+                    throttled = response.status == 429
+                    retry_after = response.headers.get('Retry-After')
+                    error = f'{response.status} {response.reason}'
+            except aiohttp.ClientConnectorError as e:
+                # Połączenie nie powstało, więc żądanie na pewno nie dotarło do Meta - można ponowić
+                error = repr(e)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                # Wysyłka nie jest idempotentna: Meta mogła już przyjąć wiadomość, ponowienie mogłoby ją zdublować
+                whatsapp_logger.error(f'❌ Sending message failed after the request was sent, not retrying: {e!r}.')
+                SEND_FAILURES.inc(reason='not_retried')
+                send_breaker.record_failure()
+                return False
+
+            if attempt == WHATSAPP_SEND_MAX_RETRIES:
+                break
+            delay = cls._retry_delay(attempt, retry_after)
+            SEND_RETRIES.inc()
+            whatsapp_logger.warning(f'⚠️ Sending message failed ({error}), retry {attempt + 1}/'
+                                    f'{WHATSAPP_SEND_MAX_RETRIES} in {delay:.2f}s')
+            await asyncio.sleep(delay)
+
+        # Jedna porażka na wiadomość, i tylko gdy API było niedostępne (5xx / brak połączenia)
+        if throttled:
+            send_breaker.record_success()
+        else:
+            send_breaker.record_failure()
+        whatsapp_logger.error(f'❌ Failed to send message after {WHATSAPP_SEND_MAX_RETRIES + 1} attempts: {error}.')
+        SEND_FAILURES.inc(reason='retries_exhausted')
+        return False
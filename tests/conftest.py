@@ -0,0 +1,15 @@
+import os
+import shutil
+import tempfile
+import pytest
+
+# src.config czyta LOG_DIR przy imporcie, więc katalog ustawiamy, zanim testy zaimportują cokolwiek z src
+TEST_LOG_DIR = tempfile.mkdtemp(prefix='whatsapp-chatbot-tests-')
+os.environ['LOG_DIR'] = TEST_LOG_DIR
+
+
+@pytest.fixture(scope='session', autouse=True)
+def test_log_dir():
+    """Keeps test runs from writing into the repository's logs/ directory."""
+    yield TEST_LOG_DIR
+    shutil.rmtree(TEST_LOG_DIR, ignore_errors=True)
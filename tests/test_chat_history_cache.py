@@ -0,0 +1,73 @@
+from src.database.chat_history_cache import ChatHistoryCache, ENTRY_OVERHEAD_BYTES
+
+
+def make_cache(**kwargs):
+    options = {'max_turns': 3, 'window_seconds': 60, 'max_senders': 10, 'max_bytes': 100_000}
+    options.update(kwargs)
+    return ChatHistoryCache(**options)
+
+
+def turn(i):
+    return {'query': f'q{i}', 'answer': f'a{i}', 'created_at': 'N/A'}
+
+
+def test_unknown_sender_is_a_miss_and_append_is_ignored():
+    cache = make_cache()
+    assert cache.get('48100') is None
+    cache.append('48100', 'q', 'a')
+    assert cache.get('48100') is None
+    assert cache.stats()['size'] == 0
+
+
+def test_loaded_history_is_returned_newest_first_with_appends():
+    cache = make_cache()
+    cache.load('48100', [turn(2), turn(1)], [10, 20])
+    cache.append('48100', 'q3', 'a3')
+    assert [entry['query'] for entry in cache.get('48100')] == ['q3', 'q2', 'q1']
+
+
+def test_ring_buffer_keeps_max_turns_and_tracks_bytes():
+    cache = make_cache(max_turns=2)
+    cache.load('48100', [], [])
+    for i in range(4):
+        cache.append('48100', f'q{i}', f'a{i}')
+    assert [entry['query'] for entry in cache.get('48100')] == ['q3', 'q2']
+    assert cache.stats()['bytes'] == 2 * (4 + ENTRY_OVERHEAD_BYTES)
+
+
+def test_expired_turns_are_dropped():
+    cache = make_cache(window_seconds=60)
+    # Wpis sprzed 70 s wypadł już z okna historii, ten sprzed 10 s jeszcze nie
+    cache.load('48100', [turn(2), turn(1)], [10, 70])
+    assert [entry['query'] for entry in cache.get('48100')] == ['q2']
+    assert cache.stats()['bytes'] == 4 + ENTRY_OVERHEAD_BYTES
+
+
+def test_least_recently_used_sender_is_evicted_over_max_senders():
+    cache = make_cache(max_senders=2)
+    cache.load('a', [turn(1)], [0])
+    cache.load('b', [turn(1)], [0])
+    cache.get('a')
+    cache.load('c', [turn(1)], [0])
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+    assert cache.get('c') is not None
+
+
+def test_senders_are_evicted_over_max_bytes():
+    entry_bytes = 4 + ENTRY_OVERHEAD_BYTES
+    cache = make_cache(max_bytes=2 * entry_bytes)
+    cache.load('a', [turn(1)], [0])
+    cache.load('b', [turn(1)], [0])
+    cache.append('b', 'q2', 'a2')
+    assert cache.get('a') is None
+    assert cache.stats()['bytes'] == 2 * entry_bytes
+
+
+def test_evict_releases_bytes():
+    cache = make_cache()
+    cache.load('a', [turn(1)], [0])
+    cache.evict('a')
+    cache.evict('a')
+    assert cache.get('a') is None
+    assert cache.stats()['bytes'] == 0
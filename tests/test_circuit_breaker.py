@@ -0,0 +1,150 @@
+import asyncio
+import pytest
+from src.circuit_breaker import CircuitBreaker, CircuitOpenError, hedged, CLOSED, HALF_OPEN, OPEN
+
+
+def make_breaker(name, threshold=3, reset_timeout=30):
+    return CircuitBreaker(f'test-{name}', failure_threshold=threshold, reset_timeout=reset_timeout)
+
+
+def expire(breaker):
+    # Zamiast czekać reset_timeout przesuwamy moment otwarcia w przeszłość
+    breaker.opened_at -= breaker.reset_timeout
+
+
+def test_opens_after_consecutive_failures():
+    breaker = make_breaker('opens')
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.record_failure()
+    assert breaker.state == CLOSED
+
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+
+
+def test_success_resets_failure_count():
+    breaker = make_breaker('resets')
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+
+
+def test_half_open_lets_one_probe_through():
+    breaker = make_breaker('probe', threshold=1)
+    breaker.record_failure()
+    expire(breaker)
+
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+
+
+def test_failed_probe_opens_again():
+    breaker = make_breaker('reopen', threshold=2)
+    breaker.record_failure()
+    breaker.record_failure()
+    expire(breaker)
+
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+
+
+def test_zero_threshold_disables_breaker():
+    breaker = make_breaker('disabled', threshold=0)
+    for _ in range(10):
+        breaker.record_failure()
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+
+
+def test_call_counts_timeouts_as_failures():
+    breaker = make_breaker('timeout', threshold=1)
+
+    async def slow():
+        await asyncio.sleep(1)
+
+    async def main():
+        with pytest.raises(asyncio.TimeoutError):
+            await breaker.call(slow, timeout=0.01)
+        with pytest.raises(CircuitOpenError):
+            await breaker.call(slow, timeout=0.01)
+
+    asyncio.run(main())
+    assert breaker.state == OPEN
+
+
+def test_call_ignores_cancellation():
+    breaker = make_breaker('cancel', threshold=1)
+
+    async def main():
+        task = asyncio.create_task(breaker.call(lambda: asyncio.sleep(1)))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert breaker.state == CLOSED
+    assert breaker.failures == 0
+
+
+def run_hedged(delays, delay=0.02):
+    """Runs `hedged` over calls that sleep for consecutive `delays` (an Exception instance makes a call fail)."""
+    calls = []
+
+    async def func():
+        index = len(calls)
+        calls.append(index)
+        outcome = delays[index]
+        if isinstance(outcome, Exception):
+            raise outcome
+        await asyncio.sleep(outcome)
+        return index
+
+    result = asyncio.run(hedged('test', func, delay))
+    return result, calls
+
+
+def test_hedged_fast_call_sends_no_backup():
+    result, calls = run_hedged([0])
+    assert result == 0
+    assert calls == [0]
+
+
+def test_hedged_slow_call_is_beaten_by_backup():
+    result, calls = run_hedged([1, 0])
+    assert result == 1
+    assert calls == [0, 1]
+
+
+def test_hedged_failed_backup_waits_for_first():
+    result, calls = run_hedged([0.05, ValueError('backup failed')])
+    assert result == 0
+
+
+def test_hedged_raises_when_both_fail():
+    async def func():
+        await asyncio.sleep(0.05)
+        raise ValueError('down')
+
+    with pytest.raises(ValueError):
+        asyncio.run(hedged('test', func, 0.01))
+
+
+def test_hedged_disabled_with_zero_delay():
+    result, calls = run_hedged([0.05], delay=0)
+    assert result == 0
+    assert calls == [0]
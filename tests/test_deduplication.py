@@ -0,0 +1,118 @@
+import asyncio
+from src.api import deduplication, webhook
+from src.api.deduplication import MessageDeduplicator
+
+
+def test_redelivered_message_is_a_duplicate():
+    deduplicator = MessageDeduplicator(ttl=60, max_size=10, backend='local')
+
+    async def main():
+        return [await deduplicator.is_duplicate(message_id) for message_id in ('m1', 'm2', 'm1')]
+
+    assert asyncio.run(main()) == [False, False, True]
+    stats = deduplicator.stats()
+    assert (stats['size'], stats['hits'], stats['misses']) == (2, 1, 2)
+
+
+def test_message_without_id_is_never_a_duplicate():
+    deduplicator = MessageDeduplicator(ttl=60, max_size=10, backend='local')
+
+    async def main():
+        return [await deduplicator.is_duplicate(None), await deduplicator.is_duplicate(None)]
+
+    assert asyncio.run(main()) == [False, False]
+
+
+def test_expired_id_is_accepted_again():
+    deduplicator = MessageDeduplicator(ttl=60, max_size=10, backend='local')
+
+    async def main():
+        await deduplicator.is_duplicate('m1')
+        deduplicator.seen['m1'] -= 61
+        return await deduplicator.is_duplicate('m1')
+
+    assert asyncio.run(main()) is False
+
+
+def test_oldest_ids_are_dropped_over_max_size():
+    deduplicator = MessageDeduplicator(ttl=60, max_size=2, backend='local')
+
+    async def main():
+        for message_id in ('m1', 'm2', 'm3'):
+            await deduplicator.is_duplicate(message_id)
+
+    asyncio.run(main())
+    assert list(deduplicator.seen) == ['m2', 'm3']
+
+
+def test_forget_lets_the_retry_through():
+    deduplicator = MessageDeduplicator(ttl=60, max_size=10, backend='local')
+
+    async def main():
+        await deduplicator.is_duplicate('m1')
+        await deduplicator.forget('m1')
+        return await deduplicator.is_duplicate('m1')
+
+    assert asyncio.run(main()) is False
+
+
+def test_mysql_backend_drops_ids_claimed_by_another_replica(monkeypatch):
+    claimed = {'m1'}
+    released = []
+
+    async def claim(message_id):
+        if message_id in claimed:
+            return False
+        claimed.add(message_id)
+        return True
+
+    async def release(message_id):
+        released.append(message_id)
+        claimed.discard(message_id)
+
+    monkeypatch.setattr(deduplication, 'claim_message_id', claim)
+    monkeypatch.setattr(deduplication, 'release_message_id', release)
+    deduplicator = MessageDeduplicator(ttl=60, max_size=10, backend='mysql')
+
+    async def main():
+        results = [await deduplicator.is_duplicate('m1'), await deduplicator.is_duplicate('m2')]
+        await deduplicator.forget('m2')
+        return results
+
+    assert asyncio.run(main()) == [True, False]
+    assert released == ['m2']
+    assert claimed == {'m1'}
+
+
+def test_mysql_error_does_not_drop_the_message(monkeypatch):
+    async def claim(message_id):
+        return None
+
+    monkeypatch.setattr(deduplication, 'claim_message_id', claim)
+    deduplicator = MessageDeduplicator(ttl=60, max_size=10, backend='mysql')
+    assert asyncio.run(deduplicator.is_duplicate('m1')) is False
+
+
+def text_message(message_id):
+    return {'id': message_id, 'from': '48100200300', 'type': 'text', 'text': {'body': 'Dzień dobry'}}
+
+
+def test_message_rejected_by_full_queue_is_forgotten(monkeypatch):
+    monkeypatch.setattr(webhook, 'deduplicator', MessageDeduplicator(ttl=60, max_size=10, backend='local'))
+    monkeypatch.setattr(webhook.message_queue, 'enqueue', lambda key, message: False)
+
+    assert asyncio.run(webhook.accept_message(text_message('m1'))) is False
+    assert 'm1' not in webhook.deduplicator.seen
+
+
+def test_accepted_message_stays_claimed(monkeypatch):
+    enqueued = []
+    monkeypatch.setattr(webhook, 'deduplicator', MessageDeduplicator(ttl=60, max_size=10, backend='local'))
+    monkeypatch.setattr(webhook.message_queue, 'enqueue', lambda key, message: enqueued.append(key) or True)
+
+    async def main():
+        return [await webhook.accept_message(text_message('m1')), await webhook.accept_message(text_message('m1'))]
+
+    assert asyncio.run(main()) == [True, True]
+    assert enqueued == [48100200300]
+
@@ -0,0 +1,94 @@
+import asyncio
+from src.database.ingestion import Ingestion, chunk_words, read_chunks, iter_source_files
+
+
+def words(count):
+    return ' '.join(f'w{i}' for i in range(count))
+
+
+def test_chunks_overlap_and_cover_every_word():
+    chunks = list(chunk_words(words(10), chunk_size=4, overlap=1))
+    assert chunks == ['w0 w1 w2 w3', 'w3 w4 w5 w6', 'w6 w7 w8 w9']
+
+
+def test_last_chunk_is_not_repeated_inside_the_previous_one():
+    assert list(chunk_words(words(4), chunk_size=4, overlap=2)) == ['w0 w1 w2 w3']
+    assert list(chunk_words(words(5), chunk_size=4, overlap=2)) == ['w0 w1 w2 w3', 'w2 w3 w4']
+
+
+def test_overlap_not_smaller_than_chunk_size_still_advances():
+    assert list(chunk_words(words(3), chunk_size=2, overlap=5)) == ['w0 w1', 'w1 w2']
+
+
+def test_empty_text_has_no_chunks():
+    assert list(chunk_words('  \n ', chunk_size=4, overlap=1)) == []
+
+
+def test_pages_are_chunked_separately_with_stable_hashes(tmp_path):
+    path = tmp_path / 'cennik_uslug.txt'
+    path.write_text(f'{words(5)}\fdruga strona', encoding='utf-8')
+    chunks = read_chunks(path, chunk_size=4, overlap=1)
+
+    assert [(chunk['pageNumber'], chunk['chunkIndex'], chunk['content']) for chunk in chunks] == [
+        (1, 0, 'w0 w1 w2 w3'), (1, 1, 'w3 w4'), (2, 0, 'druga strona')]
+    assert {chunk['title'] for chunk in chunks} == {'cennik uslug'}
+    assert [chunk['contentHash'] for chunk in read_chunks(path, 4, 1)] == [chunk['contentHash'] for chunk in chunks]
+    assert len({chunk['contentHash'] for chunk in chunks}) == 3
+
+
+def test_directories_are_walked_for_supported_files(tmp_path):
+    (tmp_path / 'b.md').write_text('b')
+    (tmp_path / 'nested').mkdir()
+    (tmp_path / 'nested' / 'a.TXT').write_text('a')
+    (tmp_path / 'image.png').write_bytes(b'')
+    assert [path.name for path in iter_source_files([tmp_path])] == ['b.md', 'a.TXT']
+
+
+class FakeMongoDB:
+    def __init__(self):
+        self.chunks = {}  # contentHash -> chunk
+
+    async def ensure_ingestion_indexes(self):
+        pass
+
+    async def existing_content_hashes(self, hashes):
+        return hashes & set(self.chunks)
+
+    async def upsert_chunks(self, chunks):
+        for chunk in chunks:
+            self.chunks[chunk['contentHash']] = chunk
+        return len(chunks)
+
+    async def delete_stale_chunks(self, source, hashes):
+        stale = [key for key, chunk in self.chunks.items() if chunk['source'] == source and key not in hashes]
+        for key in stale:
+            del self.chunks[key]
+        return len(stale)
+
+
+class FakeOpenAI:
+    def __init__(self):
+        self.embedded = []
+
+    async def generate_embeddings_batch(self, texts, use_cache=True):
+        self.embedded.extend(texts)
+        return [[0.0] for _ in texts]
+
+
+def test_rerun_embeds_only_changed_chunks_and_deletes_stale_ones(tmp_path):
+    path = tmp_path / 'faq.txt'
+    path.write_text(words(7), encoding='utf-8')
+    mongodb, openai = FakeMongoDB(), FakeOpenAI()
+
+    def ingest():
+        return asyncio.run(Ingestion(mongodb, openai, batch_size=2).run([path], chunk_size=4, overlap=1))
+
+    stats = ingest()
+    assert (stats['chunks'], stats['embedded'], stats['written']) == (2, 2, 2)
+
+    path.write_text(words(6) + ' zmiana', encoding='utf-8')
+    openai.embedded.clear()
+    stats = ingest()
+    assert (stats['skipped'], stats['embedded'], stats['deleted']) == (1, 1, 1)
+    assert openai.embedded == ['w3 w4 w5 zmiana']
+    assert sorted(chunk['content'] for chunk in mongodb.chunks.values()) == ['w0 w1 w2 w3', 'w3 w4 w5 zmiana']
@@ -0,0 +1,85 @@
+from src.database.keyword_index import KeywordIndex, reciprocal_rank_fusion, tokenize
+
+DOCUMENTS = [
+    {'_id': 1, 'title': 'Kontakt', 'content': 'Infolinia: +48 123-456-789, czynna od 8 do 16.'},
+    {'_id': 2, 'title': 'Godziny otwarcia', 'content': 'Biuro jest czynne od poniedziałku do piątku.'},
+    {'_id': 3, 'title': 'Usługi', 'content': 'Wdrażamy system ERP oraz usługi chmurowe w modelu SaaS.'},
+]
+
+
+def make_index(documents=DOCUMENTS):
+    index = KeywordIndex(mongodb_client=None, refresh_interval=0)
+    for document in documents:
+        index._upsert(document)
+    return index
+
+
+def ids(results):
+    return [result['_id'] for result in results]
+
+
+def test_phone_numbers_are_also_indexed_as_digits():
+    assert '48123456789' in tokenize('Zadzwoń: +48 123-456-789')
+
+
+def test_search_ranks_exact_term_matches():
+    index = make_index()
+    assert ids(index.search('ERP')) == [3]
+    assert ids(index.search('48123456789')) == [1]
+    assert index.search('czynna')[0]['keywordScore'] > 0
+
+
+def test_rare_terms_outrank_common_ones():
+    index = make_index()
+    # "do" występuje w dwóch dokumentach, "biuro" tylko w jednym
+    assert ids(index.search('biuro do'))[0] == 2
+
+
+def test_search_limits_results_and_handles_no_match():
+    index = make_index()
+    assert len(index.search('do', num_results=2)) == 2
+    assert index.search('nieistniejące') == []
+    assert make_index([]).search('ERP') == []
+
+
+def test_updated_document_replaces_its_terms():
+    index = make_index()
+    index._upsert({'_id': 3, 'title': 'Usługi', 'content': 'Outsourcing IT.'})
+    assert index.search('ERP') == []
+    assert ids(index.search('outsourcing')) == [3]
+    assert len(index.documents) == 3
+
+
+def test_removed_document_is_not_found_and_rows_stay_consistent():
+    index = make_index()
+    index._remove(1)
+    assert index.search('infolinia') == []
+    # Ostatni dokument zajął zwolniony wiersz
+    assert ids(index.search('ERP')) == [3]
+    assert index.rows == {3: 0, 2: 1}
+    assert index.total_length == sum(index.lengths)
+
+
+def test_exact_match_requires_rare_terms_in_the_best_result():
+    index = make_index()
+    common = make_index([{'_id': i, 'title': 'ERP', 'content': f'Dokument {i}'} for i in range(10)])
+    assert not common.is_exact_match('ERP', common.search('ERP'))
+    assert index.is_exact_match('ERP', index.search('ERP'))
+    assert not index.is_exact_match('ERP biuro', index.search('ERP biuro'))
+    assert not index.is_exact_match('ERP', [])
+
+
+def test_reciprocal_rank_fusion_sums_ranks_across_lists():
+    vector = [{'_id': 'a', 'similarityScore': 0.9}, {'_id': 'b', 'similarityScore': 0.8}]
+    keyword = [{'_id': 'b', 'keywordScore': 5.0}, {'_id': 'c', 'keywordScore': 3.0}]
+    fused = reciprocal_rank_fusion([vector, keyword], k=60)
+
+    assert ids(fused) == ['b', 'a', 'c']
+    assert fused[0]['fusedScore'] == 1 / 62 + 1 / 61
+    assert fused[0]['similarityScore'] == 0.8
+    assert 'keywordScore' not in fused[0]
+    assert fused[2]['fusedScore'] == 1 / 62
+
+
+def test_reciprocal_rank_fusion_of_nothing_is_empty():
+    assert reciprocal_rank_fusion([[], []]) == []
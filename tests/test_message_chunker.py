@@ -0,0 +1,57 @@
+from src.whatsapp.message_chunker import split_message, find_split, StreamChunker
+
+
+def test_short_message_is_not_split():
+    assert split_message('Dzień dobry!', limit=100) == ['Dzień dobry!']
+
+
+def test_empty_message_gives_no_chunks():
+    assert split_message('  \n ', limit=100) == []
+
+
+def test_split_prefers_paragraph_break():
+    text = 'Pierwszy akapit. Zdanie.\n\nDrugi akapit.'
+    assert split_message(text, limit=30) == ['Pierwszy akapit. Zdanie.', 'Drugi akapit.']
+
+
+def test_split_falls_back_to_sentence_then_word():
+    assert find_split('Ala ma kota. Kot ma Alę', 20) == len('Ala ma kota. ')
+    assert find_split('jeden dwa trzy cztery', 12) == len('jeden dwa ')
+
+
+def test_word_longer_than_limit_is_cut_hard():
+    assert split_message('x' * 25, limit=10) == ['x' * 10, 'x' * 10, 'x' * 5]
+
+
+def test_every_chunk_fits_the_limit_and_no_text_is_lost():
+    text = ' '.join(f'Zdanie numer {i}.' for i in range(200)) + '\n\n' + 'Koniec.'
+    chunks = split_message(text, limit=100)
+    assert all(len(chunk) <= 100 for chunk in chunks)
+    assert ' '.join(chunks).split() == text.split()
+
+
+def test_stream_chunker_releases_paragraphs_after_min_length():
+    chunker = StreamChunker(min_length=10, max_length=200, limit=300)
+    assert chunker.feed('Krótko.\n\n') == []
+    assert chunker.feed('Drugi akapit') == []
+    assert chunker.feed('.\n\nTrzeci') == ['Krótko.\n\nDrugi akapit.']
+    assert chunker.flush() == ['Trzeci']
+    assert chunker.flush() == []
+
+
+def test_stream_chunker_cuts_long_paragraph_at_sentence():
+    chunker = StreamChunker(min_length=10, max_length=30, limit=300)
+    chunks = chunker.feed('Pierwsze zdanie. Drugie zdanie jest dłuższe')
+    assert chunks == ['Pierwsze zdanie.']
+    assert chunker.buffer == 'Drugie zdanie jest dłuższe'
+
+
+def test_stream_chunker_output_matches_input():
+    text = ''.join(f'Akapit {i}. ' * (i % 7 + 1) + '\n\n' for i in range(40))
+    chunker = StreamChunker(min_length=50, max_length=120, limit=150)
+    chunks = []
+    for start in range(0, len(text), 7):
+        chunks.extend(chunker.feed(text[start:start + 7]))
+    chunks.extend(chunker.flush())
+    assert all(len(chunk) <= 150 for chunk in chunks)
+    assert ' '.join(chunks).split() == text.split()
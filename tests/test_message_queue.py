@@ -0,0 +1,153 @@
+import asyncio
+from src.api.message_queue import MessageQueue
+
+
+def make_queue(handled, delay=0.05, **kwargs):
+    async def handler(messages):
+        handled.append(list(messages))
+        await asyncio.sleep(delay)
+
+    options = {'worker_count': 4, 'max_size': 100, 'coalesce_window': 0.02, 'coalesce_max_wait': 1,
+               'coalesce_max_messages': 10}
+    options.update(kwargs)
+    return MessageQueue(handler, **options)
+
+
+def test_idle_sender_is_handled_without_waiting():
+    handled = []
+
+    async def main():
+        queue = make_queue(handled, coalesce_window=10)
+        await queue.start()
+        queue.enqueue('a', 'a1')
+        await asyncio.sleep(0.01)
+        assert handled == [['a1']]
+        await queue.drain(1)
+
+    asyncio.run(main())
+
+
+def test_messages_sent_during_processing_are_coalesced_in_order():
+    handled = []
+
+    async def main():
+        queue = make_queue(handled)
+        await queue.start()
+        for message in ('a1', 'a2', 'a3', 'a4'):
+            queue.enqueue('a', message)
+            await asyncio.sleep(0.005)
+        await queue.drain(1)
+
+    asyncio.run(main())
+    assert handled == [['a1'], ['a2', 'a3', 'a4']]
+
+
+def test_sender_never_has_two_batches_in_flight():
+    in_flight = {}
+    overlaps = []
+    order = []
+
+    async def handler(messages):
+        key = messages[0][0]
+        if in_flight.get(key):
+            overlaps.append(key)
+        in_flight[key] = True
+        order.extend(messages)
+        await asyncio.sleep(0.01)
+        in_flight[key] = False
+
+    async def main():
+        queue = MessageQueue(handler, worker_count=4, max_size=100, coalesce_window=0, coalesce_max_messages=1)
+        await queue.start()
+        for i in range(5):
+            for key in 'ab':
+                queue.enqueue(key, f'{key}{i}')
+        await queue.drain(2)
+
+    asyncio.run(main())
+    assert overlaps == []
+    assert [m for m in order if m[0] == 'a'] == [f'a{i}' for i in range(5)]
+    assert [m for m in order if m[0] == 'b'] == [f'b{i}' for i in range(5)]
+
+
+def test_different_senders_run_concurrently():
+    handled = []
+
+    async def main():
+        queue = make_queue(handled, delay=0.2)
+        await queue.start()
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        for key in 'abcd':
+            queue.enqueue(key, key)
+        await queue.drain(1)
+        return loop.time() - started
+
+    elapsed = asyncio.run(main())
+    assert sorted(batch[0] for batch in handled) == list('abcd')
+    assert elapsed < 0.4
+
+
+def test_batch_is_capped_at_max_messages():
+    handled = []
+
+    async def main():
+        queue = make_queue(handled, coalesce_max_messages=2)
+        await queue.start()
+        for i in range(5):
+            queue.enqueue('a', i)
+        await queue.drain(1)
+
+    asyncio.run(main())
+    assert handled == [[0, 1], [2, 3], [4]]
+
+
+def test_full_queue_rejects_messages():
+    handled = []
+
+    async def main():
+        queue = make_queue(handled, max_size=2)
+        await queue.start()
+        accepted = [queue.enqueue('a', i) for i in range(3)]
+        await queue.drain(1)
+        return accepted
+
+    assert asyncio.run(main()) == [True, True, False]
+
+
+def test_drain_flushes_debouncing_senders_and_stops_accepting():
+    handled = []
+
+    async def main():
+        queue = make_queue(handled, delay=0.02, coalesce_window=10, coalesce_max_wait=10)
+        await queue.start()
+        queue.enqueue('a', 'a1')
+        await asyncio.sleep(0)
+        queue.enqueue('a', 'a2')
+        await queue.drain(1)
+        assert not queue.enqueue('a', 'a3')
+        assert queue.depth() == 0
+        assert queue.workers == []
+
+    asyncio.run(main())
+    assert handled == [['a1'], ['a2']]
+
+
+def test_handler_error_does_not_stop_the_sender():
+    handled = []
+
+    async def handler(messages):
+        handled.append(messages)
+        if messages == ['bad']:
+            raise RuntimeError('boom')
+
+    async def main():
+        queue = MessageQueue(handler, worker_count=1, max_size=10, coalesce_window=0)
+        await queue.start()
+        queue.enqueue('a', 'bad')
+        await asyncio.sleep(0.01)
+        queue.enqueue('a', 'good')
+        await queue.drain(1)
+
+    asyncio.run(main())
+    assert handled == [['bad'], ['good']]
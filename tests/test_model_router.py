@@ -0,0 +1,114 @@
+import asyncio
+import pytest
+from src.ai.model_router import ModelRouter, TIER_CANNED, TIER_SMALL, TIER_LARGE
+from src.ai.openai_client import CHAT_COMPLETION_ERROR
+from src.circuit_breaker import CircuitOpenError
+
+HISTORY = [{'query': 'Czy mogę umówić spotkanie?', 'answer': 'Tak, pasuje jutro o 10?'}]
+
+
+class FakeOpenAI:
+    """Returns `outcomes[model]` for each call: a reply, or an exception instance to raise."""
+
+    def __init__(self, outcomes):
+        self.outcomes = outcomes
+        self.calls = []
+
+    async def generate_chat_completion(self, messages, model=None):
+        self.calls.append(model)
+        outcome = self.outcomes[model]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    async def stream_chat_completion(self, messages, model=None):
+        self.calls.append(model)
+        outcome = self.outcomes[model]
+        if isinstance(outcome, Exception):
+            raise outcome
+        if outcome == CHAT_COMPLETION_ERROR:
+            yield outcome
+            return
+        for part in outcome.split(' '):
+            yield part
+
+
+def make_router(client=None, **kwargs):
+    options = {'small_model': 'small', 'large_model': 'large', 'small_max_words': 0, 'enabled': True}
+    options.update(kwargs)
+    return ModelRouter(client, **options)
+
+
+@pytest.mark.parametrize('question, intent', [
+    ('Cześć!', 'greeting'),
+    ('Dzień dobry', 'greeting'),
+    ('Hello there', 'greeting'),
+    ('Dzięki', 'thanks'),
+    ('Do widzenia.', 'goodbye'),
+    ('ok', 'acknowledgement'),
+])
+def test_canned_intents_skip_model_and_retrieval(question, intent):
+    route = make_router().route(question)
+    assert (route.tier, route.intent, route.model, route.retrieval) == (TIER_CANNED, intent, None, False)
+    assert route.reply
+
+
+def test_thanks_and_acknowledgement_go_to_the_model_during_a_conversation():
+    router = make_router()
+    assert router.route('ok', HISTORY).tier == TIER_LARGE
+    assert router.route('Dzięki', HISTORY).tier == TIER_LARGE
+    assert router.route('Cześć', HISTORY).tier == TIER_CANNED
+
+
+def test_small_talk_goes_to_the_small_model_without_retrieval():
+    route = make_router().route('Jak się masz?')
+    assert (route.tier, route.intent, route.model, route.retrieval) == (TIER_SMALL, 'small_talk', 'small', False)
+
+
+def test_questions_stay_on_the_large_model_by_default():
+    route = make_router().route('Gdzie jest biuro?')
+    assert (route.tier, route.model, route.retrieval) == (TIER_LARGE, 'large', True)
+
+
+def test_short_questions_go_to_the_small_model_when_enabled():
+    router = make_router(small_max_words=5)
+    route = router.route('Gdzie jest biuro?')
+    assert (route.tier, route.intent, route.model, route.retrieval) == (TIER_SMALL, 'simple_question', 'small', True)
+    assert router.route('Jakie usługi oferujecie w zakresie chmury i ERP?').tier == TIER_LARGE
+
+
+def test_reasoning_and_multiple_questions_stay_on_the_large_model():
+    router = make_router(small_max_words=5)
+    assert router.route('Wyjaśnij różnicę SaaS i PaaS').tier == TIER_LARGE
+    assert router.route('Gdzie? Kiedy?').tier == TIER_LARGE
+
+
+def test_disabled_router_sends_everything_to_the_large_model():
+    route = make_router(enabled=False).route('Cześć!')
+    assert (route.tier, route.model, route.retrieval) == (TIER_LARGE, 'large', True)
+
+
+def test_failed_small_completion_falls_back_to_the_large_model():
+    for failure in (CHAT_COMPLETION_ERROR, CircuitOpenError('small'), asyncio.TimeoutError()):
+        client = FakeOpenAI({'small': failure, 'large': 'odpowiedź'})
+        router = make_router(client)
+        assert asyncio.run(router.complete(router.route('Jak się masz?'), [])) == 'odpowiedź'
+        assert client.calls == ['small', 'large']
+
+
+def test_open_circuit_of_the_large_model_is_raised():
+    client = FakeOpenAI({'large': CircuitOpenError('large')})
+    router = make_router(client)
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(router.complete(router.route('Gdzie jest biuro?'), []))
+
+
+def test_failed_small_stream_falls_back_before_the_first_part():
+    async def collect(router, route):
+        return [delta async for delta in router.stream(route, [])]
+
+    for failure in (CHAT_COMPLETION_ERROR, CircuitOpenError('small')):
+        client = FakeOpenAI({'small': failure, 'large': 'Dzień dobry'})
+        router = make_router(client)
+        assert asyncio.run(collect(router, router.route('Jak się masz?'))) == ['Dzień', 'dobry']
+        assert client.calls == ['small', 'large']
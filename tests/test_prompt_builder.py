@@ -0,0 +1,83 @@
+from src.ai.prompt_builder import PromptBuilder, count_tokens, format_result, TOKENS_PER_MESSAGE
+
+
+def chunk(i, score=None, content=None, **fields):
+    result = {'_id': i, 'title': f'Dokument {i}', 'pageNumber': 1, 'content': content or f'Treść fragmentu {i}.'}
+    if score is not None:
+        result['similarityScore'] = score
+    result.update(fields)
+    return result
+
+
+def tokens_of(*results):
+    return sum(count_tokens(format_result(result)) for result in results)
+
+
+def turn(i, length=10):
+    return {'query': f'pytanie {i} ' + 'x' * length, 'answer': f'odpowiedź {i} ' + 'y' * length}
+
+
+def turn_tokens(entry):
+    return count_tokens(entry['query']) + count_tokens(entry['answer']) + 2 * TOKENS_PER_MESSAGE
+
+
+def test_context_is_packed_best_score_first():
+    low, high = chunk(1, 0.80), chunk(2, 0.90)
+    builder = PromptBuilder(context_budget=10_000, score_margin=1)
+    context, tokens, used = builder.select_context([low, high])
+    assert context == format_result(high) + format_result(low)
+    assert (tokens, used) == (tokens_of(low, high), 2)
+
+
+def test_chunks_below_score_margin_are_dropped():
+    builder = PromptBuilder(context_budget=10_000, score_margin=0.05)
+    _, _, used = builder.select_context([chunk(1, 0.90), chunk(2, 0.86), chunk(3, 0.80)])
+    assert used == 2
+
+
+def test_duplicate_content_is_used_once():
+    builder = PromptBuilder(context_budget=10_000, score_margin=1)
+    duplicate = chunk(2, 0.85, content='  treść   FRAGMENTU 1. ')
+    _, _, used = builder.select_context([chunk(1, 0.90, content='Treść fragmentu 1.'), duplicate])
+    assert used == 1
+
+
+def test_oversized_chunk_is_skipped_and_smaller_ones_still_fit():
+    best, large, small = chunk(1, 0.90), chunk(2, 0.89, content='słowo ' * 200), chunk(3, 0.88)
+    builder = PromptBuilder(context_budget=tokens_of(best, small), score_margin=1)
+    context, tokens, used = builder.select_context([best, large, small])
+    assert context == format_result(best) + format_result(small)
+    assert (tokens, used) == (tokens_of(best, small), 2)
+
+
+def test_fused_results_keep_their_order_and_ignore_score_margin():
+    keyword_only = chunk(1, fusedScore=0.03)
+    vector = chunk(2, 0.90, fusedScore=0.02)
+    weak = chunk(3, 0.10, fusedScore=0.01)
+    builder = PromptBuilder(context_budget=10_000, score_margin=0.05)
+    context, _, used = builder.select_context([keyword_only, vector, weak])
+    assert used == 3
+    assert context.index('Dokument 1') < context.index('Dokument 2') < context.index('Dokument 3')
+
+
+def test_empty_results_give_empty_context():
+    assert PromptBuilder().select_context([]) == ('', 0, 0)
+
+
+def test_history_budget_drops_the_oldest_turns():
+    history = [turn(3), turn(2), turn(1)]  # najnowsze pierwsze, jak z MySQL
+    builder = PromptBuilder(history_budget=turn_tokens(history[0]) + turn_tokens(history[1]))
+    selected, tokens = builder.select_history(history)
+    assert selected == history[:2]
+    assert tokens == builder.history_budget
+
+
+def test_history_stops_at_first_turn_over_budget():
+    history = [turn(2), turn(1, length=2000), turn(0)]
+    builder = PromptBuilder(history_budget=turn_tokens(history[0]) + turn_tokens(history[2]))
+    selected, _ = builder.select_history(history)
+    assert selected == history[:1]
+
+
+def test_missing_history_is_empty():
+    assert PromptBuilder().select_history(None) == ([], 0)
@@ -0,0 +1,152 @@
+import asyncio
+import numpy as np
+from src.ai import semantic_cache
+from src.ai.semantic_cache import SemanticCache
+
+QUESTION = np.array([1.0, 0.0, 0.0])
+SIMILAR = np.array([0.99, 0.1, 0.0])
+OTHER = np.array([0.0, 1.0, 0.0])
+
+
+def make_cache(**kwargs):
+    options = {'threshold': 0.95, 'max_size': 4, 'ttl': 60, 'shared': False}
+    options.update(kwargs)
+    return SemanticCache(**options)
+
+
+def test_similar_question_hits():
+    cache = make_cache()
+    cache.store('Jakie są godziny otwarcia?', QUESTION, 'Od 8 do 16.')
+    assert cache.lookup(SIMILAR) == 'Od 8 do 16.'
+    assert cache.lookup(OTHER) is None
+    stats = cache.stats()
+    assert (stats['size'], stats['hits'], stats['misses']) == (1, 1, 1)
+
+
+def test_empty_cache_misses():
+    cache = make_cache()
+    assert cache.lookup(QUESTION) is None
+
+
+def test_expired_answer_is_not_served():
+    cache = make_cache(ttl=60)
+    cache.store('q', QUESTION, 'a')
+    cache.expires_at -= 61
+    assert cache.lookup(QUESTION) is None
+    assert cache.stats()['size'] == 0
+
+
+def test_expired_slot_is_reused():
+    cache = make_cache(max_size=2)
+    cache.store('q1', QUESTION, 'a1')
+    cache.store('q2', OTHER, 'a2')
+    cache.expires_at[0] = 0
+    cache.store('q3', np.array([0.0, 0.0, 1.0]), 'a3')
+    assert cache.questions == ['q3', 'q2']
+
+
+def test_least_recently_used_answer_is_evicted_when_full():
+    cache = make_cache(max_size=2)
+    cache.store('q1', QUESTION, 'a1')
+    cache.store('q2', OTHER, 'a2')
+    cache.last_used[1] -= 10
+    cache.store('q3', np.array([0.0, 0.0, 1.0]), 'a3')
+    assert cache.lookup(QUESTION) == 'a1'
+    assert cache.lookup(OTHER) is None
+
+
+def test_invalidate_drops_every_answer():
+    cache = make_cache()
+    cache.store('q1', QUESTION, 'a1')
+    cache.store('q2', OTHER, 'a2')
+    cache.invalidate(reason='test')
+    assert cache.lookup(QUESTION) is None
+    assert cache.lookup(OTHER) is None
+    assert cache.stats()['size'] == 0
+
+
+def test_disabled_cache_stores_nothing():
+    cache = make_cache(max_size=0)
+    cache.store('q', QUESTION, 'a')
+    assert cache.lookup(QUESTION) is None
+
+
+def fake_generations(monkeypatch, values):
+    """Makes `fetch_cache_generation` return consecutive `values` (None = MySQL unavailable)."""
+    values = iter(values)
+
+    async def fetch(name):
+        return next(values)
+
+    monkeypatch.setattr(semantic_cache, 'fetch_cache_generation', fetch)
+
+
+def test_shared_cache_serves_nothing_before_first_sync(monkeypatch):
+    fake_generations(monkeypatch, [1])
+    cache = make_cache(shared=True, sync_interval=0)
+    cache.store('q', QUESTION, 'a')
+    assert cache.lookup(QUESTION) is None
+
+    assert asyncio.run(cache.sync())
+    cache.store('q', QUESTION, 'a')
+    assert cache.lookup(QUESTION) == 'a'
+
+
+def test_generation_change_invalidates_local_copy(monkeypatch):
+    fake_generations(monkeypatch, [1, 1, 2])
+    cache = make_cache(shared=True, sync_interval=0)
+    asyncio.run(cache.sync())
+    cache.store('q', QUESTION, 'a')
+
+    asyncio.run(cache.sync())
+    assert cache.lookup(QUESTION) == 'a'
+
+    asyncio.run(cache.sync())
+    assert cache.generation == 2
+    assert cache.lookup(QUESTION) is None
+
+
+def test_unreadable_generation_stops_serving(monkeypatch):
+    fake_generations(monkeypatch, [1, None])
+    cache = make_cache(shared=True, sync_interval=0)
+    asyncio.run(cache.sync())
+    cache.store('q', QUESTION, 'a')
+
+    assert not asyncio.run(cache.sync())
+    assert cache.lookup(QUESTION) is None
+
+
+def test_sync_is_rate_limited(monkeypatch):
+    fake_generations(monkeypatch, [1])
+    cache = make_cache(shared=True, sync_interval=60)
+    assert asyncio.run(cache.sync())
+    # Drugie wywołanie w oknie sync_interval nie pyta MySQL (iterator jest już pusty)
+    assert asyncio.run(cache.sync())
+
+
+def test_invalidate_everywhere_bumps_generation(monkeypatch):
+    bumped = []
+
+    async def bump(name):
+        bumped.append(name)
+        return 7
+
+    monkeypatch.setattr(semantic_cache, 'bump_cache_generation', bump)
+    cache = make_cache(shared=True)
+    cache.in_sync = True
+    cache.store('q', QUESTION, 'a')
+    asyncio.run(cache.invalidate_everywhere('test'))
+    assert bumped == [semantic_cache.GENERATION_NAME]
+    assert cache.generation == 7
+    assert cache.lookup(QUESTION) is None
+
+
+def test_use_local_serves_without_mysql():
+    cache = make_cache(shared=True)
+    cache.store('q', QUESTION, 'a')
+    assert cache.lookup(QUESTION) is None
+
+    cache.use_local('test')
+    assert asyncio.run(cache.sync())
+    cache.store('q', QUESTION, 'a')
+    assert cache.lookup(QUESTION) == 'a'
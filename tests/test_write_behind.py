@@ -0,0 +1,156 @@
+import asyncio
+import json
+import os
+from src.database.write_behind import QueryLogWriter, MAX_REPLAY_FAILURES
+
+
+class FakeMySQL:
+    """Flush callback that records written queries; `down` fails every write, `poison` fails rows by query."""
+
+    def __init__(self, poison=()):
+        self.written = []
+        self.batches = []
+        self.down = False
+        self.poison = set(poison)
+
+    async def flush(self, rows):
+        if self.down or any(row['query'] in self.poison for row in rows):
+            return None
+        self.batches.append(len(rows))
+        self.written.extend(row['query'] for row in rows)
+        return True
+
+
+def make_writer(mysql, tmp_path, **kwargs):
+    options = {'batch_size': 3, 'flush_interval': 0.01, 'max_pending': 100,
+               'spill_path': str(tmp_path / 'spill.jsonl')}
+    options.update(kwargs)
+    return QueryLogWriter(mysql.flush, **options)
+
+
+def row(query):
+    return json.dumps({'whatsapp_number_id': 1, 'query': query, 'answer': 'a', 'submitted_at': 0})
+
+
+def write_spill(writer, lines):
+    with open(writer.spill_path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def read_lines(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as f:
+        return [line for line in f.read().splitlines() if line]
+
+
+def spilled_queries(path):
+    return [json.loads(line)['query'] for line in read_lines(path)]
+
+
+def restart(writer):
+    async def main():
+        await writer.start()
+        await writer.close()
+
+    asyncio.run(main())
+
+
+def test_rows_are_written_in_batches(tmp_path):
+    mysql = FakeMySQL()
+    writer = make_writer(mysql, tmp_path)
+
+    async def main():
+        await writer.start()
+        for i in range(7):
+            await writer.submit(1, f'q{i}', 'a')
+        await writer.close()
+
+    asyncio.run(main())
+    assert mysql.written == [f'q{i}' for i in range(7)]
+    assert mysql.batches == [3, 3, 1]
+    assert not os.path.exists(writer.spill_path)
+
+
+def test_failed_flush_spills_and_is_replayed_on_start(tmp_path):
+    mysql = FakeMySQL()
+    mysql.down = True
+    writer = make_writer(mysql, tmp_path)
+
+    async def main():
+        await writer.start()
+        await writer.submit(1, 'q1', 'a')
+        await writer.close()
+
+    asyncio.run(main())
+    assert spilled_queries(writer.spill_path) == ['q1']
+
+    mysql.down = False
+    restart(writer)
+    assert mysql.written == ['q1']
+    assert read_lines(writer.spill_path) == []
+
+
+def test_full_queue_and_stopped_writer_spill_to_disk(tmp_path):
+    mysql = FakeMySQL()
+    writer = make_writer(mysql, tmp_path, max_pending=1)
+
+    async def main():
+        await writer.submit(1, 'before start', 'a')
+        writer.queue = asyncio.Queue(maxsize=1)
+        await writer.submit(1, 'queued', 'a')
+        await writer.submit(1, 'overflow', 'a')
+
+    asyncio.run(main())
+    assert spilled_queries(writer.spill_path) == ['before start', 'overflow']
+
+
+def test_unparsable_lines_are_quarantined(tmp_path):
+    mysql = FakeMySQL()
+    writer = make_writer(mysql, tmp_path)
+    write_spill(writer, [row('q1'), '{"whatsapp_number_id": 1, "que', '[1, 2]', row('q2')])
+
+    restart(writer)
+    assert mysql.written == ['q1', 'q2']
+    assert read_lines(writer.quarantine_path) == ['{"whatsapp_number_id": 1, "que', '[1, 2]']
+    assert not os.path.exists(f'{writer.spill_path}.replaying')
+
+
+def test_failing_row_is_quarantined_after_max_replays(tmp_path):
+    mysql = FakeMySQL(poison={'bad'})
+    writer = make_writer(mysql, tmp_path)
+    write_spill(writer, [row('q1'), row('bad'), row('q2'), row('q3')])
+
+    restart(writer)
+    assert mysql.written == ['q1', 'q2', 'q3']
+    assert spilled_queries(writer.spill_path) == ['bad']
+
+    for _ in range(MAX_REPLAY_FAILURES - 1):
+        restart(writer)
+    assert read_lines(writer.spill_path) == []
+    quarantined = [json.loads(line) for line in read_lines(writer.quarantine_path)]
+    assert [(entry['query'], entry['replay_failures']) for entry in quarantined] == [('bad', MAX_REPLAY_FAILURES)]
+    assert mysql.written == ['q1', 'q2', 'q3']
+
+
+def test_replay_with_mysql_down_keeps_rows_unchanged(tmp_path):
+    mysql = FakeMySQL()
+    mysql.down = True
+    writer = make_writer(mysql, tmp_path)
+    lines = [row(f'q{i}') for i in range(7)]
+    write_spill(writer, lines)
+
+    restart(writer)
+    assert read_lines(writer.spill_path) == lines
+    assert read_lines(writer.quarantine_path) == []
+
+
+def test_interrupted_replay_is_resumed(tmp_path):
+    mysql = FakeMySQL()
+    writer = make_writer(mysql, tmp_path)
+    with open(f'{writer.spill_path}.replaying', 'w', encoding='utf-8') as f:
+        f.write(row('q1') + '\n')
+
+    restart(writer)
+    assert mysql.written == ['q1']
+    assert not os.path.exists(f'{writer.spill_path}.replaying')